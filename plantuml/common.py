@@ -98,7 +98,11 @@ def get_default_color_style(obj_type: str):
     return fill, stroke, stroke_width, font_weight, text_color
 
 def get_obj_prop(obj, prop, default=0):
-    if isinstance(obj, pt.PlantumlType) and prop in obj.metadata_dict:
+    if isinstance(obj, pt.PlantumlType) and prop in pt.LAYOUT_FIELDS:
+        res = getattr(obj.layout, pt.LAYOUT_FIELDS[prop])
+        if res is not None:
+            return res
+    elif isinstance(obj, pt.PlantumlType) and prop in obj.metadata_dict:
         res = obj.metadata_dict[prop]
         if res is not None:
             return res
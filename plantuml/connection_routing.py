@@ -6,8 +6,14 @@ from pprint import pprint
 import plantuml.plantuml_types as pt
 import plantuml.connection_state_manager as csm
 import plantuml.common as c
+import plantuml.spatial_index as si
+import plantuml.geometry as geo
+import plantuml.routing_trace as trace
+import plantuml.road_graph as rg
+from plantuml.interval_set import IntervalSet
 import inspect
 import math
+import time
 from enum import Enum
 
 
@@ -39,28 +45,34 @@ def print_html_comment_indent(text, indent = 0):
 
 def print_obj_abs_pos_dim(arch: pt.PlantumlArchitecture, obj: pt.PlantumlType, indent = 0):
     x1, y1 = get_absolute_pos(arch, obj)
-    print_html_comment_indent(f'  {obj.name} ({x1}, {y1}) ({c.get_obj_prop(obj, "rect_x_len", None)}, {c.get_obj_prop(obj, "rect_y_len", None)})', indent)
+    print_html_comment_indent(f'  {obj.name} ({x1}, {y1}) ({obj.layout.x_len}, {obj.layout.y_len})', indent)
 
 def get_absolute_pos(arch, obj):
     """
     Returns the absolute coordinates x and y of obj in the architecture (Left, Top), if valid. Otherwise returns None, None.
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
+    rects = arch.get_absolute_rects()
+    if rects is not None and obj in rects:
+        rect = rects[obj]
+        if rect is None:
+            return None, None
+        return rect[0], rect[1]
+
     owner_tree = arch.get_owner_tree(obj)
     abs_x = 0
     abs_y = 0
     for index, item in enumerate(owner_tree):
-        # print_html_comment_indent(f"{index}: {item.name}, pos=({c.get_obj_prop(item, 'rect_x_pos', 0)},{c.get_obj_prop(item, 'rect_y_pos', 0)})", 2)
+        # print_html_comment_indent(f"{index}: {item.name}, pos=({item.layout.x_pos},{item.layout.y_pos})", 2)
         #The last element will be assumed as 0, 0, not None, None
-        dx = c.get_obj_prop(item, 'rect_x_pos', 0)
-        dy = c.get_obj_prop(item, 'rect_y_pos', 0)
-        if dx == None or dy == None:
-            return None, None
-        abs_x += dx
-        abs_y += dy
+        layout = item.layout
+        if layout.x_pos is not None:
+            abs_x += layout.x_pos
+        if layout.y_pos is not None:
+            abs_y += layout.y_pos
     
-    dx = c.get_obj_prop(obj, 'rect_x_pos', None)
-    dy = c.get_obj_prop(obj, 'rect_y_pos', None)
+    dx = obj.layout.x_pos
+    dy = obj.layout.y_pos
     if dx == None or dy == None:
         return None, None
     abs_x += dx
@@ -73,8 +85,8 @@ def get_absolute_center(arch, obj):
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
     abs_x, abs_y = get_absolute_pos(arch, obj)
-    dx = c.get_obj_prop(obj, 'rect_x_len', None)
-    dy = c.get_obj_prop(obj, 'rect_y_len', None)
+    dx = obj.layout.x_len
+    dy = obj.layout.y_len
     if abs_x == None or abs_y == None or dx == None or dy == None:
         return None, None
     abs_x += dx/2
@@ -82,14 +94,30 @@ def get_absolute_center(arch, obj):
 
     return abs_x, abs_y
 
+def get_absolute_rect(arch, obj):
+    """
+    Returns the absolute rectangle (x1, y1, x2, y2) of obj in the architecture without rounding, or None if the position or the size is not valid.
+    """
+    x1, y1 = get_absolute_pos(arch, obj)
+    if x1 is None or y1 is None or obj.layout.x_len is None or obj.layout.y_len is None:
+        return None
+    return (x1, y1, x1 + obj.layout.x_len, y1 + obj.layout.y_len)
+
 def get_absolute_coordinates(arch, obj):
     """
     Returns the absolute coordinates x1, y1, x2 and y2 of the obj in the architecture. If a coordinate could not be found, it return None for all coordinates (e.g. None, None, None, None). 
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
+    rects = arch.get_absolute_rects()
+    if rects is not None and obj in rects:
+        rect = rects[obj]
+        if rect is not None and rect[2] is not None:
+            return int(rect[0]), int(rect[1]), int(rect[2]), int(rect[3])
+        return None, None, None, None
+
     x1, y1 = get_absolute_pos(arch, obj)
-    dx = c.get_obj_prop(obj, "rect_x_len", None)
-    dy = c.get_obj_prop(obj, "rect_y_len", None)
+    dx = obj.layout.x_len
+    dy = obj.layout.y_len
 
     if x1 is not None and y1 is not None and dx is not None and dy is not None: 
         x2 = x1 + dx
@@ -99,34 +127,10 @@ def get_absolute_coordinates(arch, obj):
 
 def subtract_ranges(reference: tuple[int, int], exclusions: list[tuple[int, int]]) -> list[tuple[int, int]]:
     # The result is a list of ranges that are left from the reference range that are not overlapped by the individual exclusion ranges
-    x1, x2 = reference
-    result = [(x1, x2)]
-
-    for ex1, ex2 in exclusions:
-        new_result = []
-        for r1, r2 in result:
-            # Adjust exclusion range to be within the bounds of the current reference range
-            adjusted_ex1 = max(r1, ex1)
-            adjusted_ex2 = min(r2, ex2)
-
-            # If the exclusion range does not overlap with the current range, keep the current range
-            if adjusted_ex2 <= r1 or adjusted_ex1 >= r2:
-                new_result.append((r1, r2))
-            else:
-                # If the exclusion range overlaps, adjust the range by cutting out the overlap
-                if adjusted_ex1 > r1:
-                    new_result.append((r1, adjusted_ex1))
-                if adjusted_ex2 < r2:
-                    new_result.append((adjusted_ex2, r2))
-        result = new_result
-
-    return result
+    return geo.subtract_ranges(reference, exclusions)
 
 def normalize_vector(v):
-    magnitude = math.sqrt(v[0]**2 + v[1]**2)
-    if magnitude == 0:
-        return (0, 0)
-    return (v[0] / magnitude, v[1] / magnitude)
+    return geo.normalize_vector(v)
     
 def find_rect_border_intersection(x0: int, y0: int, width: int, height: int, dx: int, dy: int) -> tuple[int, int]:
     """
@@ -140,57 +144,7 @@ def find_rect_border_intersection(x0: int, y0: int, width: int, height: int, dx:
     dy: vertical directio of the vector in the center of the rectangle.
     return: a tuple with coordinates (x, y) on the border of the retangle.
     """
-    # print_html_comment_indent(f"    find_rect_border_intersection pos=({x0},{y0}) dim=({width},{height}) dir=({dx},{dy})")
-    # Calculate the center of the rectangle
-    xc = x0 + width / 2
-    yc = y0 + height / 2
-    
-    # Normalize the direction vector
-    magnitude = math.sqrt(dx**2 + dy**2)
-    dx_norm = dx / magnitude
-    dy_norm = dy / magnitude
-    
-    tan_rect = height / width # always positive
-    
-    if dx_norm != 0:  # Avoid division by zero    
-        tg_vec = dy_norm/dx_norm
-        
-        if abs(tg_vec) <= tan_rect: #It is left or right intersection
-            if dx < 0: # It is a left intersection
-                # print_html_comment_indent("         1")
-                t_left = (x0 - xc) / dx_norm
-                y_left = yc + t_left * dy_norm
-                return (x0, y_left)
-            
-            else: # It is a right intersection
-                # print_html_comment_indent("         2")
-                t_right = (x0 + width - xc) / dx_norm
-                y_right = yc + t_right * dy_norm
-                return (x0 + width, y_right)
-                
-        
-        else: # Else the intersection is top or bottom
-            if dy > 0: # It is a bottom intersection
-                # print_html_comment_indent("         3")
-                t_bottom = (y0 + height - yc) / dy_norm
-                x_bottom = xc + t_bottom * dx_norm
-                return (x_bottom, y0 + height)
-
-
-            else: # It is a top intersection
-
-                # print_html_comment_indent("         4")
-                t_top = (y0 - yc) / dy_norm
-                x_top = xc + t_top * dx_norm
-                return (x_top, y0)
-
-    else:
-        # print_html_comment_indent("         5")
-
-        if dy > 0: # It is a bottom intersection
-            return (x0 + width/2, y0 + height)
-        else: # It is a top intersection
-            return (x0 + width/2, 0)
+    return geo.get_border_port((x0, y0, x0 + width, y0 + height), (dx, dy))[1]
 
 def are_components_in_same_row(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, indent=0) -> bool:
     """
@@ -200,18 +154,10 @@ def are_components_in_same_row(arch: pt.PlantumlArchitecture, comp1: pt.Plantuml
     comp2: is the second component to verified.
     """
     
-    x1, y1 = get_absolute_pos(arch, comp1)
-    x2, y2 = get_absolute_pos(arch, comp2)
-    
-    res = False
-    if y1 < y2:
-        if  (y1 + c.get_obj_prop(comp1, "rect_y_len")) >= y2:
-            res = True
-    else:
-        if  (y2 + c.get_obj_prop(comp2, "rect_y_len")) >= y1:
-            res = True
+    res = geo.are_rects_in_same_row(get_absolute_rect(arch, comp1), get_absolute_rect(arch, comp2))
 
-    print_html_comment_indent(f"    {res}\t= are_components_in_same_row: {comp1} and {comp2}", indent);
+    if trace.enabled:
+        trace.event("are_components_in_same_row", res, comp1=comp1, comp2=comp2)
     return res
 
 def are_components_in_same_column(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, indent=0) -> bool:
@@ -222,21 +168,13 @@ def are_components_in_same_column(arch: pt.PlantumlArchitecture, comp1: pt.Plant
     comp2: is the second component to verified.
     """
     
-    x1, y1 = get_absolute_pos(arch, comp1)
-    x2, y2 = get_absolute_pos(arch, comp2)
-    
     # print_obj_abs_pos_dim(arch, comp1)
     # print_obj_abs_pos_dim(arch, comp2)
     
-    res = False
-    if x1 < x2:
-        if  (x1 + c.get_obj_prop(comp1, "rect_x_len")) >= x2:
-            res = True
-    else:
-        if  (x2 + c.get_obj_prop(comp2, "rect_x_len")) >= x1:
-            res = True
+    res = geo.are_rects_in_same_column(get_absolute_rect(arch, comp1), get_absolute_rect(arch, comp2))
 
-    print_html_comment_indent(f"    {res}\t= are_components_in_same_column: {comp1} and {comp2}", indent);
+    if trace.enabled:
+        trace.event("are_components_in_same_column", res, comp1=comp1, comp2=comp2)
     return res
 
 def get_vertical_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, indent=0)-> tuple[int, int]:
@@ -251,8 +189,8 @@ def get_vertical_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlTy
     if are_components_in_same_row(arch, comp1, comp2, indent+1): # If they overlap
         L1_x1, L1_y1 = get_absolute_pos(arch, comp1)
         L2_x1, L2_y1 = get_absolute_pos(arch, comp2)
-        L1_y2 = L1_y1 + c.get_obj_prop(comp1, "rect_y_len")
-        L2_y2 = L2_y1 + c.get_obj_prop(comp2, "rect_y_len")
+        L1_y2 = L1_y1 + comp1.layout.y_len
+        L2_y2 = L2_y1 + comp2.layout.y_len
 
         # Calculate the start and end of the overlap
         overlap_y1 = max(L1_y1, L2_y1)
@@ -260,7 +198,8 @@ def get_vertical_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlTy
         
         res = (overlap_y1, overlap_y2)
 
-    print_html_comment_indent(f"    {res}\t= get_vertical_overlapping: {comp1} and {comp2}", indent);
+    if trace.enabled:
+        trace.event("get_vertical_overlapping", res, comp1=comp1, comp2=comp2)
     return res
 
 def get_horizontal_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, indent=0) -> tuple[int, int]:
@@ -275,8 +214,8 @@ def get_horizontal_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.Plantuml
     if are_components_in_same_column(arch, comp1, comp2, indent+1):
         L1_x1, L1_y1 = get_absolute_pos(arch, comp1)
         L2_x1, L2_y1 = get_absolute_pos(arch, comp2)
-        L1_x2 = L1_x1 + c.get_obj_prop(comp1, "rect_x_len")
-        L2_x2 = L2_x1 + c.get_obj_prop(comp2, "rect_x_len")
+        L1_x2 = L1_x1 + comp1.layout.x_len
+        L2_x2 = L2_x1 + comp2.layout.x_len
 
         # Calculate the start and end of the overlap
         overlap_x1 = max(L1_x1, L2_x1)
@@ -284,7 +223,8 @@ def get_horizontal_overlapping(arch: pt.PlantumlArchitecture, comp1: pt.Plantuml
         
         res = (overlap_x1, overlap_x2)
 
-    print_html_comment_indent(f"    {res}\t= get_horizontal_overlapping: {comp1} and {comp2}", indent);
+    if trace.enabled:
+        trace.event("get_horizontal_overlapping", res, comp1=comp1, comp2=comp2)
     return res
 
 def is_there_other_component_between(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, dir_type: DirType, component_type: pt.PlantumlType = pt.PlantumlContainer, indent=0) -> bool:
@@ -311,13 +251,11 @@ def is_there_other_component_between(arch: pt.PlantumlArchitecture, comp1: pt.Pl
         if dist[0] > 0: # component is at right
             coord = (comp1_x2, avrg_y)
             dist_next_comp = get_distance_to_next_component(arch, coord, Dir.RIGHT, component_type, indent+1)
-            print_html_comment_indent(f"    -> Ccomponent is at right, dist_next_comp={dist_next_comp}", indent+1)
             if dist_next_comp < dist[0]:
                 res = True
         else: # component is at left
             coord = (comp1_x1, avrg_y)
             dist_next_comp = get_distance_to_next_component(arch, coord, Dir.LEFT, component_type, indent+1)
-            print_html_comment_indent(f"    -> Ccomponent is at left, dist_next_comp={dist_next_comp}", indent+1)
             if dist_next_comp > dist[0]:
                 res = True
     
@@ -326,20 +264,19 @@ def is_there_other_component_between(arch: pt.PlantumlArchitecture, comp1: pt.Pl
         if dist[1] > 0: # component is below
             coord = (avr_x, comp1_y2)
             dist_next_comp = get_distance_to_next_component(arch, coord, Dir.DOWN, component_type, indent+1)
-            print_html_comment_indent(f"    --> Ccomponent is below, dist_next_comp={dist_next_comp}", indent+1)
             if dist_next_comp < dist[1]:
                 res = True
         else: # component is above
             coord = (avr_x, comp1_y1)
             dist_next_comp = get_distance_to_next_component(arch, coord, Dir.UP, component_type, indent+1)
-            print_html_comment_indent(f"    --> Ccomponent is above, dist_next_comp={dist_next_comp}", indent+1)
             if dist_next_comp > dist[1]:
                 res = True
     
     # get_distance_to_next_component(arch, coord, dir, component_type, indent)
     # get_distance_to_component(arch, comp1, comp2, indent) 
 
-    print_html_comment_indent(f"    {res}\t= is_there_other_component_between: {comp1.name} and {comp2.name} dir_type={dir_type}", indent);
+    if trace.enabled:
+        trace.event("is_there_other_component_between", res, comp1=comp1, comp2=comp2, dir_type=dir_type, component_type=component_type)
     return res
 
 def is_there_activity_between(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, dir_type: DirType, indent=0) -> bool:
@@ -356,7 +293,8 @@ def is_there_activity_between(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlT
     """
     res = is_there_other_component_between(arch, comp1, comp2, dir_type, pt.PlantumlActivity, indent+1)
 
-    print_html_comment_indent(f"    {res}\t= is_there_activity_between: {comp1.name} and {comp2.name} dir_type={dir_type}", indent);
+    if trace.enabled:
+        trace.event("is_there_activity_between", res, comp1=comp1, comp2=comp2, dir_type=dir_type)
     return res
 
 def get_distance_to_component(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlType, comp2: pt.PlantumlType, indent=0) -> tuple[int, int]:
@@ -367,29 +305,9 @@ def get_distance_to_component(arch: pt.PlantumlArchitecture, comp1: pt.PlantumlT
     comp2: is the second component to verified.
     return: tuple with the absolute distance vector (dx, dy). The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
-
-    comp1_x1, comp1_y1, comp1_x2, comp1_y2 = get_absolute_coordinates(arch, comp1)
-    comp2_x1, comp2_y1, comp2_x2, comp2_y2 = get_absolute_coordinates(arch, comp2)
-    
-    print_obj_abs_pos_dim(arch, comp1, indent+1)
-    print_obj_abs_pos_dim(arch, comp2, indent+1)
-    
-    # discover horizontal direction
-    dx = 0
-    if comp2_x2 < comp1_x1:
-        dx = comp2_x2 - comp1_x1
-    elif comp2_x1 > comp1_x2:
-        dx = comp2_x1 - comp1_x2
-
-    # discover vertical direction
-    dy = 0
-    if comp2_y2 < comp1_y1:
-        dy = comp2_y2 - comp1_y1
-    elif comp2_y1 > comp1_y2:
-        dy = comp2_y1 - comp1_y2
-
-    res = (dx, dy)
-    print_html_comment_indent(f"    {res}\t= get_distance_to_component: {comp1.name} and {comp2.name}", indent);
+    res = geo.get_rect_distance(get_absolute_coordinates(arch, comp1), get_absolute_coordinates(arch, comp2))
+    if trace.enabled:
+        trace.event("get_distance_to_component", res, comp1=comp1, comp2=comp2)
     return res
 
 def is_component_in_the_path(arch: pt.PlantumlArchitecture, obj: pt.PlantumlType, coord: tuple[int, int], dir: Dir, indent=0) -> bool:
@@ -404,41 +322,14 @@ def is_component_in_the_path(arch: pt.PlantumlArchitecture, obj: pt.PlantumlType
     
     return: a PlantumlType object or None.
     """
-    coord_overlapp = lambda coord, v1, v2: v1 <= coord <= v2
-    # def coord_overlapp(coord, v1, v2):
-        # # Returns True if coord is between v1 and v2
-        # if v1 <= coord <= v2:
-            # return True
-        # return False
-    
     res = False
     x1, y1, x2, y2 = get_absolute_coordinates(arch, obj)
     
     if x1 is not None and y1 is not None and x2 is not None and y2 is not None: 
-
-        if dir == Dir.RIGHT:
-            # print_with_indent(f"          RIGHT");
-            if coord_overlapp(coord[1], y1, y2) and x1 > coord[0]:
-                # print_with_indent(f"            OK");
-                res = True
-        elif dir == Dir.LEFT:
-            # print_with_indent(f"          LEFT");
-            if coord_overlapp(coord[1], y1, y2) and x2 < coord[0]:
-                # print_with_indent(f"            OK");
-                res = True
-        elif dir == Dir.DOWN:
-            # print_with_indent(f"          DOWN");
-            if coord_overlapp(coord[0], x1, x2) and y1 > coord[1]:
-                # print_with_indent(f"            OK");
-                res = True
-        else: #dir == Dir.UP:
-            # print_with_indent(f"          UP");
-            if coord_overlapp(coord[0], x1, x2) and y2 < coord[1]:
-                # print_with_indent(f"            OK");
-                res = True
+        res = geo.is_rect_in_the_path((x1, y1, x2, y2), coord, dir)
     
-    if res == True:
-        print_html_comment_indent(f"        {res}\t= is_component_in_the_path: {obj.name} {coord}, dir={dir}, obj coord = {x1}, {y1}, {x2}, {y2}", indent);
+    if res == True and trace.enabled:
+        trace.event("is_component_in_the_path", res, obj=obj, coord=coord, dir=dir, rect=(x1, y1, x2, y2))
     return res
 
 def get_components_in_the_path(arch: pt.PlantumlArchitecture, coord: tuple[int, int], dir: Dir, component_type: pt.PlantumlType = pt.PlantumlContainer, indent=0) -> list[pt.PlantumlType]:
@@ -453,19 +344,27 @@ def get_components_in_the_path(arch: pt.PlantumlArchitecture, coord: tuple[int,
     
     return: a list lantumlType objects or empty.
     """
+    index = si.get_spatial_index(arch, component_type)
+    if index is not None:
+        res = index.get_components_in_the_path(coord, dir)
+        if trace.enabled:
+            trace.event("get_components_in_the_path", res, coord=coord, dir=dir, component_type=component_type)
+        return res
+
+    # The layout was not done, so there is no spatial index: search the tree
     res = []
     def recurrent(arch, obj, coord, dir, component_type, valid_componnents):
-        for name, value in inspect.getmembers(obj):
-            if not inspect.isroutine(value) and not name.startswith('__'):
-                if isinstance(value, pt.PlantumlType) and value.is_visible():
-                    if isinstance(value, component_type) and is_component_in_the_path(arch, value, coord, dir, indent+1):
-                        valid_componnents.append(value)
-                        # return # Does not need to go deeper
-                    else:
-                        recurrent(arch, value, coord, dir, component_type, valid_componnents)
+        for value in obj.get_children():
+            if value.is_visible():
+                if isinstance(value, component_type) and is_component_in_the_path(arch, value, coord, dir, indent+1):
+                    valid_componnents.append(value)
+                    # return # Does not need to go deeper
+                else:
+                    recurrent(arch, value, coord, dir, component_type, valid_componnents)
 
     recurrent(arch, arch, coord, dir, component_type, res) # Start at root which is the arch itself
-    print_html_comment_indent(f"      {res}\t= get_components_in_the_path: {coord}, dir={dir}, component_type={component_type.__name__}", indent);
+    if trace.enabled:
+        trace.event("get_components_in_the_path", res, coord=coord, dir=dir, component_type=component_type)
     return res
 
 def get_components_rects_in_front(arch: pt.PlantumlArchitecture, src_coord: tuple[int, int, int, int], dst_coord: tuple[int, int, int, int], dir: Dir, component_type: pt.PlantumlType = pt.PlantumlContainer, indent=0)  -> list[tuple[int, int, int, int]]:
@@ -483,66 +382,35 @@ def get_components_rects_in_front(arch: pt.PlantumlArchitecture, src_coord: tupl
     """
     
     res = []
-    tmp = []
-    if dir == Dir.RIGHT:
-        init = int(src_coord[1])    # y1
-        end = int(src_coord[3]) +1  # y2
+    index = si.get_spatial_index(arch, component_type)
+    if index is None: # The layout was not done
+        return res
 
-        for offset in range(init, end, 20):
-            tmp += get_components_in_the_path(arch, (src_coord[2], offset), dir, component_type, indent+1)
-        tmp = list(set(tmp)) # Remove repetitions
-        
-        # Add to res only the ones in front
-        for comp in tmp:
-            c_x1, c_y1, c_x2, c_y2 = get_absolute_coordinates(arch, comp)
-            if c_x1 < dst_coord[0]:
-                res.append((c_x1, c_y1, c_x2, c_y2))
-            
+    # All the components whose projection intersects the source, closest first
+    if dir == Dir.RIGHT:
+        components = index.get_components_in_the_span((src_coord[1], src_coord[3]), src_coord[2], dir)
+        in_front = lambda rect: rect[0] < dst_coord[0]
     elif dir == Dir.LEFT:
-        init = int(src_coord[1])    # y1
-        end = int(src_coord[3]) +1  # y2
-
-        for offset in range(init, end, 20):
-            tmp += get_components_in_the_path(arch, (src_coord[0], offset), dir, component_type, indent+1)
-        tmp = list(set(tmp)) # Remove repetitions
-
-        # Add to res only the ones in front
-        for comp in tmp:
-            c_x1, c_y1, c_x2, c_y2 = get_absolute_coordinates(arch, comp)
-            if c_x2 > dst_coord[2]:
-                res.append((c_x1, c_y1, c_x2, c_y2))
-
+        components = index.get_components_in_the_span((src_coord[1], src_coord[3]), src_coord[0], dir)
+        in_front = lambda rect: rect[2] > dst_coord[2]
     elif dir == Dir.DOWN:
-        init = int(src_coord[0])    # x1
-        end = int(src_coord[2]) +1  # x2
+        components = index.get_components_in_the_span((src_coord[0], src_coord[2]), src_coord[3], dir)
+        in_front = lambda rect: rect[1] < dst_coord[1]
+    else: #dir == Dir.UP:
+        components = index.get_components_in_the_span((src_coord[0], src_coord[2]), src_coord[1], dir)
+        in_front = lambda rect: rect[3] > dst_coord[3]
 
-        for offset in range(init, end, 20):
-            tmp += get_components_in_the_path(arch, (offset, src_coord[3]), dir, component_type, indent+1)
-        tmp = list(set(tmp)) # Remove repetitions
-        
-        # Add to res only the ones in front
-        for comp in tmp:
-            c_x1, c_y1, c_x2, c_y2 = get_absolute_coordinates(arch, comp)
-            if c_y1 < dst_coord[1]:
-                res.append((c_x1, c_y1, c_x2, c_y2))
+    # Add to res only the ones in front
+    for comp in components:
+        rect = get_absolute_coordinates(arch, comp)
+        if not in_front(rect):
+            break # Sorted by distance, the next ones are not in front either
+        res.append(rect)
 
-    else: #dir == Dir.UP:
-        init = int(src_coord[0])   # x1
-        end = int(src_coord[2]) +1  # x2
-
-        for offset in range(init, end, 20):
-            tmp += get_components_in_the_path(arch, (offset, src_coord[1]), dir, component_type, indent+1)
-        tmp = list(set(tmp)) # Remove repetitions
-
-        # Add to res only the ones in front
-        for comp in tmp:
-            c_x1, c_y1, c_x2, c_y2 = get_absolute_coordinates(arch, comp)
-            if c_y2 > dst_coord[3]:
-                res.append((c_x1, c_y1, c_x2, c_y2))
-    
     # res = get_components_in_the_path(arch, coord, dir, component_type, indent+1)
     
-    print_html_comment_indent(f"      {res}\t= get_components_rects_in_front: from {src_coord} to {dst_coord}, dir={dir}, component_type={component_type.__name__}", indent);
+    if trace.enabled:
+        trace.event("get_components_rects_in_front", res, src_coord=src_coord, dst_coord=dst_coord, dir=dir, component_type=component_type)
     return res    
 
 def get_free_obstacle_ranges(arch: pt.PlantumlArchitecture, src_coord: tuple[int, int, int, int], dst_coord: tuple[int, int, int, int], dir: Dir, component_type: pt.PlantumlType = pt.PlantumlContainer, indent=0) -> list[tuple[int, int]]:
@@ -558,30 +426,22 @@ def get_free_obstacle_ranges(arch: pt.PlantumlArchitecture, src_coord: tuple[int
     
     return: a list of tuples with each range on the applicable direction, i.e. if dir is horizontal, ranges are vertical.
     """
-    res = []
     components_rects = get_components_rects_in_front(arch, src_coord, dst_coord, dir, component_type, indent+1)
 
-    exclusions = []
     if dir == Dir.RIGHT or dir == Dir.LEFT:
-        # Calculate the start and end of the overlap
-        overlap_y1 = max(src_coord[1], dst_coord[1])
-        overlap_y2 = min(src_coord[3], dst_coord[3])
-        src_range = (overlap_y1, overlap_y2) # ranges are y coords
-        
-        for comp_rect in components_rects:
-            exclusions.append((comp_rect[1], comp_rect[3]))
-        res = subtract_ranges(src_range, exclusions)
+        # Calculate the start and end of the overlap, ranges are y coords
+        overlap = (max(src_coord[1], dst_coord[1]), min(src_coord[3], dst_coord[3]))
+        exclusions = IntervalSet((comp_rect[1], comp_rect[3]) for comp_rect in components_rects)
 
     else: #dir == Dir.DOWN or dir == Dir.UP:
-        # Calculate the start and end of the overlap
-        overlap_x1 = max(src_coord[0], dst_coord[0])
-        overlap_x2 = min(src_coord[2], dst_coord[2])
-        src_range = (overlap_x1, overlap_x2) # ranges are x coords
-        for comp_rect in components_rects:
-            exclusions.append((comp_rect[0], comp_rect[2]))
-        res = subtract_ranges(src_range, exclusions)
-
-    print_html_comment_indent(f"      {res}\t= get_free_obstacle_ranges: from {src_coord} to {dst_coord}, dir={dir}, component_type={component_type.__name__}", indent);
+        # Calculate the start and end of the overlap, ranges are x coords
+        overlap = (max(src_coord[0], dst_coord[0]), min(src_coord[2], dst_coord[2]))
+        exclusions = IntervalSet((comp_rect[0], comp_rect[2]) for comp_rect in components_rects)
+
+    res = exclusions.gaps(overlap[0], overlap[1])
+
+    if trace.enabled:
+        trace.event("get_free_obstacle_ranges", res, src_coord=src_coord, dst_coord=dst_coord, dir=dir, component_type=component_type)
     return res    
 
 
@@ -624,7 +484,8 @@ def get_next_component(arch: pt.PlantumlArchitecture, coord: tuple[int, int], di
                 if ref < y2:
                     ref = y2
                     res = comp
-    print_html_comment_indent(f"      {res}\t= get_next_component: {coord}, dir={dir}, component_type={component_type.__name__}", indent);
+    if trace.enabled:
+        trace.event("get_next_component", res, coord=coord, dir=dir, component_type=component_type)
     return res
 
 def get_distance_to_next_component(arch: pt.PlantumlArchitecture, coord: tuple[int, int], dir: Dir, component_type: pt.PlantumlType = pt.PlantumlContainer, indent=0) -> int:
@@ -660,7 +521,8 @@ def get_distance_to_next_component(arch: pt.PlantumlArchitecture, coord: tuple[i
         else: #dir == Dir.UP:
             res = 0 - coord[1]
     
-    print_html_comment_indent(f"    {res}\t= get_distance_to_next_component: {coord}, dir={dir}, component_type={component_type.__name__}", indent);
+    if trace.enabled:
+        trace.event("get_distance_to_next_component", res, coord=coord, dir=dir, component_type=component_type)
     return res
 
 def test(arch: pt.PlantumlArchitecture, comp: list[pt.PlantumlType]):
@@ -796,7 +658,7 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
     The function uses different criteria for routing a connection:
         - Componnents with direct sight to other component (direct vertical or horizontral line of sight), then the connection is a straight line.
         - TODO: Components in the same row/column with direct sight to the are in front of another component, then the connection needs a 90 degree curve.
-        - Componnets locates inside other different componnets or far from each other, they uses the lanes for routing.
+        - Componnets locates inside other different componnets or far from each other, they uses the lanes for routing (the cheapest route in the road graph, see road_graph.route_with_roads).
     
     arch: The architecture fo the diagram.
     name: String with the name of the connection, to be print. 
@@ -807,8 +669,8 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
     return: A dictionary entry with the connection poly line where the key is the name of the connection.
     """
 
-    print_html_comment_indent(f"route_single_comonnection: {name} {comp1.name} {comp1.path}", indent) # false
-    print_html_comment_indent(f"                           {name} {comp2.name} {comp2.path}", indent) # false
+    if trace.enabled:
+        trace.event("route_single_comonnection", name=name, comp1=comp1, comp2=comp2)
     conn_points = []
 
     # if name != "Multiple Conn:0": # name != "Conn 3" and name != "Conn 5" and name != "Conn 6": # Turn others of for debugging
@@ -816,35 +678,31 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
 
 
     # Estimate direction
-    c1_x1, c1_y1, c1_x2, c1_y2 = get_absolute_coordinates(arch, comp1)
-    c2_x1, c2_y1, c2_x2, c2_y2 = get_absolute_coordinates(arch, comp2)
+    relation = highway_map.get("relations", {}).get((comp1, comp2))
+    if relation is not None: # Computed for all the connections by get_connection_relations
+        c1_x1, c1_y1, c1_x2, c1_y2 = relation["rect1"]
+        c2_x1, c2_y1, c2_x2, c2_y2 = relation["rect2"]
+        is_same_row, is_same_column = relation["same_row"], relation["same_column"]
+        horizontal_dir, vertical_dir = relation["horizontal_dir"], relation["vertical_dir"]
+    else:
+        c1_x1, c1_y1, c1_x2, c1_y2 = get_absolute_coordinates(arch, comp1)
+        c2_x1, c2_y1, c2_x2, c2_y2 = get_absolute_coordinates(arch, comp2)
+        is_same_row = are_components_in_same_row(arch, comp1, comp2, indent+1)
+        is_same_column = are_components_in_same_column(arch, comp1, comp2, indent+1)
+        horizontal_dir = Dir.RIGHT if c1_x2 < c2_x1 else Dir.LEFT
+        vertical_dir = Dir.DOWN if c1_y2 < c2_y1 else Dir.UP
     
-    # print(f" get_absolute_coordinates {c1_x1}, {c1_y1}, {c1_x2}, {c1_y2}")
-    # print(f" get_absolute_coordinates {c2_x1}, {c2_y1}, {c2_x2}, {c2_y2}")
-    
-    print_html_comment_indent(f"{comp1.name} {highway_map['addresses'][comp1.path]}", indent)
-    print_html_comment_indent(f"  pos = ({c1_x1}, {c1_y1}) ({c1_x2}, {c1_y2})", indent)
-    print_html_comment_indent(f"{comp2.name} {highway_map['addresses'][comp2.path]}", indent)
-    print_html_comment_indent(f"  pos = ({c2_x1}, {c2_y1}) ({c2_x2}, {c2_y2})", indent+1)
-    print_html_comment_indent(f"   dir vec = ({c2_x1-c1_x1}, {c2_y1-c1_y1})", indent)
-
-    dir_vec = normalize_vector((c2_x1-c1_x1, c2_y1-c1_y1))
-    print_html_comment_indent(f"   normalized dir vec = {dir_vec}", indent)
-
-    is_same_row = are_components_in_same_row(arch, comp1, comp2, indent+1)
-    is_same_column = are_components_in_same_column(arch, comp1, comp2, indent+1)
+    if trace.enabled:
+        trace.event("absolute coordinates", rect1=(c1_x1, c1_y1, c1_x2, c1_y2), rect2=(c2_x1, c2_y1, c2_x2, c2_y2))
     
     finished = False
     ############################
     # criterion 1: straight line
     if is_same_row:
-        if c1_x2 < c2_x1:
-            dir = Dir.RIGHT
-        else:
-            dir = Dir.LEFT
+        dir = horizontal_dir
         free_ranges = get_free_obstacle_ranges(arch, (c1_x1, c1_y1, c1_x2, c1_y2), (c2_x1, c2_y1, c2_x2, c2_y2), dir, pt.PlantumlActivity, indent+1)
 
-        if c1_x2 < c2_x1:
+        if dir == Dir.RIGHT:
             x1 = c1_x2
             x2 = c2_x1
         else: 
@@ -858,14 +716,10 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
             finished = True
 
     elif is_same_column:
-
-        if c1_y2 < c2_y1:
-            dir = Dir.DOWN
-        else:
-            dir = Dir.UP
+        dir = vertical_dir
         free_ranges = get_free_obstacle_ranges(arch, (c1_x1, c1_y1, c1_x2, c1_y2), (c2_x1, c2_y1, c2_x2, c2_y2), dir, pt.PlantumlActivity, indent+1)
         
-        if c1_y2 < c2_y1:
+        if dir == Dir.DOWN:
             y1 = c1_y2
             y2 = c2_y1
         else: 
@@ -899,63 +753,70 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
         range1 = get_rects_if_components_between_common_horizontal_lanes(highway_map, comp1, comp2, tree1, tree2, indent+1)
         range2 = get_rects_if_components_between_common_vertical_lanes(  highway_map, comp1, comp2, tree1, tree2, indent+1)
         if range1 != None:
-            print_html_comment_indent(f' Connection {name}: get_rects_if_components_between_common_horizontal_lanes TRUE ********************************************** {comp1.name} {comp2.name}', indent+1)
+            if trace.enabled:
+                trace.event("get_rects_if_components_between_common_horizontal_lanes", range1, comp1=comp1, comp2=comp2)
             # Give priority to go downwords or horizontally, to avoid passing over titles
-            if c1_x2 < c2_x1:
-                dir = Dir.RIGHT
-            else:
-                dir = Dir.LEFT
+            dir = horizontal_dir
 
             if c1_y2 < c2_y2: # Main criterion, comp1 goes down if comp2 side is free
-                print_html_comment_indent(f'comp1 goes down if comp2 side is free')
+                if trace.enabled:
+                    trace.event("criterion 2", goes_down=comp1)
                 free_ranges = get_free_obstacle_ranges(arch, (c1_x1, c1_y2, c1_x2, range1[1]), (c2_x1, c2_y1, c2_x2, c2_y2), dir, pt.PlantumlActivity, indent+1)
                 if len(free_ranges) > 0:
-                    x2 = c2_x1 if dir == Dir.RIGHT else c2_x2
-                    x = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.DOWN, [(c1_x1, c1_x2)])
-                    y = csm.allocate_an_address_on_border(highway_map, comp2.path, opposit(dir), free_ranges, [x ,None ,x2 ,None])
-                    if y != None and x != None: # and csm.is_free_offroad_horizontal_lane(highway_map, [x ,y ,x2 ,y]):
-                        road_points = [(x, c1_y2), (x, y), (x2, y)]
-
-                        csm.allocate_offroad_horizontal_lane(highway_map, [x ,y ,x2 ,y]) # also save this as an offroad lane, it has no road
-                        conn_points = road_points
-                        finished = True
+                    with highway_map.transaction() as savepoint: # The address of one end is released if the other end fails
+                        x2 = c2_x1 if dir == Dir.RIGHT else c2_x2
+                        x = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.DOWN, [(c1_x1, c1_x2)])
+                        y = csm.allocate_an_address_on_border(highway_map, comp2.path, opposit(dir), free_ranges, [x ,None ,x2 ,None]) if x != None else None # The other end only if the first one has an address
+                        if y != None and x != None: # and csm.is_free_offroad_horizontal_lane(highway_map, [x ,y ,x2 ,y]):
+                            road_points = [(x, c1_y2), (x, y), (x2, y)]
+
+                            csm.allocate_offroad_horizontal_lane(highway_map, [x ,y ,x2 ,y]) # also save this as an offroad lane, it has no road
+                            conn_points = road_points
+                            finished = True
+                        else:
+                            savepoint.rollback() # Routed with the roads
             else: # Criterion 2, comp2 goes down if comp1 side is free
-                print_html_comment_indent(f'comp2 goes down if comp1 side is free')
+                if trace.enabled:
+                    trace.event("criterion 2", goes_down=comp2)
                 free_ranges = get_free_obstacle_ranges(arch, (c1_x1, c1_y1, c1_x2, c1_y2), (c2_x1, c2_y2, c2_x2, range1[1]), dir, pt.PlantumlActivity, indent+1)
                 if len(free_ranges) > 0:
-                    x1 = c1_x2 if dir == Dir.RIGHT else c1_x1
-                    x = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.DOWN, [(c2_x1, c2_x2)])
-                    y = csm.allocate_an_address_on_border(highway_map, comp1.path, dir, free_ranges, [x1 ,None ,x ,None])
-                    if y != None and x != None: # and csm.is_free_offroad_horizontal_lane(highway_map, [x1 ,y ,x ,y]):
-                        road_points = [(x1, y), (x, y), (x, c2_y2)]
-
-                        csm.allocate_offroad_horizontal_lane(highway_map, [x1 ,y ,x ,y]) # also save this as an offroad lane, it has no road
-                        conn_points = road_points
-                        finished = True
+                    with highway_map.transaction() as savepoint: # The address of one end is released if the other end fails
+                        x1 = c1_x2 if dir == Dir.RIGHT else c1_x1
+                        x = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.DOWN, [(c2_x1, c2_x2)])
+                        y = csm.allocate_an_address_on_border(highway_map, comp1.path, dir, free_ranges, [x1 ,None ,x ,None]) if x != None else None # The other end only if the first one has an address
+                        if y != None and x != None: # and csm.is_free_offroad_horizontal_lane(highway_map, [x1 ,y ,x ,y]):
+                            road_points = [(x1, y), (x, y), (x, c2_y2)]
+
+                            csm.allocate_offroad_horizontal_lane(highway_map, [x1 ,y ,x ,y]) # also save this as an offroad lane, it has no road
+                            conn_points = road_points
+                            finished = True
+                        else:
+                            savepoint.rollback() # Routed with the roads
 
         elif range2 != None:    
-            print_html_comment_indent(f' Connection {name}: get_rects_if_components_between_common_vertical_lanes TRUE ********************************************** {comp1.name} {comp2.name}', indent+1)
+            if trace.enabled:
+                trace.event("get_rects_if_components_between_common_vertical_lanes", range2, comp1=comp1, comp2=comp2)
             # print(" Criteria12 elif range2 != None ---------------------------------------------------------------")
             # Give priority to go left or vertically, to avoid passing over titles
-            if c1_y2 < c2_y1:
-                dir = Dir.DOWN
-            else:
-                dir = Dir.UP
+            dir = vertical_dir
 
             if c1_x2 < c2_x2: # Main criterion, comp1 goes Right if comp2 top/bottom is free
                 # print(" Criteria12 c1_x2 < c2_x2 ---------------------------------------------------------------")
                 free_ranges = get_free_obstacle_ranges(arch, (c1_x2, c1_y2, range2[1], c1_y2), (c2_x1, c2_y1, c2_x2, c2_y2), dir, pt.PlantumlActivity, indent+1)
                 # print(f" Criteria12 check dir = {dir}")
                 if len(free_ranges) > 0:
-                    y2 = c2_y1 if dir == Dir.DOWN else c2_y2
-                    y = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.RIGHT, [(c1_y1, c1_y2)])
-                    x = csm.allocate_an_address_on_border(highway_map, comp2.path, opposit(dir), free_ranges, [None, y, None, y2])
-                    if y != None and x != None: # and csm.is_free_offroad_vertical_lane(highway_map, [x, y, x, y2]):
-                        road_points = [(c1_x2, y), (x, y), (x, y2)]
-
-                        csm.allocate_offroad_vertical_lane(highway_map, [x, y, x, y2]) # also save this as an offroad lane, it has no road
-                        conn_points = road_points
-                        finished = True
+                    with highway_map.transaction() as savepoint: # The address of one end is released if the other end fails
+                        y2 = c2_y1 if dir == Dir.DOWN else c2_y2
+                        y = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.RIGHT, [(c1_y1, c1_y2)])
+                        x = csm.allocate_an_address_on_border(highway_map, comp2.path, opposit(dir), free_ranges, [None, y, None, y2]) if y != None else None # The other end only if the first one has an address
+                        if y != None and x != None: # and csm.is_free_offroad_vertical_lane(highway_map, [x, y, x, y2]):
+                            road_points = [(c1_x2, y), (x, y), (x, y2)]
+
+                            csm.allocate_offroad_vertical_lane(highway_map, [x, y, x, y2]) # also save this as an offroad lane, it has no road
+                            conn_points = road_points
+                            finished = True
+                        else:
+                            savepoint.rollback() # Routed with the roads
             else: # Criterion 2, comp2 goes Right if comp1 side is free
                 # print(" Criteria12 else ---------------------------------------------------------------")
                 free_ranges = get_free_obstacle_ranges(arch, (c1_x1, c1_y1, c1_x2, c1_y2), (c2_x2, c2_y1, range2[1], c2_y2), dir, pt.PlantumlActivity, indent+1)
@@ -966,15 +827,18 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
                 # print(f" Criteria12 comp2 range = {(c2_x2, range2[1])}")
 
                 if len(free_ranges) > 0:
-                    y1 = c1_y2 if dir == Dir.DOWN else c1_y1
-                    y = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.RIGHT, [(c2_y1, c2_y2)])
-                    x = csm.allocate_an_address_on_border(highway_map, comp1.path, dir, free_ranges, [None, y1, None, y])
-                    if y != None and x != None: # and csm.is_free_offroad_vertical_lane(highway_map, [x, y1, x, y]):
-                        road_points = [(x, y1), (x, y), (c2_x2, y)]
+                    with highway_map.transaction() as savepoint: # The address of one end is released if the other end fails
+                        y1 = c1_y2 if dir == Dir.DOWN else c1_y1
+                        y = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.RIGHT, [(c2_y1, c2_y2)])
+                        x = csm.allocate_an_address_on_border(highway_map, comp1.path, dir, free_ranges, [None, y1, None, y]) if y != None else None # The other end only if the first one has an address
+                        if y != None and x != None: # and csm.is_free_offroad_vertical_lane(highway_map, [x, y1, x, y]):
+                            road_points = [(x, y1), (x, y), (c2_x2, y)]
 
-                        csm.allocate_offroad_vertical_lane(highway_map, [x, y1, x, y]) # also save this as an offroad lane, it has no road
-                        conn_points = road_points
-                        finished = True
+                            csm.allocate_offroad_vertical_lane(highway_map, [x, y1, x, y]) # also save this as an offroad lane, it has no road
+                            conn_points = road_points
+                            finished = True
+                        else:
+                            savepoint.rollback() # Routed with the roads
 
 
     # print_html_comment_indent(f'------------------------------------------')
@@ -982,438 +846,119 @@ def route_single_comonnection(arch: pt.PlantumlArchitecture, name: str, comp1: p
     ############################
     # criterion 3: Routing with roads
     if not finished:
-        # get the exit direction, according to the dest direction and the orientation.
-        
-        print_html_comment_indent(f'------------------------------------------')
-        print_html_comment_indent(f'Routing comp1 = {comp1.name}')
-        # go down the hierarchy of the first comp to find a road belonging the component common to both ends
-        # Create a sequence of pairs (road, offset) for each road in the hierarhy down tree
-        road_points1 = []
-        address = highway_map["addresses"][comp1.path]
-        # get the initial closest road of comp1
-        print_html_comment_indent(f' {comp1.name}: address map = {address}', indent+1)
-        if Dir.LEFT in address or Dir.RIGHT in address:
-            if dir_vec[0] > 0:
-                # print(f'Criterion 3, con1 starts RIGHT')
-                road = address[Dir.RIGHT]
-                x = c1_x2
-                # y = int(c1_y1 + c1_y2) / 2
-                y = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.RIGHT, [(c1_y1, c1_y2)])
-                r_x = lane = csm.allocate_a_road_lane(highway_map, road, False)
-                r_y = y
-            else:
-                # print(f'Criterion 3, con1 starts LEFT')
-                road = address[Dir.LEFT]
-                x = c1_x1
-                # y = int(c1_y1 + c1_y2) / 2
-                y = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.LEFT, [(c1_y1, c1_y2)])
-                r_x = lane = csm.allocate_a_road_lane(highway_map, road, False)
-                r_y = y
-        else: # Dir.UP in address or Dir.DOWN in address:
-            if dir_vec[1] > 0:
-                # print(f'Criterion 3, con1 starts DOWN')
-                road = address[Dir.DOWN]
-                # x = int(c1_x1 + c1_x2) / 2
-                x = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.DOWN, [(c1_x1, c1_x2)])
-                y = c1_y2
-                r_x = x
-                r_y = lane = csm.allocate_a_road_lane(highway_map, road, False)
-            else:
-                # print(f'Criterion 3, con1 starts UP')
-                road = address[Dir.UP]
-                # x = int(c1_x1 + c1_x2) / 2
-                x = csm.allocate_an_address_on_border(highway_map, comp1.path, Dir.UP, [(c1_x1, c1_x2)])
-                y = c1_y1
-                r_x = x
-                r_y = lane = csm.allocate_a_road_lane(highway_map, road, False)
-        # just_crossing = True # The componnent is not actually using a roud, just crossing it
-        prev_road1 = (road, lane)
-        road_points1.append((x, y))        
-        last_coord1 = (r_x, r_y)
-        road_points1.append(last_coord1)        
-        print_html_comment_indent(f' {comp1.name}: use road = {road}', indent+1)        
-
-        for index, comp in enumerate(reversed(tree1)):
-            if comp == common:
-                break
-            print_html_comment_indent(f' {comp.name}: down comp {index} = {comp}')
-            address = highway_map["addresses"][comp.path]
-            #get the next closest ways
-            print_html_comment_indent(f' {comp.name}: address map = {address}', indent+1)
-            if Dir.LEFT in address or Dir.RIGHT in address:
-                if dir_vec[0] > 0:
-                    print_html_comment_indent(f'  RIGHT')
-                    road = address[Dir.RIGHT]
-                    if csm.is_last_road(highway_map, prev_road1[0]):
-                        csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1])
-                        x = lane = csm.allocate_a_road_lane(highway_map, road, False) #get_horizontal_center_of_road(highway_map, road)
-                        y = last_coord1[1]
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                        print_html_comment_indent(f'   is_last_road')
-                    else:
-                        x = last_coord1[0]
-                        y = csm.get_vertical_end(highway_map, road, dir_vec[0])
-                        # csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_x = lane = csm.allocate_a_road_lane(highway_map, road, True)
-                        r_y = x
-                        # just_crossing = False
-                        print_html_comment_indent(f'   ')
-                else: # Dir.LEFT
-                    print_html_comment_indent(f'  LEFT')
-                    road = address[Dir.LEFT]
-                    if csm.is_first_road(prev_road1[0]):
-                        csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1])
-                        x = lane = csm.allocate_a_road_lane(highway_map, road, False)
-                        y = last_coord1[1]
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                        print_html_comment_indent(f'   is_first_road')
-                    else:
-                        x = last_coord1[0]
-                        y = csm.get_vertical_end(highway_map, road, dir_vec[0])
-                        # csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_x = lane = csm.allocate_a_road_lane(highway_map, road, True)
-                        r_y = x
-                        # just_crossing = False
-                        print_html_comment_indent(f'   ')
-            else: # Dir.UP in address or Dir.DOWN in address:
-                if dir_vec[1] > 0:
-                    print_html_comment_indent(f'  DOWN')
-                    road = address[Dir.DOWN]
-                    if csm.is_last_road(highway_map, prev_road1[0]):
-                        csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1])
-                        x = last_coord1[0]
-                        y = lane = csm.allocate_a_road_lane(highway_map, road, False)
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                        print_html_comment_indent(f'   is_last_road')
-                    else:
-                        x = csm.get_horizontal_end(highway_map, road, dir_vec[0])
-                        y = last_coord1[1]
-                        r_x = x
-                        # csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_y = lane = csm.allocate_a_road_lane(highway_map, road, True)
-                        # just_crossing = False
-                        print_html_comment_indent(f'   ')
-                else: # Dir.UP
-                    print_html_comment_indent(f'  UP')
-                    road = address[Dir.UP]
-                    if csm.is_first_road(prev_road1[0]):
-                        csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1])
-                        x = last_coord1[0]
-                        y = lane = csm.allocate_a_road_lane(highway_map, road, False)
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                    else:
-                        x = csm.get_horizontal_end(highway_map, road, dir_vec[0])
-                        y = last_coord1[1]
-                        r_x = x
-                        # csm.deallocate_a_road_lane(highway_map, prev_road1[0], prev_road1[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_y = lane = csm.allocate_a_road_lane(highway_map, road, True)
-                        # just_crossing = False
-                        print_html_comment_indent(f'   ')
-                    
-            prev_road1 = (road, lane)
-            last_coord1 = (x, y)
-            road_points1.append(last_coord1)        
-            if r_x != None and r_y != None:
-                last_coord1 = (r_x, r_y)
-                road_points1.append(last_coord1)        
-            print_html_comment_indent(f' {comp.name}: use road = {road}', indent+1)
-
-        print_html_comment_indent(f'------------------------------------------')
-        print_html_comment_indent(f'Routing comp2 = {comp2.name}')
-        dir_vec = normalize_vector((last_coord1[0] - c2_x1, last_coord1[1] - c2_y1)) # Make new assumption base the comp end up
-        # go down the hierarchy of the second comp to find a road belonging the component common to both ends
-        # Create a sequence of pairs (road, offset) for each road in the hierarhy down tree
-        #   This list of paits must be in reverse order to have a single polyline
-        road_points2 = []
-        address = highway_map["addresses"][comp2.path]
-        # get the initial closest road of comp2
-        print_html_comment_indent(f' {comp2.name}: address map = {address}', indent+1)
-        if Dir.LEFT in address or Dir.RIGHT in address:
-            if dir_vec[0] > 0: # Use inverted dir, because comp2 is inverse direction
-                road = address[Dir.RIGHT]
-                x = c2_x2
-                # y = int(c2_y1 + c2_y2) / 2
-                y = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.RIGHT, [(c2_y1, c2_y2)])
-                r_x = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                r_y = y
-            else:
-                road = address[Dir.LEFT]
-                x = c2_x1
-                # y = int(c2_y1 + c2_y2) / 2
-                y = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.LEFT, [(c2_y1, c2_y2)])
-                r_x = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                r_y = y
-        else: # Dir.UP in address or Dir.DOWN in address:
-            if dir_vec[1] > 0: # Use inverted dir, because comp2 is inverse direction
-                road = address[Dir.DOWN]
-                # x = int(c2_x1 + c2_x2) / 2
-                x = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.DOWN, [(c2_x1, c2_x2)])
-                y = c2_y2
-                r_x = x
-                r_y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-            else:
-                road = address[Dir.UP]
-                # x = int(c2_x1 + c2_x2) / 2
-                x = csm.allocate_an_address_on_border(highway_map, comp2.path, Dir.UP, [(c2_x1, c2_x2)])
-                y = c2_y1
-                r_x = x
-                r_y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-
-        # just_crossing = True # The componnent is not actually using a roud, just crossing it
-        prev_road2 = (road, lane)
-        last_coord2 = (x, y)
-        print_html_comment_indent(f' last_coord2 = {last_coord2}')
-        road_points2.insert(0, last_coord2) # For the second list, is the reverse order, up the hierarchy tree
-        last_coord2 = (r_x, r_y)
-        print_html_comment_indent(f' last_coord2 = {last_coord2}')
-        road_points2.insert(0, last_coord2)    
-        print_html_comment_indent(f' {comp2.name}: use road = {road}', indent+1)        
-        for index, comp in enumerate(reversed(tree2)):
-            if comp == common:
-                break
-            print_html_comment_indent(f' {comp.name}: down comp {index} = {comp}')
-            address = highway_map["addresses"][comp.path]
-            #get the next closest ways
-            print_html_comment_indent(f' {comp.name}: address map = {address}', indent+1)
-            if Dir.LEFT in address or Dir.RIGHT in address:
-                if dir_vec[0] > 0: # Use inverted dir, because comp2 is inverse direction
-                    print_html_comment_indent(f'  RIGHT')
-                    road = address[Dir.RIGHT]
-                    if csm.is_last_road(highway_map, prev_road2[0]):
-                        print_html_comment_indent(f'   is_last_road')
-
-                        csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1])
-                        x = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        y = last_coord2[1]
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                    else:
-                        x = last_coord2[0]
-                        y = csm.get_road_vertical_end(highway_map, road, dir_vec[0])
-                        # csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_x = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        r_y = y
-                        # just_crossing = False
-                else:
-                    print_html_comment_indent(f'  LEFT')
-                    road = address[Dir.LEFT]
-                    if csm.is_first_road(prev_road2[0]):
-                        csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1])
-                        x = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        y = last_coord2[1]
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                    else:
-                        x = last_coord2[0]
-                        y = csm.get_road_vertical_end(highway_map, road, dir_vec[0])
-                        # csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_x = lane = csm.allocate_a_road_lane(highway_map, road, True), prev_road1
-                        r_y = y
-                        # just_crossing = False
-            else: # Dir.UP in address or Dir.DOWN in address:
-                if dir_vec[1] > 0: # Use inverted dir, because comp2 is inverse direction
-                    print_html_comment_indent(f'  DOWN')
-                    road = address[Dir.DOWN]
-                    if csm.is_last_road(highway_map, prev_road2[0]):
-                        print_html_comment_indent(f'   is_last_road')
-
-                        csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1])
-                        x = last_coord2[0]
-                        y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                    else:
-                        print_html_comment_indent(f'   NOT is_last_road')
-                        
-                        x = csm.get_road_horizontal_end(highway_map, road, dir_vec[0])
-                        y = last_coord2[1]
-                        r_x = x
-                        # csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)                        
-                        # just_crossing = False
-                else:
-                    print_html_comment_indent(f'  UP')
-                    road = address[Dir.UP]
-                    if csm.is_first_road(prev_road2[0]):
-                        x = last_coord2[0]
-                        csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1])
-                        y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        r_x = None # Not needed
-                        r_y = None # Not needed
-                        # just_crossing = True
-                    else:
-                        x = csm.get_road_horizontal_end(highway_map, road, dir_vec[0])
-                        y = last_coord2[1]
-                        r_x = x
-                        # csm.deallocate_a_road_lane(highway_map, prev_road2[0], prev_road2[1]) if just_crossing == True else None # deallocate prevous lane
-                        r_y = lane = csm.allocate_a_road_lane(highway_map, road, True, prev_road1)
-                        # just_crossing = False
-
-            prev_road2 = (road, lane)
-            last_coord2 = (x, y)
-            road_points2.insert(0, last_coord2) # For the second list, is the reverse order, up the hierarchy tree
-            if r_x != None and r_y != None:
-                last_coord2 = (r_x, r_y)
-                road_points2.insert(0, last_coord2)  # For the second list, is the reverse order, up the hierarchy tree   
-
-            print_html_comment_indent(f' {comp.name}: use road = {road}', indent+1)
-                
-        print_html_comment_indent(f'------------------------------------------')
-        # In the end, connect the last road parts that connects all together
-        road_points_center = [] # TODO TBD
-
-        #  At this point, both sides of the connections are at the same final architecture
-        if prev_road1[0] == prev_road2[0]: # If they are at the same road
-            road_points_center = [last_coord1, last_coord2]
-        else: # If they are NOT in the same road
-
-            if highway_map["roads"]["orientations"][prev_road2[0]] == DirType.HORIZONTAL:
-                
-                dir = Dir.UP
-                if last_coord1[1] < last_coord2[1]:
-                    dir = Dir.DOWN
-
-                components_rects1 = get_components_rects_in_front(arch, (last_coord1[0], last_coord1[1], last_coord1[0], last_coord1[1]), (last_coord2[0], last_coord2[1], last_coord2[0], last_coord2[1]), dir, pt.PlantumlContainer, indent+1)
-                components_rects2 = get_components_rects_in_front(arch, (last_coord2[0], last_coord2[1], last_coord2[0], last_coord2[1]), (last_coord1[0], last_coord1[1], last_coord1[0], last_coord1[1]), dir, pt.PlantumlContainer, indent+1)
-
-                if len(components_rects1) == 0: # If no obstacle in front of last_coord1, use it
-                    x1 = last_coord1[0]
-                elif len(components_rects2) == 0: # else if no obstacle in front of last_coord2, use it
-                    x1 = last_coord2[0]
-                else: # Else go to one of the edges
-                    dist_to_end_1 = csm.get_closest_horizontal_dist_to_end(highway_map, prev_road1[0], last_coord1[0])
-                    dist_to_end_2 = csm.get_closest_horizontal_dist_to_end(highway_map, prev_road2[0], last_coord2[0])
-                    if abs(dist_to_end_1) < abs(dist_to_end_2): # road of comp1 is the master for the edge
-                        x1 = csm.get_road_horizontal_end(highway_map, prev_road1[0], dist_to_end_1)
-                    else: # road of comp2 is the master for the edge
-                        x1 = csm.get_road_horizontal_end(highway_map, prev_road1[0], dist_to_end_2)
-                y1 = last_coord1[1]
-                x2 = x1
-                y2 = last_coord2[1]
-            
-            else: # If roads orientation == DirType.VERTICAL
-            
-                dir = Dir.LEFT
-                if last_coord1[0] < last_coord2[0]:
-                    dir = Dir.RIGHT
-
-                components_rects1 = get_components_rects_in_front(arch, (last_coord1[0], last_coord1[1], last_coord1[0], last_coord1[1]), (last_coord2[0], last_coord2[1], last_coord2[0], last_coord2[1]), dir, pt.PlantumlContainer, indent+1)
-                components_rects2 = get_components_rects_in_front(arch, (last_coord2[0], last_coord2[1], last_coord2[0], last_coord2[1]), (last_coord1[0], last_coord1[1], last_coord1[0], last_coord1[1]), dir, pt.PlantumlContainer, indent+1)
-
-                if len(components_rects1) == 0: # If no obstacle in front of last_coord1, use it
-                    y1 = last_coord1[1]
-                elif len(components_rects2) == 0: # else if no obstacle in front of last_coord2, use it
-                    y1 = last_coord2[1]
-                else: # Else go to one of the edges
-                    dist_to_end_1 = csm.get_closest_vertical_dist_to_end(highway_map, prev_road1[0], last_coord1[1])
-                    dist_to_end_2 = csm.get_closest_vertical_dist_to_end(highway_map, prev_road2[0], last_coord2[1])
-                    if abs(dist_to_end_1) < abs(dist_to_end_2): # road of comp1 is the master for the edge
-                        y1 = csm.get_road_vertical_end(highway_map, prev_road1[0], dist_to_end_1)
-                    else: # road of comp2 is the master for the edge
-                        y1 = csm.get_road_vertical_end(highway_map, prev_road1[0], dist_to_end_2)
-                x1 = last_coord1[0]
-                y2 = y1
-                x2 = last_coord2[0]
-            
-            road_points_center = [(x1, y1), (x2, y2)]
-
-        
-        print_html_comment_indent(f'------------------------------------------')
-        road_points = road_points1 + road_points_center + road_points2
-        
-        for point in road_points:
-            print_html_comment_indent(f'  point = {point}')
-        conn_points = road_points
-
-        # conn_str = print_poly_conn(road_points1, layout_style, name)
-        # conn_str += print_poly_conn(road_points_center, layout_style, name)
-        # conn_str += print_poly_conn(road_points2, layout_style, name)
+        conn_points = rg.route_with_roads(highway_map, comp1, (c1_x1, c1_y1, c1_x2, c1_y2), comp2, (c2_x1, c2_y1, c2_x2, c2_y2))
+        if trace.enabled:
+            trace.event("route_with_roads", conn_points, comp1=comp1, comp2=comp2)
             
     return conn_points
     
 
+def get_connection_relations(arch: pt.PlantumlArchitecture, connections: list[pt.PlantumlConnection]) -> dict:
+    """
+    Computes in one batch the relations between the ends of every single connection, used by route_single_comonnection instead of testing them pair by pair.
+    The same row and same column tests are done with the batched kernels of geometry (batch_same_row and batch_same_column).
+    
+    arch: The architecture fo the diagram, with the layout done.
+    connections: list of PlantumlConnection objects.
+    
+    return: A dictionary where the key is the pair of components (comp1, comp2) and the value is a dictionary with:
+        - rect1, rect2: The absolute coordinates (x1, y1, x2, y2) of the components, as returned by get_absolute_coordinates.
+        - same_row, same_column: True if the components overlap vertically or horizontally.
+        - horizontal_dir: Dir.RIGHT if comp2 is at the right of comp1, Dir.LEFT otherwise.
+        - vertical_dir: Dir.DOWN if comp2 is below comp1, Dir.UP otherwise.
+    """
+    pairs = []
+    rects1 = []
+    rects2 = []
+    for obj in connections:
+        for idx, comp1, comp2 in obj.get_endpoint_pairs():
+            rect1 = get_absolute_rect(arch, comp1)
+            rect2 = get_absolute_rect(arch, comp2)
+            if rect1 is None or rect2 is None:
+                continue # Not placed, the pair is tested by route_single_comonnection
+            pairs.append((comp1, comp2))
+            rects1.append(rect1)
+            rects2.append(rect2)
+
+    same_rows = geo.batch_same_row(rects1, rects2)
+    same_columns = geo.batch_same_column(rects1, rects2)
+
+    res = {}
+    for pair, rect1, rect2, same_row, same_column in zip(pairs, rects1, rects2, same_rows, same_columns):
+        rect1 = (int(rect1[0]), int(rect1[1]), int(rect1[2]), int(rect1[3])) # Same as get_absolute_coordinates
+        rect2 = (int(rect2[0]), int(rect2[1]), int(rect2[2]), int(rect2[3]))
+        res[pair] = {
+            "rect1": rect1,
+            "rect2": rect2,
+            "same_row": same_row,
+            "same_column": same_column,
+            "horizontal_dir": Dir.RIGHT if rect1[2] < rect2[0] else Dir.LEFT,
+            "vertical_dir": Dir.DOWN if rect1[3] < rect2[1] else Dir.UP,
+            }
+    return res
+
 def route_svg_comonnection(arch: pt.PlantumlArchitecture, name: str, obj: pt.PlantumlConnection, highway_map: dict, layout_style: dict, indent=0):
-    print_html_comment_indent(f"route_svg_comonnection: {name} {obj.name} {obj.path}", indent) # false
     res = {}
     poly_points = []
     
     # Actualy a connection obj may have multiple single connections.
     # This is a list of pairs of componnents refs 
     single_connection_list = []
-    if isinstance(obj.comp1, list):
-        for idx, item in enumerate(obj.comp1):
-            comp1 = item.ref
-            comp2 = obj.comp2.ref
-            single_connection_list.append((f"{name}:{idx}", comp1, comp2))
-    elif isinstance(obj.comp2, list):
-        for idx, item in enumerate(obj.comp2):
-            comp2 = item.ref
-            comp1 = obj.comp1.ref
-            single_connection_list.append((f"{name}:{idx}", comp1, comp2))
-    else:
-            comp1 = obj.comp1.ref
-            comp2 = obj.comp2.ref
+    for idx, comp1, comp2 in obj.get_endpoint_pairs():
+        if idx is None:
             single_connection_list.append((f"{name}", comp1, comp2))
+        else:
+            single_connection_list.append((f"{name}:{idx}", comp1, comp2))
     
     for comp in single_connection_list:
-        points = route_single_comonnection(arch, comp[0], comp[1], comp[2], highway_map, indent+1)
+        trace.set_connection(comp[0])
+        start = time.perf_counter() if trace.enabled else 0
+        cache = highway_map.get("route_cache") # A RouteCache, if the routes are cached
+        points = cache.lookup(arch, highway_map, comp[0], comp[1], comp[2]) if cache is not None else None
+        if points is None:
+            if cache is not None:
+                csm.start_recording()
+            points = route_single_comonnection(arch, comp[0], comp[1], comp[2], highway_map, indent+1)
+            if cache is not None:
+                cache.store(arch, highway_map, comp[0], comp[1], comp[2], points, csm.stop_recording())
+        if trace.enabled:
+            trace.event("route_svg_comonnection", points, connection_obj=obj, duration=time.perf_counter() - start)
+        trace.set_connection(None)
+        if len(points) < 2: # No route, nothing to print
+            csm.get_congestion(highway_map)["failures"].append(comp[0])
+            continue
         conn_str = print_poly_conn(points, obj, layout_style, comp[0])
         # print(conn_str)
         res.update({name:conn_str})
       
     return res
 
-def get_rects_if_components_between_common_horizontal_lanes(highway_map, comp1, comp2, tree1, tree2, indent):
-    """
-    This function does two things, it test if the components are between two common roads (same row in some point in the hierarchy), and if yes then return the vertical range (in absolute svg coordinates) of the common areas of both componnents.  If not, returns None
-    """
-    # print_html_comment_indent(f'  are_components_between_common_horizontal_lanes', indent+1)
-
-    address1 = highway_map["addresses"][comp1.path]
-    # print_html_comment_indent(f'    comp1.path={comp1.path}', indent+1)
-    for index, item in enumerate(reversed(tree1)):
-        # print_html_comment_indent(f' {comp1.name}: tree {index} = {item}')
+def get_common_addresses(highway_map, comp1, comp2, tree1, tree2):
+    # Returns the roads next to comp1 and comp2 or to their owners just below the common owner, as dictionaries {face: road id}
+    address_roads = highway_map.address_roads
+    address1 = address_roads.get(comp1.path, {})
+    for item in reversed(tree1):
         if item in tree2:
             break
-        # print_html_comment_indent(f'     item.path={item.path}', indent+1)
-        address1 = highway_map["addresses"][item.path]
+        address1 = address_roads.get(item.path, {})
         
-    address2 = highway_map["addresses"][comp2.path]
-    # print_html_comment_indent(f'    comp2.path={comp2.path}', indent+1)
-    for index, item in enumerate(reversed(tree2)):
-        # print_html_comment_indent(f' {comp1.name}: tree {index} = {item}')
+    address2 = address_roads.get(comp2.path, {})
+    for item in reversed(tree2):
         if item in tree1:
             break
-        # print_html_comment_indent(f'     item.path={item.path}', indent+1)
-        address2 = highway_map["addresses"][item.path]
-        
+        address2 = address_roads.get(item.path, {})
+    return address1, address2
+
+def get_rects_if_components_between_common_horizontal_lanes(highway_map, comp1, comp2, tree1, tree2, indent):
+    """
+    This function does two things, it test if the components are between two common roads (same row in some point in the hierarchy), and if yes then return the vertical range (in absolute svg coordinates) of the common areas of both componnents.  If not, returns None
+    """
+    address1, address2 = get_common_addresses(highway_map, comp1, comp2, tree1, tree2)
     if Dir.UP in address1 and Dir.DOWN in address1 and Dir.UP in address2 and Dir.DOWN in address2: 
-        # print_html_comment_indent(f'    They have UP and DOWN', indent+1)
-        # print_html_comment_indent(f'     Up 1 = {address1[Dir.UP]}', indent+1)
-        # print_html_comment_indent(f'     Up 2 = {address2[Dir.UP]}', indent+1)
-        # print_html_comment_indent(f'     Down 1 = {address1[Dir.DOWN]}', indent+1)
-        # print_html_comment_indent(f'     Down 2 = {address2[Dir.DOWN]}', indent+1)
         if address1[Dir.UP] == address2[Dir.UP] and  address1[Dir.DOWN] == address2[Dir.DOWN]:
-            # print_html_comment_indent(f'     RETURN TRUE', indent+1)
-            road1 = address1[Dir.UP]
-            road2 = address1[Dir.DOWN]
-
-            rect1 = highway_map["roads"]["rects"][road1]   
-            rect2 = highway_map["roads"]["rects"][road2]   
-            y1 = rect1[1] + rect1[3]
-            y2 = rect2[1]
-            return (y1, y2)
+            rect1 = highway_map.road_rects[address1[Dir.UP]]
+            rect2 = highway_map.road_rects[address1[Dir.DOWN]]
+            return (rect1[3], rect2[1])
   
     return None
 
@@ -1421,31 +966,12 @@ def get_rects_if_components_between_common_vertical_lanes(highway_map, comp1, co
     """
     This function does two things, it test if the components are between two common roads (same column in some point in the hierarchy), and if yes then return the horizontal range (in absolute svg coordinates) of the common areas of both componnents.  If not, returns None
     """
-
-    address1 = highway_map["addresses"][comp1.path]
-    for index, item in enumerate(reversed(tree1)):
-        # print_html_comment_indent(f' {comp1.name}: tree {index} = {item}')
-        if item in tree2:
-            break
-        address1 = highway_map["addresses"][item.path]
-        
-    address2 = highway_map["addresses"][comp2.path]
-    for index, item in enumerate(reversed(tree2)):
-        # print_html_comment_indent(f' {comp1.name}: tree {index} = {item}')
-        if item in tree1:
-            break
-        address2 = highway_map["addresses"][item.path]
- 
+    address1, address2 = get_common_addresses(highway_map, comp1, comp2, tree1, tree2)
     if Dir.LEFT in address1 and Dir.RIGHT in address1 and Dir.LEFT in address2 and Dir.RIGHT in address2:
         if address1[Dir.LEFT] == address2[Dir.LEFT] and  address1[Dir.RIGHT] == address2[Dir.RIGHT]:
-            road1 = address1[Dir.LEFT]
-            road2 = address1[Dir.RIGHT]
-
-            rect1 = highway_map["roads"]["rects"][road1]   
-            rect2 = highway_map["roads"]["rects"][road2]   
-            x1 = rect1[0] + rect1[2]
-            x2 = rect2[0]
-            return (x1, x2)
+            rect1 = highway_map.road_rects[address1[Dir.LEFT]]
+            rect2 = highway_map.road_rects[address1[Dir.RIGHT]]
+            return (rect1[2], rect2[0])
 
     return None
 
@@ -1,9 +1,13 @@
 import inspect
 import ast
+import contextlib
 import tokenize
 import io
 from pprint import pprint
 import plantuml.plantuml_types as pt
+import plantuml.routing_trace as trace
+from plantuml.interval_set import IntervalSet
+from plantuml.lane_set import LaneSet, get_interlaced_shifts
 import inspect
 import math
 from enum import Enum
@@ -18,6 +22,116 @@ class DirType(Enum):
     HORIZONTAL = 0
     VERTICAL = 1
 
+class HighwayMap(dict):
+    """
+    Map of the roads where the connections pass, created by do_svg_architecture (see its documentation for the content).
+    It is still the dictionary of roads and addresses keyed by the road names "M <path> <index>", kept as a readable view for debugging.
+    The routing uses the integer ids of the roads, so it gets a road, its owner, its lanes and the roads next to a component without
+    building or parsing the names:
+        - road_names: The name of each road id.
+        - road_ids: The id of each road name.
+        - road_owners: The component owning each road.
+        - road_indexes: The index of each road in its owner, 0 for the first one.
+        - road_allocations: The lanes allocated on each road (see new_road_allocations).
+        - road_rects: The absolute rectangle (x1, y1, x2, y2) of each road, set by index_roads.
+        - road_orientations: The orientation (DirType) of each road, set by index_roads.
+        - address_roads: The ids of the roads next to each component {comp_path: {face: road id}}, set by index_roads.
+    The allocations done inside a transaction can be rolled back (see transaction).
+    """
+    def __init__(self):
+        super().__init__()
+        self["roads"] = { # Contains the definition and states of all lanes.
+            "rects": {}, # The screen representation of a lane as a long rectangle.
+            "orientations": {}, # The direction of the roads, HORIZONTAL or VERTICAL.
+            "allocations": {} # The offroad lanes where a connection passes outside of the roads (see get_offroad_lanes), the lanes of the roads are in road_allocations.
+            }
+        self["addresses"] = {} # Contains all the components with the information what are the lanes passing by and the allocations of the connections.
+        self["final"] = [] # Just lists all the lanes that are the last one (bottom most or left most) inside a component.
+        self.road_names = []
+        self.road_ids = {}
+        self.road_owners = []
+        self.road_indexes = []
+        self.road_allocations = []
+        self.road_rects = []
+        self.road_orientations = []
+        self.address_roads = {}
+        self.undo_log = None # The functions undoing the allocations done in the open transactions, None out of a transaction
+
+    def add_road(self, name: str, owner, index: int) -> int:
+        """
+        Registers a road of the view with its owner component and its index in the owner, returns its id.
+        """
+        road_id = len(self.road_names)
+        self.road_names.append(name)
+        self.road_ids[name] = road_id
+        self.road_owners.append(owner)
+        self.road_indexes.append(index)
+        self.road_allocations.append(new_road_allocations())
+        return road_id
+
+    def index_roads(self):
+        """
+        Fills the arrays of the roads and the links of the addresses from the view, once the rectangles of the roads are absolute.
+        """
+        rects = self["roads"]["rects"]
+        orientations = self["roads"]["orientations"]
+        self.road_rects = []
+        self.road_orientations = []
+        for name in self.road_names:
+            rect = rects[name]
+            self.road_rects.append((rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]))
+            self.road_orientations.append(orientations[name])
+        self.address_roads = {}
+        for comp_path, address in self["addresses"].items():
+            self.address_roads[comp_path] = {face: self.road_ids[road] for face, road in address.items() if isinstance(face, Dir) and road in self.road_ids}
+
+    def log_undo(self, undo, *args):
+        """
+        Logs the function undoing an allocation, it is called with args if the transaction is rolled back. Nothing is logged out of a transaction.
+        """
+        if self.undo_log is not None:
+            self.undo_log.append((undo, args))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Opens a transaction for a speculative routing attempt: `with highway_map.transaction() as savepoint:`.
+        The allocations done inside the block are kept, unless savepoint.rollback() is called or an exception is raised in it.
+        The transactions can be nested, the rollback of an inner transaction only undoes its own allocations.
+        """
+        outermost = self.undo_log is None
+        if outermost:
+            self.undo_log = []
+        savepoint = Savepoint(self)
+        try:
+            yield savepoint
+        except BaseException:
+            savepoint.rollback()
+            raise
+        finally:
+            if outermost:
+                self.undo_log = None
+
+class Savepoint:
+    """
+    Position in the undo log of a HighwayMap, returned by HighwayMap.transaction.
+    """
+    def __init__(self, highway_map: HighwayMap):
+        self.highway_map = highway_map
+        self.undo_length = len(highway_map.undo_log)
+        self.recorded_length = len(_recorded_allocations) if _recorded_allocations is not None else None
+
+    def rollback(self):
+        """
+        Undoes the allocations done since the savepoint, in reverse order, and drops them from the recording (see start_recording).
+        """
+        undo_log = self.highway_map.undo_log
+        while len(undo_log) > self.undo_length:
+            undo, args = undo_log.pop()
+            undo(*args)
+        if self.recorded_length is not None and _recorded_allocations is not None:
+            del _recorded_allocations[self.recorded_length:]
+
 def print_with_indent(text, indent = 0):
     print('    ' * indent + text)
     
@@ -26,10 +140,14 @@ def print_html_comment_indent(text, indent = 0):
 
 def print_obj_abs_pos_dim(arch: pt.PlantumlArchitecture, obj: pt.PlantumlType, indent = 0):
     x1, y1 = get_absolute_pos(arch, obj)
-    print_html_comment_indent(f'  {obj.name} ({x1}, {y1}) ({get_obj_prop(obj, "rect_x_len", None)}, {get_obj_prop(obj, "rect_y_len", None)})', indent)
+    print_html_comment_indent(f'  {obj.name} ({x1}, {y1}) ({obj.layout.x_len}, {obj.layout.y_len})', indent)
 
 def get_obj_prop(obj, prop, default=0):
-    if isinstance(obj, pt.PlantumlType) and prop in obj.metadata_dict:
+    if isinstance(obj, pt.PlantumlType) and prop in pt.LAYOUT_FIELDS:
+        res = getattr(obj.layout, pt.LAYOUT_FIELDS[prop])
+        if res is not None:
+            return res
+    elif isinstance(obj, pt.PlantumlType) and prop in obj.metadata_dict:
         res = obj.metadata_dict[prop]
         if res is not None:
             return res
@@ -40,21 +158,27 @@ def get_absolute_pos(arch, obj):
     Returns the absolute coordinates x and y of obj in the architecture (Left, Top), if valid. Otherwise returns None, None.
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
+    rects = arch.get_absolute_rects()
+    if rects is not None and obj in rects:
+        rect = rects[obj]
+        if rect is None:
+            return None, None
+        return rect[0], rect[1]
+
     owner_tree = arch.get_owner_tree(obj)
     abs_x = 0
     abs_y = 0
     for index, item in enumerate(owner_tree):
-        # print_html_comment_indent(f"{index}: {item.name}, pos=({get_obj_prop(item, 'rect_x_pos', 0)},{get_obj_prop(item, 'rect_y_pos', 0)})", 2)
+        # print_html_comment_indent(f"{index}: {item.name}, pos=({item.layout.x_pos},{item.layout.y_pos})", 2)
         #The last element will be assumed as 0, 0, not None, None
-        dx = get_obj_prop(item, 'rect_x_pos', 0)
-        dy = get_obj_prop(item, 'rect_y_pos', 0)
-        if dx == None or dy == None:
-            return None, None
-        abs_x += dx
-        abs_y += dy
+        layout = item.layout
+        if layout.x_pos is not None:
+            abs_x += layout.x_pos
+        if layout.y_pos is not None:
+            abs_y += layout.y_pos
     
-    dx = get_obj_prop(obj, 'rect_x_pos', None)
-    dy = get_obj_prop(obj, 'rect_y_pos', None)
+    dx = obj.layout.x_pos
+    dy = obj.layout.y_pos
     if dx == None or dy == None:
         return None, None
     abs_x += dx
@@ -67,8 +191,8 @@ def get_absolute_center(arch, obj):
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
     abs_x, abs_y = get_absolute_pos(arch, obj)
-    dx = get_obj_prop(obj, 'rect_x_len', None)
-    dy = get_obj_prop(obj, 'rect_y_len', None)
+    dx = obj.layout.x_len
+    dy = obj.layout.y_len
     if abs_x == None or abs_y == None or dx == None or dy == None:
         return None, None
     abs_x += dx/2
@@ -81,9 +205,16 @@ def get_absolute_coordinates(arch, obj):
     Returns the absolute coordinates x1, y1, x2 and y2 of the obj in the architecture. If a coordinate could not be found, it return None for all coordinates (e.g. None, None, None, None). 
     The coordination system starts (0, 0) at Top Left of the architecture and increases towards Right and Down.
     """
+    rects = arch.get_absolute_rects()
+    if rects is not None and obj in rects:
+        rect = rects[obj]
+        if rect is not None and rect[2] is not None:
+            return rect
+        return None, None, None, None
+
     x1, y1 = get_absolute_pos(arch, obj)
-    dx = get_obj_prop(obj, "rect_x_len", None)
-    dy = get_obj_prop(obj, "rect_y_len", None)
+    dx = obj.layout.x_len
+    dy = obj.layout.y_len
 
     if x1 is not None and y1 is not None and dx is not None and dy is not None: 
         x2 = x1 + dx
@@ -91,75 +222,39 @@ def get_absolute_coordinates(arch, obj):
         return x1, y1, x2, y2
     return None, None, None, None
 
-def get_road_down_end(highway_map: dict, road: str) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    return road_rect[1] + road_rect[3] - int(road_rect[2]/2)
-
-def get_road_up_end(highway_map: dict, road: str) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    return road_rect[1] + int(road_rect[2]/2)
-
-def get_road_right_end(highway_map: dict, road: str) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    return road_rect[0] + road_rect[2] - int(road_rect[3]/2)
-
-def get_road_left_end(highway_map: dict, road: str) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    return road_rect[0] + int(road_rect[3]/2)
-
-def is_first_road(road: str):
-    words = road.split()
-    if words[2] == "0":
-        return True
-    return False
-
-def is_last_road(highway_map: dict, road: str):
-    if road in highway_map["final"]:
-        return True
-    return False
-
-def get_road_horizontal_end(highway_map: dict, road: str, target_dir: int) -> int:
-    return get_road_right_end(highway_map, road) if target_dir > 0 else get_road_left_end(highway_map, road)
-
-def get_road_vertical_end(highway_map: dict, road: str, target_dir: int) -> int:
-    return get_road_down_end(highway_map, road) if target_dir > 0 else get_road_up_end(highway_map, road)
-
+def new_road_allocations() -> LaneSet:
+    """
+    Returns the empty allocations of a road: the set of its lanes used by the connections.
+    """
+    return LaneSet()
 
-def get_closest_horizontal_dist_to_end(highway_map: dict, road: str, target_offset: int) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    
-    if target_offset - road_rect[0] < (road_rect[0] + road_rect[2]) - target_offset:
-        return road_rect[0] - target_offset
-    else:
-        return (road_rect[0] + road_rect[2]) - target_offset
+def new_border_allocations() -> dict:
+    """
+    Returns the empty allocations of the faces of a component, the "allocarions" of its address: a LaneSet of offsets for each face.
+    """
+    return {Dir.LEFT: LaneSet(), Dir.RIGHT: LaneSet(), Dir.UP: LaneSet(), Dir.DOWN: LaneSet()}
 
-def get_closest_vertical_dist_to_end(highway_map: dict, road: str, target_offset: int) -> int:
-    road_rect = highway_map["roads"]["rects"][road]
-    
-    if target_offset - road_rect[1] < (road_rect[1] + road_rect[3]) - target_offset:
-        return road_rect[1] - target_offset
-    else:
-        return (road_rect[1] + road_rect[3]) - target_offset
+def get_border_allocations(highway_map: dict, comp_path: str, face: Dir) -> LaneSet:
+    """
+    Returns the offsets allocated on the face of a component, the address of the component is created if it has none.
+    """
+    address = highway_map["addresses"].get(comp_path)
+    if address is None:
+        address = {"allocarions": new_border_allocations()}
+        highway_map["addresses"][comp_path] = address
+    return address["allocarions"][face]
 
 def is_border_offset_available(highway_map: dict, comp_path: str, face: Dir, offset: int) -> bool:
     # print(f' is_border_offset_available of {comp_path} for offset={offset}')
-
-    if comp_path in highway_map["addresses"]:
-        allocarions = highway_map["addresses"][comp_path]["allocarions"]
-        if face in allocarions:
-            if offset in allocarions[face]:
-                return False
-    else:
-        highway_map["addresses"][comp_path] = {"allocarions": {Dir.LEFT:[], Dir.RIGHT:[], Dir.UP:[], Dir.DOWN:[]}}
-    return True
+    return not offset in get_border_allocations(highway_map, comp_path, face)
     
 def allocate_the_border_offset(highway_map: dict, comp_path: str, face: Dir, offset: int):
     # print(f' allocate_the_border_offset of {comp_path} for offset={offset}')
-
-    if not comp_path in highway_map["addresses"]:
-        highway_map["addresses"][comp_path] = {"allocarions": {Dir.LEFT:[], Dir.RIGHT:[], Dir.UP:[], Dir.DOWN:[]}}
-
-    highway_map["addresses"][comp_path]["allocarions"][face].append(offset)
+    allocations = get_border_allocations(highway_map, comp_path, face)
+    if not offset in allocations:
+        allocations.add(offset)
+        highway_map.log_undo(allocations.discard, offset)
+    _record("border", comp_path, face, offset)
     
 def allocate_an_address_on_border(highway_map: dict, comp_path: str, face: Dir, ranges: list[tuple[int, int]], range_for_checking = None) -> int|None:
     """
@@ -171,6 +266,8 @@ def allocate_an_address_on_border(highway_map: dict, comp_path: str, face: Dir,
     return: a position along the border face of the retangle.
     """
     # print(f'allocate_an_address_on_border of {comp_path} for ranges={ranges}')
+    allocations = get_border_allocations(highway_map, comp_path, face) # Looked up once for all the offsets tried
+    is_available = lambda offset: is_offroad_lane_available(highway_map, offset, range_for_checking)
     for free_range in ranges:
         if free_range[1] - free_range[0] > 5: # Do not use too short ranges
 
@@ -181,25 +278,24 @@ def allocate_an_address_on_border(highway_map: dict, comp_path: str, face: Dir,
             # init_off = int(free_range[0] + (free_range[1]-free_range[0])/3)
             if free_range[1] - free_range[0] < (2 * step):
                 step = 3
-            for init in [0, 5, 2, 8]: # Keep trying with different interlacing 
-                # Do the allocation first around the meddle till the end
-                for curr_shift in range (init, delta, step):
-                    curr_offset = offset + curr_shift
-                    if is_border_offset_available(highway_map, comp_path, face, curr_offset) and is_offroad_lane_available(highway_map, curr_offset, range_for_checking):
-                        allocate_the_border_offset(highway_map, comp_path, face, curr_offset)
-                        return curr_offset
-                    curr_offset = offset - curr_shift
-                    if is_border_offset_available(highway_map, comp_path, face, curr_offset) and is_offroad_lane_available(highway_map, curr_offset, range_for_checking):
-                        allocate_the_border_offset(highway_map, comp_path, face, curr_offset)
-                        return curr_offset
+            # Do the allocation first around the meddle till the end, then interlaced
+            shifts = get_interlaced_shifts(delta, step)
+            curr_offset = allocations.first_free((offset + shift for shift in shifts), is_available)
+            probes = shifts.index(curr_offset - offset) + 1 if curr_offset is not None else len(shifts)
+            probe_iterations = get_metrics(highway_map)["probe_iterations"]
+            probe_iterations[probes] = probe_iterations.get(probes, 0) + 1
+            if curr_offset is not None:
+                allocate_the_border_offset(highway_map, comp_path, face, curr_offset)
+                return curr_offset
             # # Other try the init
             # for offset in range (init_off, int(free_range[0]), -step):
                 # if is_border_offset_available(highway_map, comp_path, face, offset) and is_offroad_lane_available(highway_map, offset, range_for_checking):
                     # allocate_the_border_offset(highway_map, comp_path, face, offset)
                     # return offset
     
-    if len(ranges) > 0:
-        ranges[0][0] # No allocation because is full, re-use something else shared
+    if any(free_range[1] - free_range[0] > 5 for free_range in ranges): # No allocation because is full, re-use something else shared
+        _count_overflow(highway_map, get_congestion(highway_map)["borders"], (comp_path, face))
+        _record("border_overflow", comp_path, face)
     
     return None # No allocation, re-use something else shared
 
@@ -214,83 +310,201 @@ def allocate_an_address_on_border(highway_map: dict, comp_path: str, face: Dir,
     # print_html_comment_indent(f'    get_vertical_center_of_road res = {res} for rtoad = {road}')
     # return res
     
-def is_road_lane_available(highway_map: dict, road_name: str, lane: int) -> bool:
-    # print(f' is_road_lane_available of {road_name} for lane={lane}')
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-    allocations = local_roads_map["allocations"][road_name]
-    if lane in allocations:
-        # print(f'  FALSE', allocations)
-        return False
-
-    # print(f'  FALSE')
-    return True
+def is_road_lane_available(highway_map: HighwayMap, road: int, lane: int) -> bool:
+    # print(f' is_road_lane_available of {road} for lane={lane}')
+    return not lane in highway_map.road_allocations[road]
     
-def allocate_the_road_lane(highway_map: dict, road_name: str, lane: int):
-    # print(f' allocate_the_road_lane of {road_name} for lane={lane}')
+def allocate_the_road_lane(highway_map: HighwayMap, road: int, lane: int):
+    # print(f' allocate_the_road_lane of {road} for lane={lane}')
 
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-    allocations = local_roads_map["allocations"][road_name]
+    allocations = highway_map.road_allocations[road]
     if not lane in allocations:
-        print(f'        Do allocation of lane={lane} in road={road_name}')
-        allocations.append(lane)
+        if trace.enabled:
+            trace.event("allocate_the_road_lane", lane, road=highway_map.road_names[road])
+        allocations.add(lane)
+        highway_map.log_undo(allocations.discard, lane)
+        _record("lane", road, lane)
+
+def get_road_lanes(highway_map: HighwayMap, road: int) -> list[int]:
+    """
+    Returns the lanes of a road id in the order they are allocated: from the center to the borders every 10 pixels, then interlaced between them.
+    A lane can be repeated, the center one is tried twice.
+    """
+    rect = highway_map.road_rects[road] # (x1, y1, x2, y2)
+    if highway_map.road_orientations[road] == DirType.VERTICAL:
+        delta = int((rect[2] - rect[0])/2) # I want the perpendicular direction
+        offset = int(rect[0] + delta)
+    else:
+        delta = int((rect[3] - rect[1])/2)
+        offset = int(rect[1] + delta)
+
+    return [offset + shift for shift in get_interlaced_shifts(delta, 10)]
+
+def get_road_capacity(highway_map: HighwayMap, road: int) -> int:
+    """
+    Returns the number of connections that can pass through a road id, each one in its own lane.
+    """
+    return len(set(get_road_lanes(highway_map, road)))
+
+def get_congestion(highway_map: dict) -> dict:
+    """
+    Returns the overflows of the allocations in highway_map, created on the first call:
+        - roads: {road id: number of connections sharing a lane because the road was full}.
+        - borders: {(comp_path, face): number of connections without a free address on the face}.
+        - failures: list with the names of the connections that could not be routed.
+    """
+    if "congestion" not in highway_map:
+        highway_map["congestion"] = {"roads": {}, "borders": {}, "failures": []}
+    return highway_map["congestion"]
 
-def deallocate_a_road_lane(highway_map: dict, road_name: str, lane: int):
-    # print(f' deallocate_a_road_lanethe lane={lane} from {road_name} ')
+def get_metrics(highway_map: dict) -> dict:
+    """
+    Returns the counters of the routing work in highway_map, created on the first call. They add up all the routing passes and are not rolled back:
+        - probe_iterations: Histogram {number of offsets tried: number of ranges} of allocate_an_address_on_border, for each free range tried.
+        - offroad_collisions: The number of offroad lanes tried for an address on a border and found used by another connection.
+    """
+    if "metrics" not in highway_map:
+        highway_map["metrics"] = {"probe_iterations": {}, "offroad_collisions": 0}
+    return highway_map["metrics"]
 
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-    allocations = local_roads_map["allocations"][road_name]
-    if lane in allocations:
-        # print(f'  FALSE', allocations)
-        allocations.remove(lane)
+def get_routing_stats(highway_map: dict) -> dict:
+    """
+    Returns the statistics of the allocations in highway_map once the connections are routed, to see how close the roads and the faces are to be full:
+        - road_allocations: {road name: (connections, capacity)} for all the roads, the connections sharing the center lane of a full road are included.
+        - road_usage: Histogram {percent: number of roads} of the connections over the capacity of the roads, by steps of 10%, the full roads are in 100.
+        - border_allocations: {(comp_path, face): number of addresses} for the faces with addresses allocated.
+        - failed_road_allocations: The number of connections sharing the center lane of a full road.
+        - failed_border_allocations: The number of addresses not allocated because the face was full.
+        - unrouted: list with the names of the connections that could not be routed.
+        - probe_iterations and offroad_collisions: The counters of get_metrics.
+    """
+    congestion = get_congestion(highway_map)
+    metrics = get_metrics(highway_map)
+    road_allocations = {}
+    road_usage = {}
+    for road, name in enumerate(highway_map.road_names):
+        connections = len(highway_map.road_allocations[road]) + congestion["roads"].get(road, 0)
+        capacity = get_road_capacity(highway_map, road)
+        road_allocations[name] = (connections, capacity)
+        percent = min(10 * int(10 * connections / capacity), 100) if capacity > 0 else (100 if connections > 0 else 0)
+        road_usage[percent] = road_usage.get(percent, 0) + 1
+
+    border_allocations = {}
+    for comp_path, address in highway_map["addresses"].items():
+        for face, offsets in address.get("allocarions", {}).items():
+            if len(offsets) > 0:
+                border_allocations[(comp_path, face)] = len(offsets)
+
+    return {
+        "road_allocations": road_allocations,
+        "road_usage": dict(sorted(road_usage.items())),
+        "border_allocations": border_allocations,
+        "failed_road_allocations": sum(congestion["roads"].values()),
+        "failed_border_allocations": sum(congestion["borders"].values()),
+        "unrouted": list(congestion["failures"]),
+        "probe_iterations": dict(sorted(metrics["probe_iterations"].items())),
+        "offroad_collisions": metrics["offroad_collisions"],
+        }
+
+def _count_overflow(highway_map, counter, key):
+    counter[key] = counter.get(key, 0) + 1
+    highway_map.log_undo(_uncount_overflow, counter, key)
+
+def _uncount_overflow(counter, key):
+    counter[key] -= 1
+    if counter[key] == 0:
+        del counter[key]
+
+# The allocations done while recording (see start_recording), None when they are not recorded
+_recorded_allocations = None
+
+def _record(*allocation):
+    if _recorded_allocations is not None:
+        _recorded_allocations.append(allocation)
+
+def start_recording():
+    """
+    Starts recording the allocations done in the highway maps, used to replay the allocations of a cached route (see route_cache).
+    """
+    global _recorded_allocations
+    _recorded_allocations = []
+
+def stop_recording() -> list[tuple]:
+    """
+    Stops recording and returns the allocations done since start_recording, each one a tuple (kind, arguments...):
+    ("lane", road id, lane), ("border", comp_path, face, offset), ("offroad_horizontal_lane", lane_line), ("offroad_vertical_lane", lane_line),
+    ("road_overflow", road id) or ("border_overflow", comp_path, face).
+    """
+    global _recorded_allocations
+    res = _recorded_allocations if _recorded_allocations is not None else []
+    _recorded_allocations = None
+    return res
+
+def are_allocations_free(highway_map: dict, allocations: list[tuple]) -> bool:
+    """
+    Returns True if all the lanes, addresses and offroad lanes of the recorded allocations are still free in highway_map.
+    """
+    for allocation in allocations:
+        kind = allocation[0]
+        if kind == "lane":
+            if not is_road_lane_available(highway_map, allocation[1], allocation[2]):
+                return False
+        elif kind == "border":
+            if not is_border_offset_available(highway_map, allocation[1], allocation[2], allocation[3]):
+                return False
+        elif kind == "offroad_horizontal_lane":
+            if not is_free_offroad_horizontal_lane(highway_map, list(allocation[1])):
+                return False
+        elif kind == "offroad_vertical_lane":
+            if not is_free_offroad_vertical_lane(highway_map, list(allocation[1])):
+                return False
+    return True
 
-def allocate_a_road_lane(highway_map: dict, road: str, do_alloc: bool = True, prev_allocation: tuple[str, int]|None = None) -> int:
+def replay_allocations(highway_map: dict, allocations: list[tuple]):
+    """
+    Does again the recorded allocations (see stop_recording) in highway_map, in the same order.
+    """
+    congestion = get_congestion(highway_map)
+    for allocation in allocations:
+        kind = allocation[0]
+        if kind == "lane":
+            allocate_the_road_lane(highway_map, allocation[1], allocation[2])
+        elif kind == "border":
+            allocate_the_border_offset(highway_map, allocation[1], allocation[2], allocation[3])
+        elif kind == "offroad_horizontal_lane":
+            allocate_offroad_horizontal_lane(highway_map, list(allocation[1]))
+        elif kind == "offroad_vertical_lane":
+            allocate_offroad_vertical_lane(highway_map, list(allocation[1]))
+        elif kind == "road_overflow":
+            _count_overflow(highway_map, congestion["roads"], allocation[1])
+        elif kind == "border_overflow":
+            _count_overflow(highway_map, congestion["borders"], (allocation[1], allocation[2]))
+
+def allocate_a_road_lane(highway_map: HighwayMap, road: int, do_alloc: bool = True, prev_allocation: tuple[int, int]|None = None) -> int:
     """
     Automatically allocates a lane in a road. Multiple lanes are used to avoi passing one connection over other.
     
     highway_map: map generated by do_svg_architecture.recurrent_layout_sizing. All coordinates are in pixels in the svg context.
-    road: The name of the road to alloc a lane.
+    road: The id of the road to alloc a lane.
     do_alloc: True = really execute an allocation. If False, just get a road lane without allocating it.
     prev_allocation: A previous allocation of this road/lane (e.g. by comp 1). Usualy this is used to pass the last allocation from comp1, if it matches this road for comp2, there is no need to alloc a new one.
     
     return: the lane, which is an absolute position perpendicular to the deirection of the road.
     """
-    print(f'allocate_a_road_lane road={road}, prev_allocation={prev_allocation}')
-    local_roads_map = highway_map["roads"]
-    rect = local_roads_map["rects"][road]
-    orientation = local_roads_map["orientations"][road]
-    print(f' road rect={rect}')
+    rect = highway_map.road_rects[road] # (x1, y1, x2, y2)
+    orientation = highway_map.road_orientations[road]
     
     if prev_allocation != None and road == prev_allocation[0]:
+        if trace.enabled:
+            trace.event("allocate_a_road_lane", prev_allocation[1], road=highway_map.road_names[road], rect=rect, prev_allocation=prev_allocation)
         return prev_allocation[1]
 
-    if orientation == DirType.VERTICAL:
-        delta = int(rect[2]/2) # I want the perpendicular direction
-        offset = int(rect[0] + delta)
-    else:
-        delta = int(rect[3]/2)
-        offset = int(rect[1] + delta)
-
-    print(f' delta={delta}, offset={offset}')
-
-    for init in [0, 5, 2, 8]: # Keep trying with different interlacing 
-        print(f'   init={init}')
-        for relative_lane in range (init, delta, 10):
-            print(f'     relative_lane={relative_lane}')
-            lane = offset + relative_lane
-            print(f'      lane={lane} going up')
-            if is_road_lane_available(highway_map, road, lane):
-                allocate_the_road_lane(highway_map, road, lane) if do_alloc == True else None
-                print(f'        Get this')
-                return lane
-            lane = offset - relative_lane
-            print(f'      lane={lane} going down')
-            if is_road_lane_available(highway_map, road, lane):
-                allocate_the_road_lane(highway_map, road, lane) if do_alloc == True else None
-                print(f'        Get this')
-                return lane
+    lane = highway_map.road_allocations[road].first_free(get_road_lanes(highway_map, road))
+    if lane is not None:
+        allocate_the_road_lane(highway_map, road, lane) if do_alloc == True else None
+        if trace.enabled:
+            trace.event("allocate_a_road_lane", lane, road=highway_map.road_names[road], rect=rect, do_alloc=do_alloc)
+        return lane
 
     # if orientation == DirType.VERTICAL:
         # init = int(rect[0] + 5)  # I want the perpendicular direction
@@ -314,60 +528,64 @@ def allocate_a_road_lane(highway_map: dict, road: str, do_alloc: bool = True, pr
             # allocate_the_road_lane(highway_map, road, lane)
             # return lane
 
-    return init # No allocation, re-use something else shared
+    # No allocation, re-use the center lane shared with other connections
+    if orientation == DirType.VERTICAL:
+        lane = int(rect[0] + int((rect[2] - rect[0])/2))
+    else:
+        lane = int(rect[1] + int((rect[3] - rect[1])/2))
+    if do_alloc == True:
+        _count_overflow(highway_map, get_congestion(highway_map)["roads"], road)
+        _record("road_overflow", road)
+    if trace.enabled:
+        trace.event("allocate_a_road_lane", lane, road=highway_map.road_names[road], rect=rect, do_alloc=do_alloc, shared=True)
+    return lane
+
+def get_offroad_lanes(highway_map: dict, kind: str) -> dict:
+    """
+    Returns the offroad lanes of a kind ("offroad_horizontal_lane" or "offroad_vertical_lane") indexed by their fixed coordinate:
+    {y: IntervalSet of x ranges} for the horizontal lanes and {x: IntervalSet of y ranges} for the vertical ones.
+    """
+    allocations = highway_map["roads"]["allocations"]
+    if not kind in allocations:
+        allocations[kind] = {}
+    return allocations[kind]
+
+def _add_offroad_lane(highway_map, lanes, coord, low, high):
+    # Adds the range [low, high] to the lanes at coord, the ranges are merged so the undo puts back a copy of the previous ones
+    if not coord in lanes:
+        lanes[coord] = IntervalSet()
+        highway_map.log_undo(lanes.pop, coord)
+    elif highway_map.undo_log is not None:
+        highway_map.log_undo(lanes.__setitem__, coord, IntervalSet(lanes[coord]))
+    lanes[coord].add(low, high)
 
 def is_free_offroad_horizontal_lane(highway_map, lane_line):
-
-    def is_horizontal_overlapping(lane_line, lane):
-        if lane_line[1] != lane_line[3] or lane_line[1] != lane[1] or lane_line[1] != lane[3]:
-            return False
-        # Check if they overlap
-        return lane_line[3] >= lane[1] and lane[3] >= lane_line[1]
+    # A lane is free if no other lane on the same y overlaps its x range, the lane_line is not changed
     # print(f' is_free_offroad_horizontal_lane for {lane_line}')
     
-    if (lane_line[0] > lane_line[2]): # Ensure right order
-        lane_line[0], lane_line[2] = lane_line[2], lane_line[0]
-
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-
-    if not "offroad_horizontal_lane" in local_roads_map["allocations"]:
-        local_roads_map["allocations"]["offroad_horizontal_lane"] = []
-        
-    for lane in local_roads_map["allocations"]["offroad_horizontal_lane"]:
-        if is_horizontal_overlapping(lane_line, lane):
-            # print(f'   It is NOT free')
+    if lane_line[1] != lane_line[3]: # Not horizontal
+        return True
 
-            return False
+    lanes = get_offroad_lanes(highway_map, "offroad_horizontal_lane").get(lane_line[1])
+    if lanes is not None and lanes.overlaps(min(lane_line[0], lane_line[2]), max(lane_line[0], lane_line[2])):
+        # print(f'   It is NOT free')
+        return False
 
     # print(f'   It is free')
     return True
     
 def is_free_offroad_vertical_lane(highway_map, lane_line):
-
-    def is_vertical_overlapping(lane_line, lane):
-        if lane_line[0] != lane_line[2] or lane_line[0] != lane[0] or lane_line[0] != lane[2]:
-            return False
-        # Check if they overlap
-        return lane_line[2] >= lane[0] and lane[2] >= lane_line[0]
-
+    # A lane is free if no other lane on the same x overlaps its y range, the lane_line is not changed
     # print(f' is_free_offroad_vertical_lane for {lane_line}')
 
-    if (lane_line[1] > lane_line[3]): # Ensure right order
-        lane_line[1], lane_line[3] = lane_line[3], lane_line[1]
-
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-
-    if not "offroad_vertical_lane" in local_roads_map["allocations"]:
-        local_roads_map["allocations"]["offroad_vertical_lane"] = []
-    
-    for lane in local_roads_map["allocations"]["offroad_vertical_lane"]:
-        if is_vertical_overlapping(lane_line, lane):
-            print(f'   It is NOT free')
-            return False
+    if lane_line[0] != lane_line[2]: # Not vertical
+        return True
 
-    # print(f'    offroad_vertical_lane = {local_roads_map["allocations"]["offroad_vertical_lane"]}')
+    lanes = get_offroad_lanes(highway_map, "offroad_vertical_lane").get(lane_line[0])
+    if lanes is not None and lanes.overlaps(min(lane_line[1], lane_line[3]), max(lane_line[1], lane_line[3])):
+        if trace.enabled:
+            trace.event("is_free_offroad_vertical_lane", False, lane_line=lane_line, lanes=list(lanes))
+        return False
 
     # print(f'   It is free')
     return True
@@ -378,13 +596,8 @@ def allocate_offroad_horizontal_lane(highway_map, lane_line):
     if (lane_line[0] > lane_line[2]): # Ensure right order
         lane_line[0], lane_line[2] = lane_line[2], lane_line[0]
 
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-    
-    if not "offroad_horizontal_lane" in local_roads_map["allocations"]:
-        local_roads_map["allocations"]["offroad_horizontal_lane"] = []
-    
-    local_roads_map["allocations"]["offroad_horizontal_lane"].append(lane_line)
+    _add_offroad_lane(highway_map, get_offroad_lanes(highway_map, "offroad_horizontal_lane"), lane_line[1], lane_line[0], lane_line[2])
+    _record("offroad_horizontal_lane", tuple(lane_line))
 
 def allocate_offroad_vertical_lane(highway_map, lane_line):
     # print(f' allocate_offroad_vertical_lane for {lane_line}')
@@ -392,27 +605,28 @@ def allocate_offroad_vertical_lane(highway_map, lane_line):
     if (lane_line[1] > lane_line[3]): # Ensure right order
         lane_line[1], lane_line[3] = lane_line[3], lane_line[1]
 
-    local_roads_map = highway_map["roads"]
-    # if road_name in local_roads_map:
-    
-    if not "offroad_vertical_lane" in local_roads_map["allocations"]:
-        local_roads_map["allocations"]["offroad_vertical_lane"] = []
-    
-    local_roads_map["allocations"]["offroad_vertical_lane"].append(lane_line)
+    _add_offroad_lane(highway_map, get_offroad_lanes(highway_map, "offroad_vertical_lane"), lane_line[0], lane_line[1], lane_line[3])
+    _record("offroad_vertical_lane", tuple(lane_line))
 
 def is_offroad_lane_available(highway_map: dict, offset: int, range_for_checking: None | list[int|None, int|None, int|None, int|None]):
+    """
+    Returns True if the offroad lane at offset is free: range_for_checking [x1, y1, x2, y2] with the missing axis (None axis) replaced by offset.
+    range_for_checking is not changed, so the same range is tested for all the offsets tried on a border.
+    """
     if range_for_checking != None and isinstance(range_for_checking, list) and len(range_for_checking) == 4:
 
         # print(f" is_offroad_lane_available offset={offset} range_for_checking={range_for_checking}")
         
         # Replace the missing axis (None axis) with offset and test.
-        if range_for_checking[0] == None and range_for_checking[2] == None:
-            range_for_checking[0] = offset
-            range_for_checking[2] = offset
-            return is_free_offroad_vertical_lane(highway_map, range_for_checking)
-        elif range_for_checking[1] == None and range_for_checking[3] == None:
-            range_for_checking[1] = offset
-            range_for_checking[3] = offset
-            return is_free_offroad_horizontal_lane(highway_map, range_for_checking)
+        x1, y1, x2, y2 = range_for_checking
+        if x1 == None and x2 == None:
+            res = is_free_offroad_vertical_lane(highway_map, (offset, y1, offset, y2))
+        elif y1 == None and y2 == None:
+            res = is_free_offroad_horizontal_lane(highway_map, (x1, offset, x2, offset))
+        else:
+            return True
+        if not res: # Counted here only, the checks of the cached routes (see are_allocations_free) are not collisions
+            get_metrics(highway_map)["offroad_collisions"] += 1
+        return res
 
     return True # Default
\ No newline at end of file
@@ -0,0 +1,132 @@
+import math
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, the pure python kernels are used without it
+    np = None
+
+from plantuml.connection_state_manager import Dir
+from plantuml.interval_set import IntervalSet
+
+# Below this number of rectangles the conversion to arrays costs more than the python loop
+NUMPY_MIN_SIZE = 32
+
+def use_numpy(size):
+    """
+    Returns True if the batched kernels shall use numpy for size elements.
+    """
+    return np is not None and size >= NUMPY_MIN_SIZE
+
+def _columns(rects):
+    # Returns the rectangles [(x1, y1, x2, y2)] as four numpy arrays
+    array = np.asarray(rects)
+    return array[:, 0], array[:, 1], array[:, 2], array[:, 3]
+
+####################################################################################################
+# Scalar kernels, a rectangle is a tuple (x1, y1, x2, y2) in absolute coordinates
+
+def ranges_overlap(a1, a2, b1, b2):
+    """
+    Returns True if the closed ranges [a1, a2] and [b1, b2] overlap, touching ranges overlap.
+    """
+    return a1 <= b2 and b1 <= a2
+
+def are_rects_in_same_row(rect1, rect2):
+    """
+    Returns True if the vertical dimensions of the two rectangles overlap each other.
+    """
+    return ranges_overlap(rect1[1], rect1[3], rect2[1], rect2[3])
+
+def are_rects_in_same_column(rect1, rect2):
+    """
+    Returns True if the horizontal dimensions of the two rectangles overlap each other.
+    """
+    return ranges_overlap(rect1[0], rect1[2], rect2[0], rect2[2])
+
+def get_rect_distance(rect1, rect2):
+    """
+    Returns the closest distance vector (dx, dy) from rect1 to rect2, 0 in the dimensions where they overlap.
+    """
+    dx = 0
+    if rect2[2] < rect1[0]:
+        dx = rect2[2] - rect1[0]
+    elif rect2[0] > rect1[2]:
+        dx = rect2[0] - rect1[2]
+
+    dy = 0
+    if rect2[3] < rect1[1]:
+        dy = rect2[3] - rect1[1]
+    elif rect2[1] > rect1[3]:
+        dy = rect2[1] - rect1[3]
+
+    return (dx, dy)
+
+def is_rect_in_the_path(rect, coord, dir):
+    """
+    Returns True if the rectangle is found by a ray from coord (x, y) in the direction dir.
+    """
+    if dir == Dir.RIGHT:
+        return rect[1] <= coord[1] <= rect[3] and rect[0] > coord[0]
+    elif dir == Dir.LEFT:
+        return rect[1] <= coord[1] <= rect[3] and rect[2] < coord[0]
+    elif dir == Dir.DOWN:
+        return rect[0] <= coord[0] <= rect[2] and rect[1] > coord[1]
+    else: #dir == Dir.UP:
+        return rect[0] <= coord[0] <= rect[2] and rect[3] < coord[1]
+
+def normalize_vector(vector):
+    """
+    Returns the vector (dx, dy) with length 1, or (0, 0) for a null vector.
+    """
+    magnitude = math.sqrt(vector[0]**2 + vector[1]**2)
+    if magnitude == 0:
+        return (0, 0)
+    return (vector[0] / magnitude, vector[1] / magnitude)
+
+def get_border_port(rect, vector):
+    """
+    Returns the face (Dir) and the point (x, y) where a ray from the center of the rectangle in the direction vector (dx, dy) crosses its border.
+    A null vector gives the center of the right face.
+    """
+    xc = (rect[0] + rect[2]) / 2
+    yc = (rect[1] + rect[3]) / 2
+    dx, dy = vector
+    # Left or right face when the slope of the vector is not above the slope of the diagonal, compared without division
+    if (dx != 0 and abs(dy) * (rect[2] - rect[0]) <= (rect[3] - rect[1]) * abs(dx)) or (dx == 0 and dy == 0):
+        if dx < 0:
+            return (Dir.LEFT, (rect[0], yc + (rect[0] - xc) * dy / dx))
+        return (Dir.RIGHT, (rect[2], yc + ((rect[2] - xc) * dy / dx if dx != 0 else 0)))
+    if dy > 0:
+        return (Dir.DOWN, (xc + (rect[3] - yc) * dx / dy, rect[3]))
+    return (Dir.UP, (xc + (rect[1] - yc) * dx / dy, rect[1]))
+
+####################################################################################################
+# Batched kernels, they return the same results as the scalar ones for lists of rectangles
+
+def batch_same_row(rects1, rects2):
+    """
+    Returns a list of bools, True where rects1[i] and rects2[i] are in the same row.
+    """
+    if not use_numpy(len(rects1)):
+        return [are_rects_in_same_row(rect1, rect2) for rect1, rect2 in zip(rects1, rects2)]
+    a_x1, a_y1, a_x2, a_y2 = _columns(rects1)
+    b_x1, b_y1, b_x2, b_y2 = _columns(rects2)
+    return ((a_y1 <= b_y2) & (b_y1 <= a_y2)).tolist()
+
+def batch_same_column(rects1, rects2):
+    """
+    Returns a list of bools, True where rects1[i] and rects2[i] are in the same column.
+    """
+    if not use_numpy(len(rects1)):
+        return [are_rects_in_same_column(rect1, rect2) for rect1, rect2 in zip(rects1, rects2)]
+    a_x1, a_y1, a_x2, a_y2 = _columns(rects1)
+    b_x1, b_y1, b_x2, b_y2 = _columns(rects2)
+    return ((a_x1 <= b_x2) & (b_x1 <= a_x2)).tolist()
+
+def subtract_ranges(reference, exclusions):
+    """
+    Returns the list of ranges [(r1, r2)] left from the reference range (x1, x2) that are not overlapped by the exclusion ranges, in ascending order.
+    An exclusion only touching a range does not cut it, and an empty exclusion inside a range splits it in two.
+    The exclusions are merged in an IntervalSet, the ranges are the gaps between them.
+    """
+    return IntervalSet(exclusions).gaps(reference[0], reference[1])
@@ -0,0 +1,98 @@
+import bisect
+
+class IntervalSet:
+    """
+    Set of closed intervals [low, high] kept sorted and without overlapping, used for the free ranges and the allocations of the routing.
+    An interval added over or touching other intervals is merged with them, so the set is the union of all the intervals added.
+    A point is an interval with low == high (e.g. the offset of an address on a border).
+    The lookups are binary searches, O(log n). Adding or removing an interval is O(log n) plus the shift of the lists.
+
+    intervals: Optional iterable of tuples (low, high) added to the set.
+    """
+    def __init__(self, intervals=()):
+        self.lows = []
+        self.highs = []
+        for low, high in sorted(intervals):
+            if len(self.highs) > 0 and low <= self.highs[-1]: # Sorted, so it can only touch the last one
+                self.highs[-1] = max(self.highs[-1], high)
+            else:
+                self.lows.append(low)
+                self.highs.append(high)
+
+    def __len__(self):
+        return len(self.lows)
+
+    def __iter__(self):
+        return zip(self.lows, self.highs)
+
+    def __contains__(self, value):
+        return self.overlaps(value, value)
+
+    def __repr__(self):
+        return f"IntervalSet({list(self)})"
+
+    def add(self, low, high):
+        """
+        Adds the interval [low, high], merged with the intervals overlapping or touching it.
+        """
+        first = bisect.bisect_left(self.highs, low) # First interval ending at low or after
+        last = bisect.bisect_right(self.lows, high) # After the last interval starting at high or before
+        if first < last:
+            low = min(low, self.lows[first])
+            high = max(high, self.highs[last-1])
+        self.lows[first:last] = [low]
+        self.highs[first:last] = [high]
+
+    def remove(self, low, high):
+        """
+        Removes the interval [low, high] from the set.
+        The parts of the intervals outside it are kept, including their ends at low or high. A point is removed by any interval containing it.
+        Removing a point from inside a longer interval does not change it.
+        """
+        first = bisect.bisect_left(self.highs, low)
+        last = bisect.bisect_right(self.lows, high)
+        lows = []
+        highs = []
+        for item_low, item_high in zip(self.lows[first:last], self.highs[first:last]):
+            if low == high and item_low < low < item_high:
+                lows.append(item_low)
+                highs.append(item_high)
+                continue
+            if item_low < low:
+                lows.append(item_low)
+                highs.append(low)
+            if item_high > high:
+                lows.append(high)
+                highs.append(item_high)
+        self.lows[first:last] = lows
+        self.highs[first:last] = highs
+
+    def overlaps(self, low, high) -> bool:
+        """
+        Returns True if an interval of the set overlaps [low, high], touching intervals overlap.
+        """
+        first = bisect.bisect_left(self.highs, low)
+        return first < len(self.lows) and self.lows[first] <= high
+
+    def gaps(self, low, high) -> list[tuple]:
+        """
+        Returns the ranges [(r1, r2)] of [low, high] not covered by the set, in ascending order. A range has always r1 < r2.
+        An interval only touching a range does not cut it, and a point inside a range splits it in two.
+        """
+        res = []
+        cursor = low
+        first = bisect.bisect_left(self.highs, low)
+        last = bisect.bisect_left(self.lows, high) # The intervals starting at high only touch the last range
+        for item_low, item_high in zip(self.lows[first:last], self.highs[first:last]):
+            if item_low > cursor:
+                res.append((cursor, item_low))
+            cursor = max(cursor, item_high)
+        if cursor < high:
+            res.append((cursor, high))
+        return res
+
+    def largest_gap(self, low, high) -> tuple|None:
+        """
+        Returns the longest range (r1, r2) of [low, high] not covered by the set, the first one if several have the same length, or None if it is all covered.
+        """
+        return max(self.gaps(low, high), key=lambda gap: gap[1] - gap[0], default=None)
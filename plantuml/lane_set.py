@@ -0,0 +1,83 @@
+import functools
+
+class LaneSet:
+    """
+    Set of the lanes allocated on a road or of the offsets allocated on the face of a component, used by the routing.
+    The lanes are integer positions in pixels, close to each other (inside the width of a road or the length of a face), so they
+    are kept as the bits of an integer from the lowest lane added: testing, adding and removing a lane only touch a few machine words.
+
+    lanes: Optional iterable of lanes added to the set.
+    """
+    def __init__(self, lanes=()):
+        self.base = None # The lane of the bit 0, the lowest lane added
+        self.bits = 0
+        self.count = 0
+        for lane in lanes:
+            self.add(lane)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # In ascending order
+        bits = self.bits
+        lane = self.base
+        while bits:
+            if bits & 1:
+                yield lane
+            bits >>= 1
+            lane += 1
+
+    def __contains__(self, lane):
+        return self.base is not None and lane >= self.base and (self.bits >> (lane - self.base)) & 1 == 1
+
+    def __repr__(self):
+        return f"LaneSet({list(self)})"
+
+    def add(self, lane: int):
+        """
+        Adds the lane to the set, nothing is done if it is already in it.
+        """
+        if self.base is None:
+            self.base = lane
+        elif lane < self.base:
+            self.bits <<= self.base - lane
+            self.base = lane
+        bit = 1 << (lane - self.base)
+        if not self.bits & bit:
+            self.bits |= bit
+            self.count += 1
+
+    def discard(self, lane: int):
+        """
+        Removes the lane from the set if it is in it.
+        """
+        if lane in self:
+            self.bits &= ~(1 << (lane - self.base))
+            self.count -= 1
+
+    def first_free(self, lanes, is_available=None) -> int|None:
+        """
+        Returns the first lane of lanes not in the set, or None if they are all in it.
+        lanes: The lanes to be tried in order, usually the center of a road or a face plus the shifts of get_interlaced_shifts.
+        is_available: Optional function (lane) -> bool, the lanes for which it returns False are skipped.
+        """
+        for lane in lanes:
+            if not lane in self and (is_available is None or is_available(lane)):
+                return lane
+        return None
+
+@functools.lru_cache(maxsize=256)
+def get_interlaced_shifts(delta: int, step: int) -> tuple[int, ...]:
+    """
+    Returns the shifts from the center of the lanes of a road or a face, in the order they are allocated: from the center to the borders
+    every step pixels (one side then the other), then again interlaced between them. A shift can be repeated, the 0 is tried twice.
+    delta: The half width of the road or the face, the shifts are in ]-delta, delta[.
+    step: The distance between two lanes of the same pass.
+    """
+    res = []
+    for init in [0, 5, 2, 8]: # Keep trying with different interlacing
+        for shift in range(init, delta, step):
+            res.append(shift)
+            res.append(-shift)
+    return tuple(res)
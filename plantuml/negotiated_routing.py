@@ -0,0 +1,122 @@
+import copy
+import time
+import plantuml.connection_state_manager as csm
+import plantuml.connection_routing as cr
+import plantuml.road_graph as rg
+import plantuml.routing_trace as trace
+
+MAX_ITERATIONS = 8 # Default number of times all the connections are routed
+HISTORY_COST = 20 # Added to the history of a road or a face for each connection above its capacity in an iteration
+PRESENT_COST = 30 # Cost of a connection above the capacity of a road in the second iteration, doubled in each following iteration
+
+def save_allocations(highway_map: dict) -> dict:
+    """
+    Returns a copy of the allocations of highway_map: the lanes of the roads, the addresses of the components and the congestion.
+    """
+    return copy.deepcopy({
+        "road_allocations": highway_map.road_allocations,
+        "allocations": highway_map["roads"]["allocations"],
+        "addresses": highway_map["addresses"],
+        "congestion": csm.get_congestion(highway_map),
+        })
+
+def restore_allocations(highway_map: dict, saved: dict):
+    """
+    Replaces the allocations of highway_map with a copy returned by save_allocations, ripping up all the connections routed after it.
+    """
+    saved = copy.deepcopy(saved)
+    highway_map.road_allocations = saved["road_allocations"]
+    highway_map["roads"]["allocations"] = saved["allocations"]
+    highway_map["addresses"] = saved["addresses"]
+    highway_map["congestion"] = saved["congestion"]
+
+def get_overflows(highway_map: dict) -> dict:
+    """
+    Returns the overflows of the last routing: the roads and the faces of the components used above their capacity.
+    The keys are the road ids and the faces (comp_path, face), the values are the number of connections above the capacity.
+    """
+    congestion = csm.get_congestion(highway_map)
+    res = {}
+    for road, count in congestion["roads"].items():
+        if count > 0:
+            res[road] = count
+    for face, count in congestion["borders"].items():
+        if count > 0:
+            res[face] = count
+    return res
+
+def route_connections(arch, connections: list, highway_map: dict, layout_style: dict, max_iterations: int = MAX_ITERATIONS, time_budget: float|None = None):
+    """
+    Routes all the connections with negotiated congestion (PathFinder): the connections are routed one after another like in a single pass,
+    then if a road or the face of a component is used above its capacity, all the connections are ripped up and routed again in the same order.
+    The roads and the faces used above their capacity get more expensive on each iteration, so the connections routed first leave them to the
+    ones that need them. The iterations stop when there is no overflow, when an iteration has the same overflows as the previous one (the costs
+    did not move any connection, they only change the routes with roads), or when the budget is spent. The allocations of the best iteration are kept.
+
+    arch: The architecture of the diagram, with the layout done.
+    connections: list of the PlantumlConnection objects to be routed, in routing order.
+    highway_map: map generated by do_svg_architecture, without any connection allocated yet.
+    layout_style: The layout style dictionary used to print the connections.
+    max_iterations: Maximum number of times all the connections are routed, at least 1.
+    time_budget: Maximum time in seconds, no new iteration is started after it. None for no limit.
+
+    return: a tuple (routed, stats) where routed is a dictionary {name: svg string} like route_svg_comonnection and stats is a dictionary with:
+        - iterations: The number of iterations done.
+        - converged: True if the last iteration had no overflow.
+        - best_iteration: The index of the iteration kept, starting on 0.
+        - overflows: The number of connections above the capacity of the roads and faces, for each iteration.
+        - failures: The number of connections without a route, for each iteration.
+        - duration: The total time in seconds.
+    """
+    start = time.perf_counter()
+    road_graph = rg.get_road_graph(highway_map)
+    initial = save_allocations(highway_map)
+    stats = {"iterations": 0, "converged": False, "best_iteration": 0, "overflows": [], "failures": [], "duration": 0}
+    best = None # (failures, overflow, iteration, routed, allocations)
+    previous_overflows = None
+    cache = highway_map.get("route_cache")
+
+    road_graph.history = {}
+    road_graph.present_factor = 0 # The first iteration is the same as a single pass
+    for iteration in range(max(max_iterations, 1)):
+        restore_allocations(highway_map, initial)
+        if iteration > 0:
+            highway_map["route_cache"] = None # The cached routes would ignore the congestion costs
+        routed = {}
+        for obj in connections:
+            routed.update(cr.route_svg_comonnection(arch, obj.name, obj, highway_map, layout_style))
+
+        overflows = get_overflows(highway_map)
+        overflow = sum(overflows.values())
+        failures = len(csm.get_congestion(highway_map)["failures"])
+        stats["iterations"] += 1
+        stats["overflows"].append(overflow)
+        stats["failures"].append(failures)
+        if trace.enabled:
+            trace.event("route_connections", overflows, iteration=iteration, failures=failures)
+
+        if best is None or (failures, overflow) < best[:2]:
+            best = (failures, overflow, iteration, routed, save_allocations(highway_map))
+        if overflow == 0: # The failures do not depend on the congestion, the roads give always a route when there is one
+            stats["converged"] = True
+            break
+        if overflows == previous_overflows: # Stalled, the next iterations would route the same way
+            break
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            break
+        previous_overflows = overflows
+
+        # Negotiation: the overused resources get more expensive, for this iteration and for all the following ones
+        for resource, count in overflows.items():
+            road_graph.history[resource] = road_graph.history.get(resource, 0) + HISTORY_COST * count
+        road_graph.present_factor = PRESENT_COST if road_graph.present_factor == 0 else 2 * road_graph.present_factor
+
+    highway_map["route_cache"] = cache
+    failures, overflow, iteration, routed, allocations = best
+    if iteration != stats["iterations"] - 1:
+        restore_allocations(highway_map, allocations)
+    road_graph.history = {}
+    road_graph.present_factor = 0
+    stats["best_iteration"] = iteration
+    stats["duration"] = time.perf_counter() - start
+    return routed, stats
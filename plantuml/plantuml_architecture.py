@@ -64,23 +64,10 @@ def create_plant_comonnection(name, plantuml_obj, indent=0):
         line = "<-[norank]-"
 
     conn_str = ""
-    if isinstance(plantuml_obj.comp1, list):
-        path2 = plantuml_obj.comp2.ref.path
-        for item in plantuml_obj.comp1:
-            path1 = item.ref.path
-            conn_str += f"{path1} {line} {path2} {color} : {name}\n"
-        
-    elif isinstance(plantuml_obj.comp2, list):
-        path1 = plantuml_obj.comp1.ref.path
-        for item in plantuml_obj.comp2:
-            path2 = item.ref.path
-            conn_str += f"{path1} {line} {path2} {color} : {name}\n"
-        # path2 = plantuml_obj.comp2.ref.path
-        # return {name:f"{path1} {line} {path2} {color} : {name}"}
-    else:
-        path1 = plantuml_obj.comp1.ref.path
-        path2 = plantuml_obj.comp2.ref.path
-        conn_str = f"{path1} {line} {path2} {color} : {name}"
+    for index, comp1, comp2 in plantuml_obj.get_endpoint_pairs():
+        conn_str += f"{comp1.path} {line} {comp2.path} {color} : {name}"
+        if index is not None: # One line per single connection
+            conn_str += "\n"
     return {name:conn_str}
 
 
@@ -133,45 +120,55 @@ def do_plantuml_architecture(plantuml_arch, **kwargs):
         plantuml_arch -- A class of a PlantumlType type.
         kwargs -- Optional key/value arguments.
     """
-    def recurrent(obj, connections, indent):
-        path = ""
-        
-        # First add the layout_connectors to the connections dictionary
+    def add_layout_connectors(obj, connections):
+        # Add the layout_connectors to the connections dictionary
         if isinstance(obj, pt.PlantumlArchitecture) and "layout_connectors" in obj.metadata_dict:
             for value in obj.metadata_dict["layout_connectors"]:
                 str = f"  {value[0].ref.path} {value[1]} {value[2].ref.path}"
                 connections.update({str:str})
-        for name, value in inspect.getmembers(obj):
-            if not inspect.isroutine(value) and not name.startswith('__'):
-                if isinstance(value, pt.PlantumlType):
-                    path = value.path
-                    if isinstance(value, pt.PlantumlConnection):
-                        if value.is_visible():
-                            # Add this connection to the connections dictionary
-                            connections.update(create_plant_comonnection(value.name, value, indent))
-                    else:
-                        print_plant_component(value.name, value, indent)
-
-                if isinstance(value, pt.PlantumlType) and not isinstance(value, pt.PlantumlConnection):# and is_container(value):
-                    recurrent(value, connections, indent+1)
-                if isinstance(value, pt.PlantumlComponent) or\
-                    isinstance(value, pt.PlantumlGroup) or \
-                    isinstance(value, pt.PlantumlActor) or \
-                    isinstance(value, pt.PlantumlFrame) or \
-                    isinstance(value, pt.PlantumlFolder) or \
-                    isinstance(value, pt.PlantumlDatabase) or \
-                    isinstance(value, pt.PlantumlPackage):
-                    if value.has_sub_objs():
-                        print_with_indent("}", indent)
-                if isinstance(value, pt.PlantumlType) and not isinstance(value, pt.PlantumlConnection) and value.metadata_dict['hide'] == True:
-                    print_with_indent(f"hide ${path}", indent)
-                if isinstance(value, pt.PlantumlType) and not isinstance(value, pt.PlantumlConnection) and value.metadata_dict['remove'] == True:
-                    print_with_indent(f"remove ${path}", indent)
-                if isinstance(value, pt.PlantumlType) and "note" in value.metadata_dict:
-                    
-                    note_path = path+"_note"
-                    # Add this note with its connection to the connections dictionary
-                    connections.update({note_path: f"note \"{value.metadata_dict['note']}\" as {note_path}\n{note_path} ~ {path}"})
+
+    def close_item(value, connections, indent):
+        # Called once all the children of value were printed
+        path = value.path
+        if isinstance(value, pt.PlantumlComponent) or\
+            isinstance(value, pt.PlantumlGroup) or \
+            isinstance(value, pt.PlantumlActor) or \
+            isinstance(value, pt.PlantumlFrame) or \
+            isinstance(value, pt.PlantumlFolder) or \
+            isinstance(value, pt.PlantumlDatabase) or \
+            isinstance(value, pt.PlantumlPackage):
+            if value.has_sub_objs():
+                print_with_indent("}", indent)
+        if not isinstance(value, pt.PlantumlConnection) and value.metadata_dict['hide'] == True:
+            print_with_indent(f"hide ${path}", indent)
+        if not isinstance(value, pt.PlantumlConnection) and value.metadata_dict['remove'] == True:
+            print_with_indent(f"remove ${path}", indent)
+        if "note" in value.metadata_dict:
+                
+            note_path = path+"_note"
+            # Add this note with its connection to the connections dictionary
+            connections.update({note_path: f"note \"{value.metadata_dict['note']}\" as {note_path}\n{note_path} ~ {path}"})
+
+    def walk_items(obj, connections):
+        add_layout_connectors(obj, connections)
+        open_items = [] # (value, depth) of the items waiting for their children
+        for value, depth, owner in obj.walk(include_connections=True):
+            while open_items and open_items[-1][1] >= depth:
+                item, item_depth = open_items.pop()
+                close_item(item, connections, item_depth-1)
+
+            if isinstance(value, pt.PlantumlConnection):
+                if value.is_visible():
+                    # Add this connection to the connections dictionary
+                    connections.update(create_plant_comonnection(value.name, value, depth-1))
+            else:
+                print_plant_component(value.name, value, depth-1)
+                add_layout_connectors(value, connections)
+            open_items.append((value, depth))
+
+        while open_items:
+            item, item_depth = open_items.pop()
+            close_item(item, connections, item_depth-1)
 
 
     connections = {} # Use dictionary to avoid duplications
@@ -180,7 +177,7 @@ def do_plantuml_architecture(plantuml_arch, **kwargs):
         print(plantuml_arch.metadata_dict["arrow_dir"])
     if "skinparam" in plantuml_arch.metadata_dict:
         print(plantuml_arch.metadata_dict["skinparam"])
-    recurrent(plantuml_arch, connections, 0)
+    walk_items(plantuml_arch, connections)
 
 
     show_connections = True
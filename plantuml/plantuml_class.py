@@ -45,20 +45,20 @@ def get_classes(class_object):
 def get_inheritance(class_type):
 
     inheritance_set = set()
-    def recurrent(obj_type):
+    stack = [class_type] # Types still to be visited, no recursion needed for deep hierarchies
+    
+    # print(f'        class_type = {class_type}')
+    # print(f'        class_type.__name__ = {class_type.__name__}')
+    while stack:
+        obj_type = stack.pop()
         # print(f'          {obj_type}')
 
-        # classes_set.add(type(obj))
         for value in obj_type.__bases__:
             if value.__name__ in EXCLUDE_LIST:
                 continue
             # print(f'  {value.__name__} <|-up- {obj_type.__name__}')
             inheritance_set.add(f'  {obj_type.__name__} -up-|> {value.__name__}')
-            recurrent(value)
-    
-    # print(f'        class_type = {class_type}')
-    # print(f'        class_type.__name__ = {class_type.__name__}')
-    recurrent(class_type)
+            stack.append(value)
     
     return inheritance_set
 
@@ -149,25 +149,36 @@ def print_attrs_with_instance(class_name, class_object):
 
 def get_associated_classes(class_object, association_classes_set):
     # Get all instance methods (exclude static methods)
-    for name, member in inspect.getmembers(class_object):
-        if not isinstance(member, (int, float, str, bool, type(None), Container)) and not name.endswith('__') and not name in EXCLUDE_LIST and not inspect.isroutine(member):
-            association_classes_set.add(type(member))
-            get_associated_classes(member, association_classes_set)
+    stack = [class_object] # Objects still to be visited, no recursion needed for deep objects
+    seen = {id(class_object)} # Objects already visited, a cyclic object graph is visited once
+    while stack:
+        for name, member in inspect.getmembers(stack.pop()):
+            if not isinstance(member, (int, float, str, bool, type(None), Container)) and not name.endswith('__') and not name in EXCLUDE_LIST and not inspect.isroutine(member):
+                association_classes_set.add(type(member))
+                if not id(member) in seen:
+                    seen.add(id(member))
+                    stack.append(member)
         
 def get_associations(class_object, association_classes_set):
 
-    for name, member in inspect.getmembers(class_object):
-        if not isinstance(member, (int, float, str, bool, type(None), Container)) and not name.endswith('__') and not name in EXCLUDE_LIST and not inspect.isroutine(member):
-        
-            vis_name = name # Visibility name
-            prefix = f'_{class_object.__class__.__name__}__' # name mangling
-            if name.startswith(prefix):
-                vis_name = name.removeprefix(prefix) # de-mangling
-            elif name.startswith('_'):
-                vis_name = name.removeprefix('_')
-        
-            association_classes_set.add(f'{class_object.__class__.__name__} -right-> {member.__class__.__name__} : {vis_name}')
-            get_associations(member, association_classes_set)
+    stack = [class_object] # Objects still to be visited, no recursion needed for deep objects
+    seen = {id(class_object)} # Objects already visited, a cyclic object graph is visited once
+    while stack:
+        class_object = stack.pop()
+        for name, member in inspect.getmembers(class_object):
+            if not isinstance(member, (int, float, str, bool, type(None), Container)) and not name.endswith('__') and not name in EXCLUDE_LIST and not inspect.isroutine(member):
+            
+                vis_name = name # Visibility name
+                prefix = f'_{class_object.__class__.__name__}__' # name mangling
+                if name.startswith(prefix):
+                    vis_name = name.removeprefix(prefix) # de-mangling
+                elif name.startswith('_'):
+                    vis_name = name.removeprefix('_')
+            
+                association_classes_set.add(f'{class_object.__class__.__name__} -right-> {member.__class__.__name__} : {vis_name}')
+                if not id(member) in seen:
+                    seen.add(id(member))
+                    stack.append(member)
         
         
 def print_object_values(obj_name, object):
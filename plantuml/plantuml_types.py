@@ -1,4 +1,6 @@
 from copy import deepcopy
+from enum import Enum
+import hashlib
 import re
 import types
 import asyncio
@@ -12,6 +14,28 @@ def sanitize_name(name):
     # print(f"sanitize_name {name} -> {re.sub(r'\W|^(?=\d)', '', name.lower())}")
     return re.sub(r'\W|^(?=\d)', '', name.lower())
 
+# Options written by the layouts, they are not part of the content of an object
+HASH_EXCLUDED_OPTIONS = {"layout_connectors", "title-font-family", "title-font-size"}
+# The attributes in the content of an object (see PlantumlType._own_content) that are not children, they are also keys of the lookup indexes or the connection ends
+HASHED_ATTRIBUTES = {"name", "id", "comp1", "comp2"}
+
+def stable_repr(value):
+    """
+    Returns a text representation of an option value that does not change between runs (no memory addresses).
+    PlantumlType objects (or ObjectRef to them) are represented by their path.
+    """
+    if isinstance(value, ObjectRef):
+        value = value.ref
+    if isinstance(value, PlantumlType):
+        return f"<{value.path}>"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(stable_repr(item) for item in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{stable_repr(key)}:{stable_repr(value[key])}" for key in sorted(value, key=str)) + "}"
+    if isinstance(value, Enum):
+        return str(value)
+    return repr(value)
+
 class ObjectRef:
     """
     Stores a simple obj reference, it is used to store PlantumlType avoiding recursive searches.
@@ -19,6 +43,36 @@ class ObjectRef:
     def __init__(self, ref):
         self.ref = ref
 
+# Maps the layout keys accepted as options (and by common.get_obj_prop) to the LayoutRect fields
+LAYOUT_FIELDS = {
+    "rect_x_pos": "x_pos",
+    "rect_y_pos": "y_pos",
+    "rect_x_len": "x_len",
+    "rect_y_len": "y_len",
+    "rect_min_x_len": "min_x_len",
+    "rect_min_y_len": "min_y_len",
+}
+
+class LayoutRect:
+    """
+    Layout geometry of a PlantumlType, computed by the SVG architecture layout.
+    x_pos, y_pos: Position relative to the owner, None until the layout is done.
+    x_len, y_len: Size of the component, None until the layout is done.
+    min_x_len, min_y_len: Minimum size of the component, can be set with the rect_min_x_len and rect_min_y_len options.
+    """
+    __slots__ = ("x_pos", "y_pos", "x_len", "y_len", "min_x_len", "min_y_len")
+
+    def __init__(self, min_x_len=200, min_y_len=50):
+        self.x_pos = None
+        self.y_pos = None
+        self.x_len = None
+        self.y_len = None
+        self.min_x_len = min_x_len
+        self.min_y_len = min_y_len
+
+    def __repr__(self):
+        return f"LayoutRect(pos=({self.x_pos}, {self.y_pos}), len=({self.x_len}, {self.y_len}), min_len=({self.min_x_len}, {self.min_y_len}))"
+
 class ArchBreakLine():
     """
     This class defines a PlantUML architectural breakline in the architecture layout.
@@ -121,6 +175,7 @@ class PlantumlType:
             hide: Make a component invisible, but still occupining the place, e.g.: hide=True
             color: Define the colors of the component as plantuml syntax, e.g.: color="pink;line:red;line.bold;text:red"
             svg_orientation: Used by SVG architecture to define the orientation of inner items, can be Orientation.TOP_DOWN or LEFT_RIGHT.
+            rect_min_x_len, rect_min_y_len: SVG minimum width and height of the component. Default 200 and 50.
 
             title_height: SVG title height. Default 15.
             title_font_family: Title font family. Default 'Consolas'.
@@ -138,7 +193,155 @@ class PlantumlType:
         #self.architecture = None
         self.owner = "NONE"
         # print("---->", get_variable_names(self, globals()))
-        self.metadata_dict.update({"rect_min_x_len": 200, "rect_min_y_len": 50, "rect_x_pos":None, "rect_y_pos":None, "rect_x_len":None, "rect_y_len":None})
+        self.layout = LayoutRect() # Geometry used by the SVG layout, kept out of the metadata_dict
+
+    def __setattr__(self, name, value):
+        # Adding, replacing or removing a child changes the cached child registry
+        if isinstance(value, (PlantumlType, ArchBreakLine)) or isinstance(self.__dict__.get(name), (PlantumlType, ArchBreakLine)):
+            registry = self.__dict__.get("_child_registry")
+            if registry is not None and name not in self.__dict__ and not hasattr(type(self), name):
+                # A new child is declared after all the others, so it is just appended to the registry
+                items, children, connections, layout_items = registry
+                if isinstance(value, PlantumlType):
+                    items.append((name, value))
+                    if isinstance(value, PlantumlConnection):
+                        connections.append(value)
+                    else:
+                        children.append(value)
+                        layout_items.append(value)
+                else:
+                    layout_items.append(value)
+            else:
+                self.__dict__.pop("_child_registry", None)
+            self._invalidate_content_hash()
+            previous = self.__dict__.get(name)
+            if isinstance(previous, PlantumlType) and previous is not value:
+                self._invalidate_indexes() # The replaced subtree is still in the indexes and in the adjacency
+        elif name in HASHED_ATTRIBUTES and self.__dict__.get(name) is not value:
+            self._invalidate_content_hash()
+            self._invalidate_indexes() # The old name, id or connection ends are still in the indexes and in the adjacency
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if isinstance(self.__dict__.get(name), (PlantumlType, ArchBreakLine)):
+            self.__dict__.pop("_child_registry", None)
+            self._invalidate_content_hash()
+            if isinstance(self.__dict__.get(name), PlantumlType):
+                self._invalidate_indexes() # The deleted subtree is still in the indexes and in the adjacency
+        object.__delattr__(self, name)
+
+    def _invalidate_indexes(self):
+        # The lookup indexes and the adjacency of the architectures above are rebuilt on the next search when a child is replaced or deleted
+        node = self
+        while node is not None:
+            if isinstance(node, PlantumlArchitecture):
+                node.__dict__["_indexes_valid"] = False
+                node.__dict__.pop("_adjacency", None)
+            owner = node.__dict__.get("owner")
+            node = owner.ref if isinstance(owner, ObjectRef) else None
+
+    def _get_child_registry(self):
+        """
+        Returns the cached registry of children of this object, built from the class attributes followed by the instance attributes, in declaration order.
+        The registry is a tuple with:
+            items: list of (attribute name, PlantumlType) of all children, including connections.
+            children: list of the structural children (PlantumlType that are not PlantumlConnection).
+            connections: list of the PlantumlConnection children.
+            layout_items: list of the structural children and ArchBreakLine of the instance attributes, used by the layouts.
+        """
+        registry = self.__dict__.get("_child_registry")
+        if registry is None:
+            items = []
+            children = []
+            connections = []
+            layout_items = []
+            for is_instance_attr, attrs in ((False, vars(self.__class__)), (True, self.__dict__)):
+                for key, value in attrs.items():
+                    if isinstance(value, PlantumlType):
+                        items.append((key, value))
+                        if isinstance(value, PlantumlConnection):
+                            connections.append(value)
+                        else:
+                            children.append(value)
+                            if is_instance_attr:
+                                layout_items.append(value)
+                    elif isinstance(value, ArchBreakLine) and is_instance_attr:
+                        layout_items.append(value)
+            registry = (items, children, connections, layout_items)
+            self.__dict__["_child_registry"] = registry
+        return registry
+
+    def get_child_items(self):
+        """
+        Returns a list of (attribute name, object) of all PlantumlType children, connections included, in declaration order.
+        """
+        return self._get_child_registry()[0]
+
+    def get_children(self):
+        """
+        Returns the list of structural children (PlantumlType that are not connections) in declaration order.
+        """
+        return self._get_child_registry()[1]
+
+    def get_connections(self):
+        """
+        Returns the list of PlantumlConnection children in declaration order.
+        """
+        return self._get_child_registry()[2]
+
+    def get_layout_items(self):
+        """
+        Returns the list of structural children and ArchBreakLine defined as instance attributes, in declaration order.
+        """
+        return self._get_child_registry()[3]
+
+    def _walk_items(self, order="pre", include_connections=False, include_self=False, prune=None):
+        # Uses an explicit stack instead of recursion, so the nesting depth is not limited by the recursion limit.
+        # Yields tuples (attribute name, obj, depth, owner).
+        if order not in ("pre", "post"):
+            raise ValueError(f"Invalid walk order '{order}', it can be 'pre' or 'post'.")
+
+        def child_entries(obj, depth):
+            if include_connections:
+                items = obj.get_child_items()
+            else:
+                items = [(key, value) for key, value in obj.get_child_items() if not isinstance(value, PlantumlConnection)]
+            # Reversed, so the children are popped from the stack in declaration order
+            return [(False, key, value, depth, obj) for key, value in reversed(items)]
+
+        if include_self:
+            stack = [(False, "", self, 0, None)]
+        else:
+            stack = child_entries(self, 1)
+
+        while stack:
+            expanded, key, obj, depth, owner = stack.pop()
+            if expanded:
+                yield key, obj, depth, owner
+                continue
+            if prune is not None and prune(obj):
+                continue
+            if order == "pre":
+                yield key, obj, depth, owner
+                stack.extend(child_entries(obj, depth+1))
+            else:
+                stack.append((True, key, obj, depth, owner))
+                stack.extend(child_entries(obj, depth+1))
+
+    def walk(self, order="pre", filter=None, include_connections=False, include_self=False, prune=None):
+        """
+        Goes through the tree of objects below this object without recursion, so it works for any nesting depth.
+        The children are visited in declaration order (see get_child_items).
+        order: "pre" yields an object before its children, "post" yields it after its children.
+        filter: Optional type (or tuple of types), only the objects of this type are yielded. The walk still goes through the other objects.
+        include_connections: Also yields the PlantumlConnection objects. Default False.
+        include_self: Also yields this object, with depth 0 and owner None. Default False.
+        prune: Optional function called with each object, if it returns True the object and all its children are skipped.
+        Yields tuples (obj, depth, owner), the direct children of this object have depth 1.
+        """
+        for key, obj, depth, owner in self._walk_items(order, include_connections, include_self, prune):
+            if filter is None or isinstance(obj, filter):
+                yield obj, depth, owner
 
     def __str__(self):
         return f"'{self.path}'"
@@ -151,17 +354,88 @@ class PlantumlType:
             return False
         return True
 
-    def is_visible_recursive(self, arch):
-        if self.metadata_dict['hide'] == True or self.metadata_dict['remove'] == True:
-            return False
-
-        owner_tree = arch.get_owner_tree(self)
-        # print("is_visible_recursive ", owner_tree)
-        for item in owner_tree:
-            if item.is_visible() == False:
-                return False
+    def is_visible_recursive(self, arch=None):
+        """
+        Returns False if this object or any of its owners is hidden or removed.
+        The state is cached in each object (see get_effective_visibility), so the cost is O(1) once computed.
+        arch: Not used anymore, the owners are found following the owner links.
+        """
+        hidden, removed = self.get_effective_visibility()
+        return not hidden and not removed
 
-        return True
+    def get_effective_visibility(self):
+        """
+        Returns a tuple (hidden, removed), where each flag is True if this object or any of its owners has it set.
+        The states are computed top-down from the first owner with a cached state, and cached in all objects on the way.
+        """
+        flags = self.__dict__.get("_effective_visibility")
+        if flags is None:
+            pending = []
+            owner_flags = (False, False)
+            node = self
+            while node is not None:
+                flags = node.__dict__.get("_effective_visibility")
+                if flags is not None:
+                    owner_flags = flags
+                    break
+                pending.append(node)
+                owner = node.owner
+                node = owner.ref if isinstance(owner, ObjectRef) else None
+            for node in reversed(pending):
+                owner_flags = (owner_flags[0] or node.metadata_dict['hide'] == True, owner_flags[1] or node.metadata_dict['remove'] == True)
+                node.__dict__["_effective_visibility"] = owner_flags
+            flags = owner_flags
+        return flags
+
+    def _own_content(self):
+        # The content of this object only: type, id, name, options and the connection ends
+        content = [type(self).__name__, self.id, self.name, self.layout.min_x_len, self.layout.min_y_len]
+        for key in sorted(self.metadata_dict):
+            if key not in HASH_EXCLUDED_OPTIONS:
+                content.append(f"{key}={stable_repr(self.metadata_dict[key])}")
+        if isinstance(self, PlantumlConnection):
+            for index, comp1, comp2 in self.get_endpoint_pairs():
+                content.append(f"{index}:{comp1.path}->{comp2.path}")
+        return "\n".join(str(item) for item in content)
+
+    def get_content_hash(self):
+        """
+        Returns a hash (hex string) of the content of this object and all its children: type, id, name, options, connection ends and the hashes of the children, in declaration order.
+        Two subtrees with the same content have the same hash, so it can be used to detect changes and as key of cached results.
+        The hashes are computed bottom-up and cached, set_options, add and any change of a child attribute, of the name, of the id or of the connection ends invalidate the cached hashes of the object and of its owners.
+        Options changed directly in the metadata_dict are not detected.
+        """
+        content_hash = self.__dict__.get("_content_hash")
+        if content_hash is None:
+            # Children with a cached hash are skipped, all their children have a cached hash too
+            for obj, depth, owner in self.walk(order="post", include_connections=True, include_self=True, prune=lambda item: "_content_hash" in item.__dict__):
+                hasher = hashlib.blake2b(obj._own_content().encode(), digest_size=16)
+                for key, value in obj.get_child_items():
+                    hasher.update(f"\n{key}:{value.__dict__['_content_hash']}".encode())
+                obj.__dict__["_content_hash"] = hasher.hexdigest()
+            content_hash = self.__dict__["_content_hash"]
+        return content_hash
+
+    def _invalidate_content_hash(self):
+        # An object without cached hash has no owners with cached hash, so it stops there
+        node = self
+        while node is not None and "_content_hash" in node.__dict__:
+            del node.__dict__["_content_hash"]
+            owner = node.__dict__.get("owner")
+            node = owner.ref if isinstance(owner, ObjectRef) else None
+
+    def _invalidate_absolute_rects(self):
+        # The tables of absolute rectangles of the architectures above are stale when a position or a size changes
+        node = self
+        while node is not None:
+            node.__dict__.pop("_absolute_rects", None)
+            owner = node.__dict__.get("owner")
+            node = owner.ref if isinstance(owner, ObjectRef) else None
+
+    def _invalidate_effective_visibility(self):
+        # An object without cached state has no children with cached state, so those subtrees are skipped
+        for value, depth, owner in self.walk(include_connections=True, include_self=True, prune=lambda item: "_effective_visibility" not in item.__dict__):
+            del value.__dict__["_effective_visibility"]
     
     def post_init(self):
         PlantumlType._instance_count += 1  # Increment the counter
@@ -172,8 +446,9 @@ class PlantumlType:
     def set_architecture(self, architecture):
         # setattr(self, "architecture", ObjectRef(architecture))
         #self.architecture = architecture_ref
-        self.path = architecture.get_complete_path_name(self)
+        # The owner link must be set before the path, the path is built following the owner links
         self.owner = ObjectRef(architecture.get_owner(self))
+        self.path = architecture.get_complete_path_name(self)
         # print(f"set_architecture: {self.name} {self.owner} {architecture.get_owner(self)}")
 
     def add(self, value):
@@ -191,130 +466,88 @@ class PlantumlType:
         
         # Set the attribute on the class instance using reflection
         setattr(self, sanitized_name, value)
+        if isinstance(value, PlantumlType):
+            value.owner = ObjectRef(self)
+            value._invalidate_effective_visibility() # The owners are not the same anymore
+            self._invalidate_absolute_rects() # The new subtree has no absolute rectangles
+            owner_chain = []
+            node = self
+            while node is not None:
+                owner_chain.append(node)
+                owner = getattr(node, "owner", None)
+                node = owner.ref if isinstance(owner, ObjectRef) else None
+
+            # The paths are relative to the outermost initialized architecture, only the new subtree is initialized
+            root = None
+            for node in owner_chain:
+                if isinstance(node, PlantumlArchitecture) and getattr(node, "_post_init_done", False):
+                    root = node
+            if root is not None:
+                root._attach_subtree(value, self)
+
+            # Keep the lookup indexes of the other architectures above in sync
+            for node in owner_chain:
+                if node is not root and isinstance(node, PlantumlArchitecture) and getattr(node, "_indexes_valid", False):
+                    node._index_subtree(value)
         
         # print(f"Added attribute: {sanitized_name} = {value} to {self.name}")
 
     def has_sub_objs(self) -> bool:
-        # Iterate over all attributes of the object
-        for attr_name, attr_value in vars(self).items():
-            # Check if any attribute is an instance of the specified base class
-            if isinstance(attr_value, PlantumlType):
-                return True
-        # Check static (class) variables
-        for attr_name, attr_value in vars(self.__class__).items():
-            if isinstance(attr_value, PlantumlType):
-                return True
-        return False
+        registry = self._get_child_registry()
+        return len(registry[0]) > 0
         
     def get_activity_owner(self, activity):
-        result = None
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlActivity) and activity == value:
-                result = self
-                # print(f"   Found owner of {activity.name}, it is {result}, {key}")
-                return result
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.get_activity_owner(activity)
-                if result != None and  isinstance(value, PlantumlType):
-                    return result
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlActivity) and activity == value:
-                result = self
-                # print(f"   Found owner of {activity.name}, it is {result}, {key}")
-                return result
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.get_activity_owner(activity)
-                if result != None and  isinstance(value, PlantumlType):
-                    return result
-        return result
+        for value, depth, owner in self.walk(filter=PlantumlActivity):
+            if activity == value:
+                # print(f"   Found owner of {activity.name}, it is {owner}")
+                return owner
+        return None
 
     def get_owner(self, object):
         """
-        This is a recursive method that looks for the owner for an object from the current tree position.
+        Returns the owner of an object, looking from the current tree position.
         Idealy it can be called from a base architecture to look inside the entire architecture tree of components.
+        Objects already attached to an architecture carry an owner link (see set_architecture and add), so the lookup is direct.
+        Otherwise it falls back to a recursive search of the tree.
         """
-        result = None
-        for key, value in vars(self.__class__).items():
-            if object == value:
-                result = self
-                return result
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.get_owner(object)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
-        for key, value in self.__dict__.items():
+        if object is self:
+            return None
+        owner = getattr(object, "owner", None)
+        if isinstance(owner, ObjectRef):
+            return owner.ref
+        return self._find_owner(object)
+
+    def _find_owner(self, object):
+        # Search of the tree used when the object has no owner link yet
+        for value, depth, owner in self.walk(include_connections=True):
             if object == value:
-                result = self
-                return result
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.get_owner(object)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
-        return result
+                return owner
+        return None
         
     def find_sub_obj_by_path_recursive(self, path):
-        # Goes recursive to find object
-        result = None
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlType) and value.path == path:
-                # print (f"  Found obj '{path}' at instance level")
+        # Goes through the whole tree to find object
+        for value, depth, owner in self.walk(include_connections=True):
+            if value.path == path:
+                # print (f"  Found obj '{path}'")
                 return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_path_recursive(path)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlType) and value.path == path:
-                # print (f"  Found obj '{path}' at class level")
-                return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_path_recursive(path)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
         # print (f"Obj '{path}' not found")
         return None
 
     def find_sub_obj_by_name_recursive(self, name):
-        # Goes recursive to find object
-        result = None
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlType) and value.name == name:
-                # print (f"  Found obj '{name}' at instance level")
-                return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_name_recursive(name)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlType) and value.name == name:
-                # print (f"  Found obj '{name}' at class level")
+        # Goes through the whole tree to find object
+        for value, depth, owner in self.walk(include_connections=True):
+            if value.name == name:
+                # print (f"  Found obj '{name}'")
                 return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_name_recursive(name)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
         # print (f"Obj '{name}' not found")
         return None
 
     def find_sub_obj_by_id_recursive(self, id):
-        # Goes recursive to find object
-        result = None
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlType) and value.id == id:
-                # print (f"  Found obj '{id}' at instance level")
-                return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_name_recursive(id)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlType) and value.id == id:
-                # print (f"  Found obj '{id}' at class level")
+        # Goes through the whole tree to find object
+        for value, depth, owner in self.walk(include_connections=True):
+            if value.id == id:
+                # print (f"  Found obj '{id}'")
                 return value
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                result = value.find_sub_obj_by_name_recursive(id)
-                if result != None and isinstance(value, PlantumlType):
-                    return result
         # print (f"Obj '{id}' not found")
         return None
 
@@ -322,8 +555,17 @@ class PlantumlType:
         """
         Update the options, refer to the main constructor for more details.
         """
-        # Update the metadata_dict with the provided options
+        # The layout geometry goes to the layout record, everything else to the metadata_dict
+        layout_keys = LAYOUT_FIELDS.keys() & options.keys()
+        for key in layout_keys:
+            setattr(self.layout, LAYOUT_FIELDS[key], options.pop(key))
+        if layout_keys:
+            self._invalidate_absolute_rects()
+        visibility_changed = any(key in options and options[key] != self.metadata_dict.get(key) for key in ("hide", "remove"))
         self.metadata_dict.update(options)
+        if visibility_changed:
+            self._invalidate_effective_visibility()
+        self._invalidate_content_hash()
 
     def replace_call_method(new_call_method):
         self.__call__ = types.MethodType(new_call_method, self)
@@ -333,18 +575,15 @@ class PlantumlType:
         Returns a set of references to activities objects.
         """
         activities_list = set()
+        activity_depth = None # Used to skip the objects inside an activity
         
-        for key, value in vars(self.__class__).items():
+        for value, depth, owner in self.walk():
+            if activity_depth is not None and depth > activity_depth:
+                continue
+            activity_depth = None
             if isinstance(value, PlantumlActivity):
                 activities_list.add(value)
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                activities_list.update(value.get_all_activities(level+1))
-
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlActivity):
-                activities_list.add(value)
-            elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-                activities_list.update(value.get_all_activities(level+1))
+                activity_depth = depth
 
         return activities_list
 
@@ -356,7 +595,7 @@ class PlantumlContainer(PlantumlType):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "container"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
         # super().__post_init__()
 
 class PlantumlGroup(PlantumlContainer):
@@ -367,7 +606,7 @@ class PlantumlGroup(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "together"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
         # super().__post_init__()
 
 class PlantumlActor(PlantumlContainer):
@@ -378,7 +617,7 @@ class PlantumlActor(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Actor"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
         # super().__post_init__()
 
 class PlantumlComponent(PlantumlContainer):
@@ -389,7 +628,7 @@ class PlantumlComponent(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Component"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 class PlantumlFrame(PlantumlContainer):
     """
@@ -399,7 +638,7 @@ class PlantumlFrame(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Frame"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 class PlantumlFolder(PlantumlContainer):
     """
@@ -409,7 +648,7 @@ class PlantumlFolder(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Folder"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 class PlantumlDatabase(PlantumlContainer):
     """
@@ -419,7 +658,7 @@ class PlantumlDatabase(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Database"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 class PlantumlPackage(PlantumlContainer):
     """
@@ -429,7 +668,7 @@ class PlantumlPackage(PlantumlContainer):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Package"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 class PlantumlInterface(PlantumlType):
     """
@@ -439,7 +678,7 @@ class PlantumlInterface(PlantumlType):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Interface"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
 
 # class PlantumlPort(PlantumlType):
     # """
@@ -459,7 +698,7 @@ class PlantumlActivity(PlantumlType):
     def __init__(self, name="", id="", **options):
         super().__init__(name, id)
         self.type = "Activity"
-        self.metadata_dict.update(options)
+        self.set_options(**options)
         # super().__post_init__()
 
     def replace_run_method(self, new_call_method):
@@ -531,53 +770,88 @@ skinparam linetype ortho
 
     def _recursive_post_init(self, curr_obj):
         #Add this architecture as attribute of each element instance of PlantumlType
-        for key, value in vars(curr_obj.__class__).items():
-            if isinstance(value, PlantumlType):
-                if value.name == "":
-                    value.name = key
-                if value.id == "":
-                    value.id = key
-                value.set_architecture(self)
-                self._recursive_post_init(value)
-        for key, value in curr_obj.__dict__.items():
-            if isinstance(value, PlantumlType):
-                if value.name == "":
-                    value.name = key
-                if value.id == "":
-                    value.id = key
-                value.set_architecture(self)
-                self._recursive_post_init(value)
+        # The owners are visited before their children, so the owner path is ready when the child path is set
+        for key, value, depth, owner in curr_obj._walk_items(include_connections=True):
+            if value.name == "":
+                value.name = key
+            if value.id == "":
+                value.id = key
+            value.owner = ObjectRef(owner)
+            value.__dict__.pop("_effective_visibility", None) # The owners may have changed
+            value.__dict__.pop("_content_hash", None) # The paths of the connection ends may have changed
+            value.set_architecture(self)
+            self._register_in_indexes(value)
     
     def arch_post_init(self):
         # print("    arch_post_init(self):", self.name)
+        self._reset_indexes()
         self._recursive_post_init(self)
+        self._indexes_valid = True
+        self._build_adjacency()
         self._connect_arch_items()
         self.do_layout_combinations()
+        self._post_init_done = True
+
+    def _attach_subtree(self, value, owner):
+        # Incremental arch_post_init for a subtree added (see add) to owner, inside this already initialized architecture
+        value.set_architecture(self)
+        self._register_in_indexes(value)
+        self._recursive_post_init(value)
+        if "_adjacency" in self.__dict__:
+            for connection, depth, connection_owner in value.walk(filter=PlantumlConnection, include_connections=True, include_self=True):
+                self._add_to_adjacency(connection)
+        if isinstance(owner, PlantumlArchitecture):
+            layout_items = owner.get_layout_items()
+            connected = getattr(owner, "_layout_items_connected", None)
+            if connected is not None and connected < len(layout_items) and layout_items[-1] is value:
+                # The new items (value and the ArchBreakLine assigned before it) are placed after all the others of its owner,
+                # only their own layout connectors are added
+                # The vertical connectors are kept before the horizontal ones, as done by do_layout_combinations
+                for item in layout_items[connected:]:
+                    vertical, horizontal = owner._connect_arch_item(item)
+                    if vertical is not None:
+                        owner.metadata_dict["layout_connectors"].insert(len(owner.layout_combine_vertical)-1, (ObjectRef(vertical[0]), f"-[hidden]d-", ObjectRef(vertical[1])))
+                    if horizontal is not None:
+                        owner.metadata_dict["layout_connectors"].append((ObjectRef(horizontal[0]), f"-[hidden]r-", ObjectRef(horizontal[1])))
+            else:
+                owner._connect_arch_items()
+                owner.do_layout_combinations()
 
     def _connect_arch_items(self):
         # Connects all compones to the previous one horizontally, till a ArchBreakLine is found
-        # Initialize the previous key-value pair
         self.layout_combine_horizontal = []
         self.layout_combine_vertical = []
-        prev_value = None
-        first_row_value = None
-        previous_first_row_value = None
-        for value in self.__dict__.values():
-            if isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection) and not isinstance(value, PlantumlGroup):
-                if first_row_value is None:
-                    first_row_value = value 
-                    if previous_first_row_value is not None:
-                        self.layout_combine_vertical.append((previous_first_row_value, first_row_value))
-                        previous_first_row_value = None
-                if prev_value is not None:
-                    self.layout_combine_horizontal.append((prev_value, value))
-                    # Update previous value pair
-                prev_value = value
-            elif isinstance(value, ArchBreakLine):
-                # Starts again new line
-                prev_value = None
-                previous_first_row_value = first_row_value
-                first_row_value = None
+        # Initialize the previous key-value pair: (previous value, first value of the row, first value of the previous row)
+        self._layout_row_state = (None, None, None)
+        self._layout_items_connected = 0 # The number of layout items already connected, in order
+        for value in self.get_layout_items():
+            self._connect_arch_item(value)
+
+    def _connect_arch_item(self, value):
+        # Connects value to the items placed before it, returns the new vertical and horizontal pairs (or None)
+        prev_value, first_row_value, previous_first_row_value = self._layout_row_state
+        vertical = None
+        horizontal = None
+        if isinstance(value, PlantumlType) and not isinstance(value, PlantumlGroup):
+            if first_row_value is None:
+                first_row_value = value 
+                if previous_first_row_value is not None:
+                    vertical = (previous_first_row_value, first_row_value)
+                    self.layout_combine_vertical.append(vertical)
+                    previous_first_row_value = None
+            if prev_value is not None:
+                horizontal = (prev_value, value)
+                self.layout_combine_horizontal.append(horizontal)
+                # Update previous value pair
+            prev_value = value
+        elif isinstance(value, ArchBreakLine):
+            # Starts again new line
+            prev_value = None
+            previous_first_row_value = first_row_value
+            first_row_value = None
+        self._layout_row_state = (prev_value, first_row_value, previous_first_row_value)
+        self._layout_items_connected += 1
+        return vertical, horizontal
     
     def do_layout_combinations(self):
         # Create some invisible plantuml connections to try to fix components in relative positions
@@ -593,40 +867,166 @@ skinparam linetype ortho
                 self.metadata_dict["layout_connectors"].append((ObjectRef(item[0]), f"-[hidden]r-", ObjectRef(item[1])))
                 # self.metadata_dict["layout_connectors"].append(f"{item[0].path} -[hidden]r- {item[1].path}")
 
+    def _build_adjacency(self):
+        # Dictionary of object -> {"in": [connections], "out": [connections]}, comp1 is the "out" side and comp2 the "in" side
+        self.__dict__["_adjacency"] = {}
+        for connection, depth, owner in self.walk(filter=PlantumlConnection, include_connections=True):
+            self._add_to_adjacency(connection)
+        return self.__dict__["_adjacency"]
+
+    def _add_to_adjacency(self, connection):
+        adjacency = self.__dict__["_adjacency"]
+        for index, comp1, comp2 in connection.get_endpoint_pairs():
+            adjacency.setdefault(comp1, {"in": [], "out": []})["out"].append(connection)
+            adjacency.setdefault(comp2, {"in": [], "out": []})["in"].append(connection)
+
+    def get_connections_of(self, obj, direction="all"):
+        """
+        Returns the list of connections touching obj, without duplicates, in declaration order of the connections.
+        obj: A PlantumlType inside this architecture.
+        direction: "out" for the connections where obj is comp1, "in" where obj is comp2, or "all" for both. Default "all".
+        """
+        adjacency = self.__dict__.get("_adjacency")
+        if adjacency is None:
+            adjacency = self._build_adjacency()
+        entry = adjacency.get(obj)
+        if entry is None:
+            return []
+        if direction == "all":
+            connections = entry["out"] + entry["in"]
+        else:
+            connections = entry[direction]
+        return list(dict.fromkeys(connections))
+
+    def get_fan_in(self, obj):
+        """
+        Returns the number of single connections (see PlantumlConnection.get_endpoint_pairs) arriving at obj (obj is comp2).
+        """
+        self.get_connections_of(obj) # Builds the adjacency if needed
+        entry = self._adjacency.get(obj)
+        return len(entry["in"]) if entry is not None else 0
+
+    def get_fan_out(self, obj):
+        """
+        Returns the number of single connections (see PlantumlConnection.get_endpoint_pairs) leaving obj (obj is comp1).
+        """
+        self.get_connections_of(obj) # Builds the adjacency if needed
+        entry = self._adjacency.get(obj)
+        return len(entry["out"]) if entry is not None else 0
+
+    def update_absolute_rects(self):
+        """
+        Computes the absolute rectangles (x1, y1, x2, y2) of all objects from their layout, where the positions are relative to the owners.
+        It shall be called after the layout is done, the table is used by the geometry helpers (e.g. connection_routing.get_absolute_pos).
+        An object without position has None as rectangle, an object without size has None as x2 and y2.
+        The owners without position are considered at (0, 0).
+        """
+        rects = {}
+        origins = {} # Absolute position of each object, used as origin of its children
+        for obj, depth, owner in self.walk(include_connections=True, include_self=True):
+            base_x, base_y = origins[id(owner)] if owner is not None else (0, 0)
+            layout = obj.layout
+            origins[id(obj)] = (base_x + (layout.x_pos if layout.x_pos is not None else 0), base_y + (layout.y_pos if layout.y_pos is not None else 0))
+            if layout.x_pos is None or layout.y_pos is None:
+                rects[obj] = None
+            elif layout.x_len is None or layout.y_len is None:
+                rects[obj] = (base_x + layout.x_pos, base_y + layout.y_pos, None, None)
+            else:
+                x1 = base_x + layout.x_pos
+                y1 = base_y + layout.y_pos
+                rects[obj] = (x1, y1, x1 + layout.x_len, y1 + layout.y_len)
+        self.__dict__["_absolute_rects"] = rects
+        return rects
+
+    def get_absolute_rects(self):
+        """
+        Returns the table of absolute rectangles computed by update_absolute_rects, or None if the layout was not done or changed since then.
+        The table is dropped by clear_absolute_rects, by set_options with a layout option (e.g. rect_x_pos) on any object inside and by add.
+        The fields of the layout records set directly (obj.layout.x_pos = ...) are not tracked, clear_absolute_rects shall be called then.
+        """
+        return self.__dict__.get("_absolute_rects")
+
+    def clear_absolute_rects(self):
+        """
+        Drops the table of absolute rectangles, it shall be called when the layout is recomputed.
+        """
+        self.__dict__.pop("_absolute_rects", None)
+
+    def _reset_indexes(self):
+        # Dictionaries used to find sub objects by path, id or name without going through the whole tree
+        self._path_index = {}
+        self._id_index = {}
+        self._name_index = {}
+        self._indexes_valid = False
+
+    def _register_in_indexes(self, value):
+        # The first object registered wins, as the first one found by a recursive search would
+        self._path_index.setdefault(value.path, value)
+        self._id_index.setdefault(value.id, value)
+        self._name_index.setdefault(value.name, value)
+        if isinstance(value, PlantumlArchitecture) and value is not self:
+            # The paths inside a sub architecture are changed by this architecture, so its own indexes are outdated
+            value._indexes_valid = False
+
+    def _index_subtree(self, value):
+        self._register_in_indexes(value)
+        for child, depth, owner in value.walk(include_connections=True):
+            self._register_in_indexes(child)
+
+    def _get_indexes(self):
+        # Rebuilds the indexes only if they were invalidated (e.g. this architecture is part of another one)
+        if not getattr(self, "_indexes_valid", False):
+            self._reset_indexes()
+            for value, depth, owner in self.walk(include_connections=True):
+                self._register_in_indexes(value)
+            self._indexes_valid = True
+        return self._path_index, self._id_index, self._name_index
+
+    def find_sub_obj_by_path_recursive(self, path):
+        path_index, id_index, name_index = self._get_indexes()
+        return path_index.get(path)
+
+    def find_sub_obj_by_name_recursive(self, name):
+        path_index, id_index, name_index = self._get_indexes()
+        return name_index.get(name)
+
+    def find_sub_obj_by_id_recursive(self, id):
+        path_index, id_index, name_index = self._get_indexes()
+        return id_index.get(id)
+
     def get_sub_obj_by_name(self, name):
         # Does not go recursive
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlType) and value.name == name:
-                # print (f"  Found obj '{name}' at instance level")
-                return value
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlType) and value.name == name:
-                # print (f"  Found obj '{name}' at class level")
+        for key, value in self.get_child_items():
+            if value.name == name:
+                # print (f"  Found obj '{name}'")
                 return value
         print (f"Obj '{name}' not found")
         return None
 
     def get_sub_obj_by_id(self, id):
         # Does not go recursive
-        for key, value in self.__dict__.items():
-            if isinstance(value, PlantumlType) and value.id == id:
-                # print (f"  Found obj '{id}' at instance level")
-                return value
-        for key, value in vars(self.__class__).items():
-            if isinstance(value, PlantumlType) and value.id == id:
-                # print (f"  Found obj '{id}' at class level")
+        for key, value in self.get_child_items():
+            if value.id == id:
+                # print (f"  Found obj '{id}'")
                 return value
         print (f"Obj '{id}' not found")
         return None
 
     def get_owner_tree(self, object):
+        """
+        Returns the list of owners of object, from this architecture down to the direct owner of object.
+        It follows the owner links, so it costs O(depth).
+        """
         owner_tree = []
         current_owner = self.get_owner(object)
 
         while current_owner is not None:
-            owner_tree.insert(0, current_owner)
+            owner_tree.append(current_owner)
+            if current_owner is self:
+                break
             current_owner = self.get_owner(current_owner)
 
+        owner_tree.reverse()
         return owner_tree
 
     def get_complete_path_name(self, object):
@@ -666,7 +1066,7 @@ class PlantumlConnection(PlantumlType):
         self.metadata_dict["direction"] = "inout"
         # self.metadata_dict["line"] = "--"
 
-        self.metadata_dict.update(options)
+        self.set_options(**options)
         
         self.set_refs(comp1, comp2)
 
@@ -702,6 +1102,18 @@ class PlantumlConnection(PlantumlType):
             # Also creates the connection inside the componets
             self.comp2.ref.add(ObjectRef(self))
 
+    def get_endpoint_pairs(self):
+        """
+        Returns the list of single connections (index, comp1, comp2) of this connection.
+        A connection with a list of components on one side has one single connection per component, with index as its position in the list.
+        Otherwise there is only one single connection, with index None.
+        """
+        if isinstance(self.comp1, list):
+            return [(index, item.ref, self.comp2.ref) for index, item in enumerate(self.comp1)]
+        elif isinstance(self.comp2, list):
+            return [(index, self.comp1.ref, item.ref) for index, item in enumerate(self.comp2)]
+        return [(None, self.comp1.ref, self.comp2.ref)]
+
 def print_with_indent(text, indent=1):
     print('    ' * indent + text)
     
@@ -727,28 +1139,32 @@ def go_through_connections(object, architecture):
             comp2 = architecture.find_sub_obj_by_name_recursive(value.comp2.ref.name)
         value.set_refs(comp1, comp2)
 
-    for key, value in vars(object.__class__).items():
-        if isinstance(value, PlantumlConnection):
-            proc_value(value)
-        elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-            go_through_connections(value, architecture)
-    for key, value in object.__dict__.items():
-        if isinstance(value, PlantumlConnection):
-            proc_value(value)
-        elif isinstance(value, PlantumlType) and not isinstance(value, PlantumlConnection):
-            go_through_connections(value, architecture)
+    for value, depth, owner in object.walk(filter=PlantumlConnection, include_connections=True):
+        proc_value(value)
 
     
 def clone_architecture(architecture, new_name, base_class=PlantumlArchitecture):
 
-    print("\n----------------------------------------------------------------------------------\nclone_architecture")
     # Step 1: Get the original class and create a new class with the specified base class
     OriginalClass = architecture.__class__
 
     # Create a new class dynamically that inherits from the given base class
     NewClass = types.new_class(OriginalClass.__name__, (base_class,), {})
 
-    # Step 2: Copy the class attributes and methods from the original class
+    # All the copies share a single deepcopy memo, so each object is copied only once and the references between
+    # objects (owners, connection ends, layout connectors) point to the copies. The original architecture maps to the new instance.
+    new_instance = NewClass.__new__(NewClass)
+    memo = {id(architecture): new_instance}
+
+    # Step 2: Map every object of the tree to its empty copy, going through the tree without recursion. The attributes are
+    # copied through the memo, so deepcopy never follows a link into the tree and the nesting depth is not limited by the recursion limit.
+    objects = []
+    for obj, depth, owner in architecture.walk(include_connections=True):
+        if id(obj) not in memo:
+            memo[id(obj)] = obj.__class__.__new__(obj.__class__)
+            objects.append(obj)
+
+    # Step 3: Copy the class attributes and methods from the original class
     for key, value in OriginalClass.__dict__.items():
         if not key.startswith('__'):
             pass
@@ -764,15 +1180,21 @@ def clone_architecture(architecture, new_name, base_class=PlantumlArchitecture):
                 setattr(NewClass, key, value)
             else:
                 pass
-                setattr(NewClass, key, deepcopy(value))
+                setattr(NewClass, key, deepcopy(value, memo))
 
-    # Step 3: Create a new instance of this new class
-    new_instance = NewClass(new_name)
+    # Step 4: Initialize the new instance of this new class
+    new_instance.__init__(new_name)
 
-    # Step 4: Copy the instance attributes from the original instance
+    # Step 5: Copy the instance attributes from the original instance and from the objects of its tree
     for key, value in architecture.__dict__.items():
-        setattr(new_instance, key, deepcopy(value))
-
-    # Step 5: Correct all connection references
-    go_through_connections(new_instance, new_instance)
+        setattr(new_instance, key, deepcopy(value, memo))
+    for obj in objects:
+        memo[id(obj)].__dict__.update((key, deepcopy(value, memo)) for key, value in obj.__dict__.items())
+    new_instance._indexes_valid = False # The class attributes were initialized with the new instance, so the copied indexes are rebuilt
+    new_instance.__dict__.pop("_child_registry", None)
+    new_instance.__dict__.pop("_adjacency", None)
+    new_instance.__dict__.pop("_absolute_rects", None)
+    new_instance.__dict__.pop("_spatial_indexes", None)
+
+    # The connection references were copied through the memo, so they already point to the new objects
     return new_instance
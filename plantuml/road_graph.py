@@ -0,0 +1,384 @@
+import bisect
+import heapq
+import itertools
+import plantuml.plantuml_types as pt
+import plantuml.connection_state_manager as csm
+from plantuml.connection_state_manager import Dir, DirType
+
+# Costs used to choose a route, the length is in pixels
+BEND_COST = 40 # Each change of road adds two bends
+OCCUPANCY_COST = 30 # For each connection already using a road
+END_OFFSET = 10 # Distance to the end of a road where a connection crosses to the next road of the same component
+
+class RoadGraph:
+    """
+    Graph of the roads of a highway_map (see svg_architecture.do_svg_architecture), used to route the connections with roads.
+    The roads are the edges of the graph, the junctions are the places where a connection can cross from one road to another:
+        - Where two roads touch each other.
+        - From the roads inside a component to the roads of its owner next to the component (its address), through the space between them.
+        - At both ends of two consecutive roads of the same component, through the margins of the component.
+    It depends only on the layout, so it is built once per layout and reused for all the connections (see get_road_graph).
+    The roads are their integer ids in the highway_map, the lists of the graph are indexed by them (see HighwayMap.road_names for their names).
+
+    highway_map: The map of roads (HighwayMap) with absolute coordinates, indexed (see HighwayMap.index_roads).
+    """
+    def __init__(self, highway_map):
+        self.highway_map = highway_map
+        self.rects = highway_map.road_rects # (x1, y1, x2, y2)
+        self.orientations = highway_map.road_orientations
+        self.capacities = [csm.get_road_capacity(highway_map, road) for road in range(len(self.rects))]
+
+        # Congestion costs, raised by negotiated_routing between its iterations. The keys are the road ids and the faces (comp_path, face) of the components
+        self.history = {}
+        self.present_factor = 0 # Cost of each connection above the capacity of a road
+
+        # Each junction is (road1, road2, crossing, low, high, edge), where crossing is the direction of the move from one road to the other:
+        # for DirType.VERTICAL the move is done at any x in [low, high] through the y edge, for DirType.HORIZONTAL at any y in [low, high] through the x edge.
+        self.junctions = []
+        self.roads_by_owner = {} # The roads of each component, sorted by index
+        self.owners = [owner.path for owner in highway_map.road_owners] # The path of the component of each road
+        for road, (path, index) in enumerate(zip(self.owners, highway_map.road_indexes)):
+            self.roads_by_owner.setdefault(path, []).append((index, road))
+        for roads in self.roads_by_owner.values():
+            roads.sort()
+        self._add_touching_junctions(1, 3, 0, 2, DirType.VERTICAL) # Roads on top of each other
+        self._add_touching_junctions(0, 2, 1, 3, DirType.HORIZONTAL) # Roads side by side
+        self._add_address_junctions()
+        self._add_end_junctions()
+
+        # The junctions of each road sorted by their position along the road, a route moves along a road from one junction to the next one
+        self.road_junctions = [[] for rect in self.rects]
+        for index, junction in enumerate(self.junctions):
+            self.road_junctions[junction[0]].append(index)
+            self.road_junctions[junction[1]].append(index)
+        self.road_positions = []
+        self.slots = {} # (junction, road): index in road_junctions[road]
+        for road, junctions in enumerate(self.road_junctions):
+            junctions.sort(key=lambda index: self.get_position(road, self.get_junction_point(index)))
+            self.road_positions.append([self.get_position(road, self.get_junction_point(index)) for index in junctions])
+            for slot, index in enumerate(junctions):
+                self.slots[(index, road)] = slot
+
+    def _add_touching_junctions(self, low_side, high_side, range_low, range_high, crossing):
+        # Adds a junction for each pair of roads where the high side of one road is the low side of the other one
+        by_low_side = {}
+        for road, rect in enumerate(self.rects):
+            by_low_side.setdefault(rect[low_side], []).append(road)
+        for road, rect in enumerate(self.rects):
+            for other in by_low_side.get(rect[high_side], []):
+                other_rect = self.rects[other]
+                low = max(rect[range_low], other_rect[range_low])
+                high = min(rect[range_high], other_rect[range_high])
+                if low < high:
+                    self.junctions.append((road, other, crossing, low, high, rect[high_side]))
+
+    def _add_address_junctions(self):
+        # Adds a junction from each road inside a component on one of its sides to the road of the owner on that side
+        connected = set((junction[0], junction[1]) for junction in self.junctions)
+        connected.update((junction[1], junction[0]) for junction in self.junctions)
+        for path, roads in self.roads_by_owner.items():
+            address = self.highway_map.address_roads.get(path, {})
+            # The roads of a component cover it, so their bounding box is the rectangle of the component
+            rects = [self.rects[road] for index, road in roads]
+            comp_rect = (min(rect[0] for rect in rects), min(rect[1] for rect in rects), max(rect[2] for rect in rects), max(rect[3] for rect in rects))
+            for face, owner_road in address.items():
+                owner_rect = self.rects[owner_road]
+                for index, road in roads:
+                    if (road, owner_road) in connected:
+                        continue
+                    rect = self.rects[road]
+                    if face == Dir.UP and rect[1] == comp_rect[1]:
+                        self._add_gap_junction(road, owner_road, DirType.VERTICAL, rect[0], rect[2], owner_rect[0], owner_rect[2], comp_rect[1])
+                    elif face == Dir.DOWN and rect[3] == comp_rect[3]:
+                        self._add_gap_junction(road, owner_road, DirType.VERTICAL, rect[0], rect[2], owner_rect[0], owner_rect[2], comp_rect[3])
+                    elif face == Dir.LEFT and rect[0] == comp_rect[0]:
+                        self._add_gap_junction(road, owner_road, DirType.HORIZONTAL, rect[1], rect[3], owner_rect[1], owner_rect[3], comp_rect[0])
+                    elif face == Dir.RIGHT and rect[2] == comp_rect[2]:
+                        self._add_gap_junction(road, owner_road, DirType.HORIZONTAL, rect[1], rect[3], owner_rect[1], owner_rect[3], comp_rect[2])
+
+    def _add_gap_junction(self, road, owner_road, crossing, low1, high1, low2, high2, edge):
+        low = max(low1, low2)
+        high = min(high1, high2)
+        if low < high:
+            self.junctions.append((road, owner_road, crossing, low, high, edge))
+
+    def _add_end_junctions(self):
+        # Adds the junctions at both ends of consecutive roads of the same component
+        for roads in self.roads_by_owner.values():
+            for (index1, road1), (index2, road2) in zip(roads, roads[1:]):
+                if self.orientations[road1] != self.orientations[road2]:
+                    continue
+                rect1 = self.rects[road1]
+                rect2 = self.rects[road2]
+                if self.orientations[road1] == DirType.HORIZONTAL:
+                    edge = (rect1[3] + rect2[1]) / 2
+                    low, high, crossing = max(rect1[0], rect2[0]), min(rect1[2], rect2[2]), DirType.VERTICAL
+                else:
+                    edge = (rect1[2] + rect2[0]) / 2
+                    low, high, crossing = max(rect1[1], rect2[1]), min(rect1[3], rect2[3]), DirType.HORIZONTAL
+                if high - low > 2 * END_OFFSET:
+                    self.junctions.append((road1, road2, crossing, low + END_OFFSET, low + END_OFFSET, edge))
+                    self.junctions.append((road1, road2, crossing, high - END_OFFSET, high - END_OFFSET, edge))
+
+    def get_junction_point(self, index):
+        """
+        Returns the point (x, y) representing the junction index, used to measure the distances.
+        """
+        road1, road2, crossing, low, high, edge = self.junctions[index]
+        if crossing == DirType.VERTICAL:
+            return ((low + high) / 2, edge)
+        return (edge, (low + high) / 2)
+
+    def get_position(self, road, point):
+        """
+        Returns the position of point along road, x for a horizontal road and y for a vertical one.
+        """
+        return point[0] if self.orientations[road] == DirType.HORIZONTAL else point[1]
+
+    def get_center(self, road):
+        """
+        Returns the position of the center of road perpendicular to it, y for a horizontal road and x for a vertical one.
+        """
+        rect = self.rects[road]
+        if self.orientations[road] == DirType.HORIZONTAL:
+            return (rect[1] + rect[3]) / 2
+        return (rect[0] + rect[2]) / 2
+
+    def get_occupancy_cost(self, road):
+        """
+        Returns the cost of one more connection on road: the connections already using it, the overflow of its lanes and its congestion history.
+        """
+        users = len(self.highway_map.road_allocations[road]) + csm.get_congestion(self.highway_map)["roads"].get(road, 0)
+        return OCCUPANCY_COST * users + self.present_factor * max(users + 1 - self.capacities[road], 0) + self.history.get(road, 0)
+
+    def get_border_cost(self, comp_path, face):
+        """
+        Returns the congestion history of the face of a component, added to the routes starting or ending on it.
+        """
+        return self.history.get((comp_path, face), 0)
+
+    def get_neighbour_junctions(self, road, junction, point):
+        """
+        Returns the junctions of road next to junction (or to point, if junction is None), one on each side.
+        """
+        junctions = self.road_junctions[road]
+        if junction is None:
+            slot = bisect.bisect_left(self.road_positions[road], self.get_position(road, point))
+            return junctions[max(slot-1, 0):slot+1]
+        slot = self.slots[(junction, road)]
+        return junctions[max(slot-1, 0):slot] + junctions[slot+1:slot+2]
+
+    def find_route(self, sources: dict, targets: dict, owners=None, source_costs=None, target_costs=None):
+        """
+        Returns the cheapest sequence of roads from one of the sources to one of the targets, using A* with the distance to the closest target as heuristic.
+        The cost of a route is its length plus BEND_COST for each change of road plus OCCUPANCY_COST for each connection already using a road of the route.
+        sources: dictionary {road id: (x, y)} with the start points on the roads.
+        targets: dictionary {road id: (x, y)} with the end points on the roads.
+        owners: set of the paths of the components whose roads can be used, all the roads if None.
+        source_costs: dictionary {road id: cost} added to the routes starting on a source road.
+        target_costs: dictionary {road id: cost} added to the routes ending on a target road.
+        return: a tuple (roads, junctions) where junctions[i] is the index of the junction between roads[i] and roads[i+1], or None if there is no route.
+        """
+        distance = lambda point1, point2: abs(point1[0] - point2[0]) + abs(point1[1] - point2[1])
+        heuristic = lambda point: min(distance(point, goal) for goal in targets.values())
+
+        # A node is (junction, road): at the junction on road. The junction is None at the start point of a source road and "goal" at the end point
+        costs = {}
+        parents = {}
+        pending = []
+        counter = itertools.count() # Tie-break of the queue, so the nodes are never compared
+        for road, point in sources.items():
+            node = (None, road)
+            costs[node] = self.get_occupancy_cost(road) + (source_costs or {}).get(road, 0)
+            parents[node] = None
+            heapq.heappush(pending, (costs[node] + heuristic(point), next(counter), node, point))
+
+        while pending:
+            estimate, order, node, point = heapq.heappop(pending)
+            junction, road = node
+            cost = costs[node]
+            if estimate > cost + heuristic(point):
+                continue # An old entry, the node was reached later with a lower cost
+            if junction == "goal":
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                path.reverse()
+                roads = [path[0][1]]
+                junctions = []
+                for previous, current in zip(path, path[1:]):
+                    if current[1] != previous[1]: # Crossed a junction
+                        junctions.append(current[0])
+                        roads.append(current[1])
+                return roads, junctions
+
+            moves = []
+            if road in targets:
+                moves.append((("goal", road), targets[road], distance(point, targets[road]) + (target_costs or {}).get(road, 0)))
+            for other in self.get_neighbour_junctions(road, junction, point):
+                other_point = self.get_junction_point(other)
+                moves.append(((other, road), other_point, distance(point, other_point)))
+            if junction is not None:
+                # Cross the junction to the other road
+                road1, road2 = self.junctions[junction][:2]
+                other_road = road2 if road == road1 else road1
+                if owners is None or self.owners[other_road] in owners:
+                    moves.append(((junction, other_road), point, BEND_COST + self.get_occupancy_cost(other_road)))
+
+            for next_node, next_point, step in moves:
+                next_cost = cost + step
+                if next_node not in costs or next_cost < costs[next_node]:
+                    costs[next_node] = next_cost
+                    parents[next_node] = node
+                    heapq.heappush(pending, (next_cost + heuristic(next_point), next(counter), next_node, next_point))
+        return None
+
+def get_road_graph(highway_map: dict) -> RoadGraph:
+    """
+    Returns the road graph of highway_map, it is built on the first call after the layout.
+    """
+    if "road_graph" not in highway_map:
+        highway_map["road_graph"] = RoadGraph(highway_map)
+    return highway_map["road_graph"]
+
+def get_face_center(rect, face: Dir):
+    """
+    Returns the center (x, y) of the face of the rectangle (x1, y1, x2, y2).
+    """
+    if face == Dir.UP:
+        return ((rect[0] + rect[2]) / 2, rect[1])
+    elif face == Dir.DOWN:
+        return ((rect[0] + rect[2]) / 2, rect[3])
+    elif face == Dir.LEFT:
+        return (rect[0], (rect[1] + rect[3]) / 2)
+    else: #face == Dir.RIGHT:
+        return (rect[2], (rect[1] + rect[3]) / 2)
+
+def get_address_roads(highway_map: dict, comp_path: str, rect) -> dict:
+    """
+    Returns the roads next to a component as a dictionary {road id: (face, center of the face)}.
+    """
+    return {road: (face, get_face_center(rect, face)) for face, road in highway_map.address_roads.get(comp_path, {}).items()}
+
+def allocate_border_point(highway_map: dict, comp_path: str, rect, face: Dir):
+    """
+    Allocates an address on the face of a component and returns its point (x, y) on the border.
+    """
+    center = get_face_center(rect, face)
+    if face == Dir.UP or face == Dir.DOWN:
+        x = csm.allocate_an_address_on_border(highway_map, comp_path, face, [(rect[0], rect[2])])
+        return (x if x is not None else int(center[0]), center[1])
+    y = csm.allocate_an_address_on_border(highway_map, comp_path, face, [(rect[1], rect[3])])
+    return (center[0], y if y is not None else int(center[1]))
+
+def get_lane_point(road_graph: RoadGraph, road: int, lane: int, position):
+    # Returns the point on the lane of road at the position along the road
+    if road_graph.orientations[road] == DirType.HORIZONTAL:
+        return (position, lane)
+    return (lane, position)
+
+def add_point(points: list, point, orientation: DirType):
+    # Adds point to the poly line, with a corner if it is not aligned with the last point. The first move follows the orientation of the road.
+    last = points[-1]
+    if last[0] != point[0] and last[1] != point[1]:
+        if orientation == DirType.HORIZONTAL:
+            points.append((point[0], last[1]))
+        else:
+            points.append((last[0], point[1]))
+    points.append(point)
+
+def simplify_points(points: list) -> list:
+    """
+    Returns the poly line without repeated points and without points in the middle of straight segments.
+    """
+    res = []
+    for point in points:
+        if len(res) > 0 and res[-1] == point:
+            continue
+        if len(res) > 1 and (res[-2][0] == res[-1][0] == point[0] or res[-2][1] == res[-1][1] == point[1]):
+            res[-1] = point
+            continue
+        res.append(point)
+    return res
+
+def get_owner_paths(comp) -> set:
+    """
+    Returns the paths of the owners of a component, following the owner links up to the architecture.
+    The paths are not split, the names of the components can contain "_".
+    """
+    res = set()
+    owner = comp.owner.ref if isinstance(comp.owner, pt.ObjectRef) else None
+    while owner is not None:
+        res.add(owner.path)
+        owner = owner.owner.ref if isinstance(owner.owner, pt.ObjectRef) else None
+    return res
+
+def route_with_roads(highway_map: dict, comp1, rect1, comp2, rect2) -> list:
+    """
+    Routes a connection between two components through the roads of highway_map with the cheapest route of the road graph.
+    Only the roads of the owners of the components are used, a connection does not go through other components.
+    The lanes of the roads and the addresses on the borders of both components are allocated for the connection.
+
+    highway_map: map generated by do_svg_architecture with absolute coordinates.
+    comp1: The first component of the connection, where the connection starts.
+    rect1: The absolute rectangle (x1, y1, x2, y2) of the first component.
+    comp2: The second component of the connection.
+    rect2: The absolute rectangle (x1, y1, x2, y2) of the second component.
+
+    return: the list of points (x, y) of the poly line, or empty if there is no route.
+    """
+    comp1_path = comp1.path
+    comp2_path = comp2.path
+    road_graph = get_road_graph(highway_map)
+    sources = get_address_roads(highway_map, comp1_path, rect1)
+    targets = get_address_roads(highway_map, comp2_path, rect2)
+    if len(sources) == 0 or len(targets) == 0:
+        return []
+    route = road_graph.find_route({road: value[1] for road, value in sources.items()}, {road: value[1] for road, value in targets.items()},
+                                  get_owner_paths(comp1) | get_owner_paths(comp2),
+                                  {road: road_graph.get_border_cost(comp1_path, value[0]) for road, value in sources.items()},
+                                  {road: road_graph.get_border_cost(comp2_path, value[0]) for road, value in targets.items()})
+    if route is None:
+        return []
+    roads, junctions = route
+
+    lanes = {}
+    for road in roads:
+        if road not in lanes:
+            lanes[road] = csm.allocate_a_road_lane(highway_map, road, True)
+
+    # From the border of the first component to its road
+    start = allocate_border_point(highway_map, comp1_path, rect1, sources[roads[0]][0])
+    points = [start]
+    position = road_graph.get_position(roads[0], start)
+    add_point(points, get_lane_point(road_graph, roads[0], lanes[roads[0]], position), DirType.VERTICAL if road_graph.orientations[roads[0]] == DirType.HORIZONTAL else DirType.HORIZONTAL)
+
+    # The point where each junction is crossed, as close as possible to the next crossing (or to the end), so it is computed from the end
+    end = allocate_border_point(highway_map, comp2_path, rect2, targets[roads[-1]][0])
+    crossing_points = []
+    next_point = end
+    for junction in reversed(junctions):
+        road1, road2, crossing, low, high, edge = road_graph.junctions[junction]
+        if crossing == DirType.VERTICAL:
+            next_point = (min(max(next_point[0], low), high), edge)
+        else:
+            next_point = (edge, min(max(next_point[1], low), high))
+        crossing_points.insert(0, next_point)
+
+    # Along the roads, crossing at each junction. A connection crosses at its current position when possible, to avoid bends
+    for road, next_road, point, junction in zip(roads, roads[1:], crossing_points, junctions):
+        road1, road2, crossing, low, high, edge = road_graph.junctions[junction]
+        current = points[-1]
+        if crossing == DirType.VERTICAL and low <= current[0] <= high:
+            point = (current[0], edge)
+        elif crossing == DirType.HORIZONTAL and low <= current[1] <= high:
+            point = (edge, current[1])
+        add_point(points, get_lane_point(road_graph, road, lanes[road], road_graph.get_position(road, point)), road_graph.orientations[road])
+        add_point(points, get_lane_point(road_graph, next_road, lanes[next_road], road_graph.get_position(next_road, point)), crossing)
+
+    # From the last road to the border of the second component
+    add_point(points, get_lane_point(road_graph, roads[-1], lanes[roads[-1]], road_graph.get_position(roads[-1], end)), road_graph.orientations[roads[-1]])
+    add_point(points, end, road_graph.orientations[roads[-1]])
+
+    return simplify_points(points)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import plantuml.plantuml_types as pt
+import plantuml.connection_state_manager as csm
+import plantuml.connection_routing as cr
+import plantuml.spatial_index as si
+import plantuml.routing_trace as trace
+from plantuml.connection_state_manager import Dir
+
+ROAD_ALLOCATIONS = ("lane", "road_overflow") # The kinds of recorded allocations done on a road
+
+class RouteCache:
+    """
+    Cache of the routes of the connections, reused between renderings of the same or of a slightly changed architecture.
+    A route is found by the name of its single connection and the paths and the absolute rectangles of its two components (in order), so the
+    connections between the same components keep their own routes. It is reused only if its neighbourhood is unchanged:
+        - The components intersecting the bounding box of the route and of its components have the same rectangles (the fingerprint).
+        - The roads used by the route have the same rectangles.
+        - The lanes, addresses and offroad lanes allocated by the route are still free.
+    A reused route does again its allocations in the highway_map instead of being routed again, so the following connections see the same state.
+    Only the poly lines are cached, the connections are always printed with the current layout style.
+    Usage: do_svg_architecture(arch, route_cache=cache), then cache.save() to keep the routes for the next run.
+
+    file_name: Optional json file, the routes are loaded from it if it exists and written to it by save.
+    """
+    def __init__(self, file_name: str|None = None):
+        self.file_name = file_name
+        self.routes = {}
+        self.hits = 0
+        self.misses = 0
+        if file_name is not None and os.path.exists(file_name):
+            self.load(file_name)
+
+    def get_key(self, name: str, comp1_path: str, rect1, comp2_path: str, rect2) -> str:
+        """
+        Returns the key of the route of the single connection name between two components with their absolute rectangles (x1, y1, x2, y2).
+        """
+        return f"{name}: {comp1_path} {list(rect1)} -> {comp2_path} {list(rect2)}"
+
+    def get_fingerprint(self, arch: pt.PlantumlArchitecture, region) -> str:
+        """
+        Returns a hash (hex string) of the paths and rectangles of the visible components intersecting region (x1, y1, x2, y2).
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        for obj, rect in si.get_spatial_index(arch, pt.PlantumlType).get_components_in_the_rect(region):
+            hasher.update(f"{obj.path}:{list(rect)}\n".encode())
+        return hasher.hexdigest()
+
+    def lookup(self, arch: pt.PlantumlArchitecture, highway_map: dict, name: str, comp1: pt.PlantumlType, comp2: pt.PlantumlType) -> list|None:
+        """
+        Returns the cached poly line of the route of the single connection name from comp1 to comp2 and does again its allocations in highway_map.
+        Returns None if there is no cached route or it cannot be reused, nothing is allocated then.
+        """
+        rect1 = cr.get_absolute_coordinates(arch, comp1)
+        rect2 = cr.get_absolute_coordinates(arch, comp2)
+        entry = self.routes.get(self.get_key(name, comp1.path, rect1, comp2.path, rect2))
+        res = None
+        allocations = self._get_reusable_allocations(arch, highway_map, entry) if entry is not None else None
+        if allocations is not None:
+            csm.replay_allocations(highway_map, allocations)
+            res = list(entry["points"])
+
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if trace.enabled:
+            trace.event("route_cache", res, comp1=comp1, comp2=comp2, hit=res is not None)
+        return res
+
+    def _get_reusable_allocations(self, arch, highway_map, entry):
+        # Returns the allocations of entry with the road ids of highway_map, or None if the route cannot be reused
+        roads = highway_map["roads"]["rects"]
+        for road, rect in entry["roads"].items():
+            if road not in roads or list(roads[road]) != rect:
+                return None
+        if self.get_fingerprint(arch, entry["region"]) != entry["fingerprint"]:
+            return None
+        allocations = get_road_allocations(entry["allocations"], highway_map.road_ids)
+        return allocations if csm.are_allocations_free(highway_map, allocations) else None
+
+    def store(self, arch: pt.PlantumlArchitecture, highway_map: dict, name: str, comp1: pt.PlantumlType, comp2: pt.PlantumlType, points: list, allocations: list[tuple]):
+        """
+        Stores the route of the single connection name (e.g. "Conn 1" or "Conn 1:0") from comp1 to comp2 routed in highway_map.
+        points: The poly line of the route, the routes without points are not stored.
+        allocations: The allocations done by the route, recorded with connection_state_manager.start_recording.
+        """
+        if len(points) == 0:
+            return
+        rect1 = cr.get_absolute_coordinates(arch, comp1)
+        rect2 = cr.get_absolute_coordinates(arch, comp2)
+        xs = [point[0] for point in points] + [rect1[0], rect1[2], rect2[0], rect2[2]]
+        ys = [point[1] for point in points] + [rect1[1], rect1[3], rect2[1], rect2[3]]
+        region = (min(xs), min(ys), max(xs), max(ys))
+        # The road ids depend on the layout, so the cached allocations keep the road names
+        allocations = get_road_allocations(allocations, highway_map.road_names)
+        roads = {}
+        for allocation in allocations:
+            if allocation[0] in ROAD_ALLOCATIONS:
+                roads[allocation[1]] = list(highway_map["roads"]["rects"][allocation[1]])
+        self.routes[self.get_key(name, comp1.path, rect1, comp2.path, rect2)] = {
+            "points": [tuple(point) for point in points],
+            "region": region,
+            "fingerprint": self.get_fingerprint(arch, region),
+            "roads": roads,
+            "allocations": list(allocations),
+            }
+
+    def clear(self):
+        """
+        Drops all the cached routes.
+        """
+        self.routes.clear()
+
+    def save(self, file_name: str|None = None):
+        """
+        Writes the cached routes to the json file file_name, or to the file of the cache if None.
+        """
+        file_name = file_name if file_name is not None else self.file_name
+        routes = {}
+        for key, entry in self.routes.items():
+            routes[key] = {**entry, "allocations": [[item.name if isinstance(item, Dir) else item for item in allocation] for allocation in entry["allocations"]]}
+        with open(file_name, "w") as file:
+            json.dump(routes, file)
+
+    def load(self, file_name: str):
+        """
+        Adds the routes of the json file file_name written by save to the cache.
+        """
+        with open(file_name) as file:
+            routes = json.load(file)
+        for key, entry in routes.items():
+            allocations = []
+            for allocation in entry["allocations"]:
+                if allocation[0] in ("border", "border_overflow"):
+                    allocation[2] = Dir[allocation[2]]
+                if allocation[0] in ("offroad_horizontal_lane", "offroad_vertical_lane"):
+                    allocation[1] = tuple(allocation[1])
+                allocations.append(tuple(allocation))
+            self.routes[key] = {
+                "points": [tuple(point) for point in entry["points"]],
+                "region": tuple(entry["region"]),
+                "fingerprint": entry["fingerprint"],
+                "roads": entry["roads"],
+                "allocations": allocations,
+                }
+
+def get_road_allocations(allocations: list[tuple], roads) -> list[tuple]:
+    """
+    Returns the recorded allocations (see connection_state_manager.stop_recording) with the road of each allocation on a road replaced by roads[road].
+    roads: highway_map.road_names to get the names of the roads from their ids, or highway_map.road_ids to get the ids from the names.
+    """
+    return [(allocation[0], roads[allocation[1]]) + tuple(allocation[2:]) if allocation[0] in ROAD_ALLOCATIONS else allocation for allocation in allocations]
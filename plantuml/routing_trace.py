@@ -0,0 +1,86 @@
+import json
+import time
+from collections import deque
+from enum import Enum
+
+# The trace is off by default, the helpers test this flag before building any event
+enabled = False
+
+_buffer = deque(maxlen=10000)
+_connection = None # Name of the connection being routed, added to every event
+
+def enable(capacity: int = 10000):
+    """
+    Turns the routing trace on. The events are kept in a ring buffer, the oldest events are dropped when it is full.
+    capacity: Maximum number of events kept.
+    """
+    global enabled, _buffer
+    if _buffer.maxlen != capacity:
+        _buffer = deque(_buffer, maxlen=capacity)
+    enabled = True
+
+def disable():
+    """
+    Turns the routing trace off, the events already recorded are kept.
+    """
+    global enabled
+    enabled = False
+
+def clear():
+    """
+    Drops all the recorded events.
+    """
+    _buffer.clear()
+
+def set_connection(name):
+    """
+    Sets the name of the connection being routed, it is recorded in the following events. None when no connection is being routed.
+    """
+    global _connection
+    _connection = name
+
+def event(query: str, result=None, **fields):
+    """
+    Records an event if the trace is enabled. The values are stored as they are and only converted when exported.
+    query: The name of the query or the routing step (e.g. the function name).
+    result: The result of the query, if any.
+    fields: Other values of the event (e.g. the arguments of the query or a duration in seconds).
+    """
+    if not enabled:
+        return
+    _buffer.append({"time": time.perf_counter(), "connection": _connection, "query": query, "result": result, **fields})
+
+def get_events() -> list[dict]:
+    """
+    Returns the recorded events, the oldest first.
+    """
+    return list(_buffer)
+
+def _to_json(value):
+    # Converts the values of an event into json types, the components are represented by their path
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, dict):
+        return {str(_to_json(key)): _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_to_json(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, type):
+        return value.__name__
+    if hasattr(value, "path"):
+        return value.path
+    return str(value)
+
+def to_json(indent=None) -> str:
+    """
+    Returns the recorded events as a json array.
+    """
+    return json.dumps([_to_json(item) for item in _buffer], indent=indent)
+
+def export_json(file_name: str, indent=None):
+    """
+    Writes the recorded events as a json array to the file file_name.
+    """
+    with open(file_name, "w") as file:
+        file.write(to_json(indent))
@@ -0,0 +1,199 @@
+import plantuml.plantuml_types as pt
+from plantuml.connection_state_manager import Dir
+
+class IntervalTree:
+    """
+    Static centered interval tree, it returns all the closed intervals [low, high] containing a value in O(log n + k).
+    intervals: list of tuples (low, high, item).
+    """
+    def __init__(self, intervals):
+        # Each node is a list [center, by_low, by_high, left, right]
+        self.root = None
+        if len(intervals) == 0:
+            return
+        self.root = [None, None, None, None, None]
+        pending = [(self.root, intervals)]
+        while pending:
+            node, node_intervals = pending.pop()
+            points = sorted(value for interval in node_intervals for value in interval[:2])
+            center = points[len(points)//2]
+            left = [interval for interval in node_intervals if interval[1] < center]
+            right = [interval for interval in node_intervals if interval[0] > center]
+            here = [interval for interval in node_intervals if interval[0] <= center <= interval[1]]
+            node[0] = center
+            node[1] = sorted(here, key=lambda interval: interval[0]) # Ascending low
+            node[2] = sorted(here, key=lambda interval: interval[1], reverse=True) # Descending high
+            if left:
+                node[3] = [None, None, None, None, None]
+                pending.append((node[3], left))
+            if right:
+                node[4] = [None, None, None, None, None]
+                pending.append((node[4], right))
+
+    def stab(self, value):
+        """
+        Returns the list of items whose interval contains value (low <= value <= high).
+        """
+        res = []
+        node = self.root
+        while node is not None:
+            center, by_low, by_high, left, right = node
+            if value < center:
+                for low, high, item in by_low:
+                    if low > value:
+                        break
+                    res.append(item)
+                node = left
+            elif value > center:
+                for low, high, item in by_high:
+                    if high < value:
+                        break
+                    res.append(item)
+                node = right
+            else:
+                res.extend(item for low, high, item in by_low)
+                break
+        return res
+
+    def overlap(self, low, high):
+        """
+        Returns the list of items whose interval intersects [low, high] (item low <= high and item high >= low).
+        """
+        res = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            center, by_low, by_high, left, right = pending.pop()
+            if high < center:
+                for item_low, item_high, item in by_low:
+                    if item_low > high:
+                        break
+                    res.append(item)
+                if left is not None:
+                    pending.append(left)
+            elif low > center:
+                for item_low, item_high, item in by_high:
+                    if item_high < low:
+                        break
+                    res.append(item)
+                if right is not None:
+                    pending.append(right)
+            else:
+                res.extend(item for item_low, item_high, item in by_low)
+                if left is not None:
+                    pending.append(left)
+                if right is not None:
+                    pending.append(right)
+        return res
+
+class SpatialIndex:
+    """
+    Index of the absolute rectangles of the visible components of a type, used by the routing to find the obstacles in a direction.
+    It is built from the table of absolute rectangles of the architecture (see PlantumlArchitecture.update_absolute_rects).
+    Like a search of the tree, a component inside a hidden or removed component is not considered, and when a component and
+    some of its children are found only the outermost one is returned.
+
+    arch: The architecture (PlantumlArchitecture) with the layout done.
+    component_type: The type of the components to be indexed.
+    """
+    def __init__(self, arch, component_type):
+        self.component_type = component_type
+        rects = arch.get_absolute_rects()
+
+        # Each entry is (order, obj, rect, indexed owners), order is the position in the walk of the tree
+        entries_by_obj = {}
+        rows = []
+        columns = []
+        for order, (obj, depth, owner) in enumerate(arch.walk(prune=lambda item: not item.is_visible())):
+            if not isinstance(obj, component_type):
+                continue
+            rect = rects.get(obj)
+            if rect is None or rect[2] is None:
+                continue
+            rect = (int(rect[0]), int(rect[1]), int(rect[2]), int(rect[3])) # Same as connection_routing.get_absolute_coordinates
+            indexed_owners = []
+            node = owner
+            while node is not None and node is not arch:
+                if node in entries_by_obj:
+                    indexed_owners.append(node)
+                node = node.owner.ref if isinstance(node.owner, pt.ObjectRef) else None
+            entry = (order, obj, rect, indexed_owners)
+            entries_by_obj[obj] = entry
+            rows.append((rect[1], rect[3], entry))
+            columns.append((rect[0], rect[2], entry))
+
+        self.rows = IntervalTree(rows) # Vertical ranges, crossed by horizontal rays
+        self.columns = IntervalTree(columns) # Horizontal ranges, crossed by vertical rays
+
+    def get_components_in_the_path(self, coord, dir):
+        """
+        Returns the components found from coord in the direction dir, in the same order as a search of the tree.
+        coord: a position (x, y) in absolute coordinates.
+        dir: Dir.RIGHT, Dir.LEFT, Dir.DOWN or Dir.UP.
+        """
+        if dir == Dir.RIGHT:
+            found = [entry for entry in self.rows.stab(coord[1]) if entry[2][0] > coord[0]]
+        elif dir == Dir.LEFT:
+            found = [entry for entry in self.rows.stab(coord[1]) if entry[2][2] < coord[0]]
+        elif dir == Dir.DOWN:
+            found = [entry for entry in self.columns.stab(coord[0]) if entry[2][1] > coord[1]]
+        else: #dir == Dir.UP:
+            found = [entry for entry in self.columns.stab(coord[0]) if entry[2][3] < coord[1]]
+
+        found = self._outermost(found)
+        found.sort(key=lambda entry: entry[0])
+        return [entry[1] for entry in found]
+
+    def get_components_in_the_span(self, span, coord, dir):
+        """
+        Returns the components found from a segment in the direction dir, sorted by distance (closest first).
+        It is the exact version of casting a ray from every point of the segment: every component whose projection intersects the span is found.
+        span: the range (low, high) of the segment, y range for Dir.RIGHT and Dir.LEFT, x range for Dir.DOWN and Dir.UP.
+        coord: position of the segment along dir, x for Dir.RIGHT and Dir.LEFT, y for Dir.DOWN and Dir.UP.
+        dir: Dir.RIGHT, Dir.LEFT, Dir.DOWN or Dir.UP.
+        """
+        if dir == Dir.RIGHT:
+            found = [entry for entry in self.rows.overlap(span[0], span[1]) if entry[2][0] > coord]
+            distance = lambda entry: entry[2][0] - coord
+        elif dir == Dir.LEFT:
+            found = [entry for entry in self.rows.overlap(span[0], span[1]) if entry[2][2] < coord]
+            distance = lambda entry: coord - entry[2][2]
+        elif dir == Dir.DOWN:
+            found = [entry for entry in self.columns.overlap(span[0], span[1]) if entry[2][1] > coord]
+            distance = lambda entry: entry[2][1] - coord
+        else: #dir == Dir.UP:
+            found = [entry for entry in self.columns.overlap(span[0], span[1]) if entry[2][3] < coord]
+            distance = lambda entry: coord - entry[2][3]
+
+        found = self._outermost(found)
+        found.sort(key=lambda entry: (distance(entry), entry[0]))
+        return [entry[1] for entry in found]
+
+    def get_components_in_the_rect(self, rect):
+        """
+        Returns the components whose rectangle intersects rect as tuples (component, rectangle), including the ones inside other components found, in the same order as a search of the tree.
+        rect: a rectangle (x1, y1, x2, y2) in absolute coordinates.
+        """
+        found = [entry for entry in self.rows.overlap(rect[1], rect[3]) if entry[2][0] <= rect[2] and entry[2][2] >= rect[0]]
+        found.sort(key=lambda entry: entry[0])
+        return [(entry[1], entry[2]) for entry in found]
+
+    def _outermost(self, found):
+        # Removes the entries with an owner also found
+        found_objs = set(entry[1] for entry in found)
+        return [entry for entry in found if not any(owner in found_objs for owner in entry[3])]
+
+def get_spatial_index(arch, component_type):
+    """
+    Returns the spatial index of the components of component_type in arch, it is built once per layout.
+    Returns None if the layout of the architecture is not done.
+    """
+    rects = arch.get_absolute_rects()
+    if rects is None:
+        return None
+    indexes = arch.__dict__.get("_spatial_indexes")
+    if indexes is None or indexes[0] is not rects: # A new layout was done
+        indexes = (rects, {})
+        arch.__dict__["_spatial_indexes"] = indexes
+    if component_type not in indexes[1]:
+        indexes[1][component_type] = SpatialIndex(arch, component_type)
+    return indexes[1][component_type]
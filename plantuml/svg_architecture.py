@@ -5,6 +5,8 @@ import io
 from pprint import pprint
 import plantuml.plantuml_types as pt
 import plantuml.connection_routing as cr
+import plantuml.connection_state_manager as csm
+import plantuml.negotiated_routing as nr
 import plantuml.common as c
 import inspect
 import math
@@ -90,31 +92,34 @@ def print_svg_comment(text_lines, x, y, width, height, line_to_x, line_to_y, tit
         for index, line in enumerate(text_lines):
             print_with_indent(f'<text x="{x+5}" y="{y+20+(title_font_size*index)}" font-family="{title_font_family}" font-size="{title_font_size}px" font-weight="bold">{line}</text>', indent)
 
-def get_all_connections(arch, connections, highway_map, layout_style: dict):
-    
-    def get_all_connections_recurrent(arch, obj, connections):
-        if isinstance(obj, pt.PlantumlContainer):
-           for name, value in inspect.getmembers(obj):
-                if isinstance(value, pt.PlantumlConnection):
-                    if value.is_visible():
-                        # Add this connection to the connections dictionary
-                        connections.update(cr.route_svg_comonnection(arch, value.name, value, highway_map, layout_style)) # New Method
-                        
-
-                elif isinstance(value, pt.PlantumlType):
-                    get_all_connections_recurrent(arch, value, connections)
-    
-    get_all_connections_recurrent(arch, arch, connections)
+def get_all_connections(arch, connections, highway_map, layout_style: dict, negotiated_routing=False, max_iterations=nr.MAX_ITERATIONS, time_budget=None):
+    # Returns the statistics of the negotiated routing (see negotiated_routing.route_connections), or None for a single pass
+    # The connections of a container are routed before the ones of its children
+    visible_connections = []
+    for obj, depth, owner in arch.walk(filter=pt.PlantumlContainer, include_self=True):
+        for value in obj.get_connections():
+            if value.is_visible():
+                visible_connections.append(value)
+
+    # The relations between the ends of all the connections are computed in one pass before routing
+    highway_map["relations"] = cr.get_connection_relations(arch, visible_connections)
+    if negotiated_routing == True:
+        routed, stats = nr.route_connections(arch, visible_connections, highway_map, layout_style, max_iterations, time_budget)
+        connections.update(routed)
+        return stats
+
+    for value in visible_connections:
+        # Add this connection to the connections dictionary
+        connections.update(cr.route_svg_comonnection(arch, value.name, value, highway_map, layout_style)) # New Method
+    return None
     
 def get_all_comments(obj, comments):
 
-    if isinstance(obj, pt.PlantumlType) and obj.is_visible():
-        if "note" in obj.metadata_dict:
-            lines, width, height = calculate_note_dim(obj.metadata_dict["note"])
-            comments.append([lines, obj, width, height])
-        for name, value in inspect.getmembers(obj):
-            if isinstance(value, pt.PlantumlType):
-                get_all_comments(value, comments)
+    if isinstance(obj, pt.PlantumlType):
+        for value, depth, owner in obj.walk(include_connections=True, include_self=True, prune=lambda item: not item.is_visible()):
+            if "note" in value.metadata_dict:
+                lines, width, height = calculate_note_dim(value.metadata_dict["note"])
+                comments.append([lines, value, width, height])
 
 def shift_to_right(x, width, target_x, right_most, margin=50):
     limit = min(target_x+width+margin, right_most)
@@ -265,38 +270,61 @@ def print_svg_rect(name: str, rect: list[int|float, int|float, int|float, int|fl
     print_with_indent(f'<rect x="{rect[0]}" y="{rect[1]}" width="{rect[2]}" height="{rect[3]}" fill="{fill}" stroke="{color}" stroke-width="1" fill-opacity="{fill_opacity}"/>')
     print_with_indent(f'<text x="{rect[0]+5}" y="{rect[1]+10}" font-family="Consolas" font-size="15px", fill="{color}" >{name}</text>')
     
+def get_usage_color(usage: float) -> str:
+    """
+    Returns the svg color of a usage for the heat map of the roads, from green (0, empty) to red (1 or more, full).
+    """
+    usage = min(max(usage, 0), 1)
+    return f"rgb({int(255 * usage)},{int(255 * (1 - usage))},0)"
+
+def print_road_usage(highway_map: dict, road_allocations: dict):
+    """
+    Draws the roads as a heat map of their usage, with the number of connections over the capacity of each road.
+    road_allocations: {road name: (connections, capacity)} returned in the stats of do_svg_architecture (see connection_state_manager.get_routing_stats).
+    """
+    for road, (connections, capacity) in road_allocations.items():
+        usage = connections / capacity if capacity > 0 else float(connections > 0)
+        color = get_usage_color(usage)
+        print_svg_rect(f"{connections}/{capacity}", highway_map["roads"]["rects"][road], color, color, "0.4")
+
 def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwargs):
     """
     This function creates a simple svg layout output representation of the architecture.
     
     This is an alternative to plantuml_architecture using SVG instead. It places the components always in a predictable orientation.
 
-    highway_map is a dictionary that is filled by the inner function recurrent_layout_sizing that contains the roads where connections can pass, the addresses of the componnets on the roads and the allocation of connections in the lanes of the road. A road can be main or secundary. Each component may have multiple lanes along the orientation of the component (row or column), the name of the road contains 3 parts separated by space: a charactyer stating if it is a main ('M') or secundary ('S'), the name of the component owning the lane, and an index starting on 0. Secundary roads are placed only in the beginning and at the end of a component to connect main roads. The dictionary has the following structure:
+    highway_map is a dictionary (a connection_state_manager.HighwayMap, that also indexes the roads by integer ids) that is filled by the inner function layout_sizing that contains the roads where connections can pass, the addresses of the componnets on the roads and the allocation of connections in the lanes of the road. A road can be main or secundary. Each component may have multiple lanes along the orientation of the component (row or column), the name of the road contains 3 parts separated by space: a charactyer stating if it is a main ('M') or secundary ('S'), the name of the component owning the lane, and an index starting on 0. Secundary roads are placed only in the beginning and at the end of a component to connect main roads. The dictionary has the following structure:
     - roads: Contains the definition and states of all lanes.
         - rects: The screen representation of a lane as a long rectangle.
         - orientations: The direction of the roads, HORIZONTAL or VERTICAL.
-        - allocations: Used to control the lane state (perpendicular position on a road) where a connection passes through.
+        - allocations: The offroad lanes where a connection passes outside of the roads. The lanes allocated on the roads are kept by road id (see HighwayMap.road_allocations).
     - addresses: Contains all the components with the information what are the lanes passing by and the allocations of the connections around the componnet.
     - final: Just lists all the lanes that are the last one (bottom most or left most) inside a component.
+    - relations: The geometry (rectangles, same row and column, directions) of the ends of each connection, computed in one batch by get_all_connections before routing.
+    - route_cache: The RouteCache given in the arguments, or None (see route_cache.RouteCache).
+    - congestion: The overflows of the roads and of the faces of the components, and the connections without a route (see connection_state_manager.get_congestion).
 
     Argumnets:
         plantuml_arch: A class of a PlantumlType type.
         layout_style: The layout style dictionary (E.g. pading, margin, fonts) expected for the dimensioning the layout.
-        kwargs: Optional key/value arguments (TBD).
+        kwargs: Optional key/value arguments:
+            - print_roads: True to draw the roads.
+            - print_road_usage: True to draw the roads as a heat map of their usage (see print_road_usage).
+            - negotiated_routing: True to route the connections again while roads or component faces are used above their capacity (see negotiated_routing.route_connections).
+            - routing_iterations: The maximum number of iterations of the negotiated routing.
+            - routing_time_budget: The maximum time in seconds of the negotiated routing, None for no limit.
+            - route_cache: A route_cache.RouteCache, the routes found in it are reused and the new ones are stored in it.
+
+    return: The statistics of the routing, a dictionary with the allocations per road and face, the failed allocations, the probes, the offroad
+    collisions and the unrouted connections (see connection_state_manager.get_routing_stats), plus negotiated_routing: the statistics of the
+    negotiated routing (see negotiated_routing.route_connections) or None if it was not used.
     """
     
-    highway_map = { # Creates a map of roads and streets for connection routing
-    "roads": { # Contains the definition and states of all lanes.
-        "rects": {}, # The screen representation of a lane as a long rectangle.
-        "orientations": {}, # The direction of the roads, HORIZONTAL or VERTICAL.
-        "allocations": {} # Used to control the lane state (perpendicular position on a road) where a connection passes through.
-        },
-    "addresses": {}, # Contains all the components with the information what are the lanes passing by and the allocations of the connections.
-    "final": [] # Just lists all the lanes that are the last one (bottom most or left most) inside a component.
-    }
-
-    def recurrent_layout_sizing(obj, orientation = Orientation.LEFT_RIGHT, indent=0):
-        # Creates the layout retangles of the architecture.
+    highway_map = csm.HighwayMap() # Creates a map of roads and streets for connection routing
+    highway_map["route_cache"] = kwargs.get("route_cache", None) # Routes reused between renderings, if given.
+
+    def layout_sizing(obj, orientation = Orientation.LEFT_RIGHT, indent=0):
+        # Creates the layout retangle of obj and places its children, their sizes shall be already computed.
         # All coordinates are relative to the parent component.
         # To get an absolute coordinates use get_absolute_pos or get_absolute_center from plantuml.connection_routing.
         # layout_style and highway_map are accessed using closure principle (captured from the parent function)
@@ -316,41 +344,25 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
         # Precedence of the orientation rules, from least to most priority: architecture arrow_dir, architecture svg_orientation, object svg_orientation.
         
         if orientation == Orientation.TOP_DOWN:
-            rect_min_u_len = 'rect_min_y_len'
-            rect_min_v_len = 'rect_min_x_len'
-            rect_u_pos = 'rect_y_pos'
-            rect_v_pos = 'rect_x_pos'
-            rect_u_len = 'rect_y_len'
-            rect_v_len = 'rect_x_len'
+            rect_min_u_len = 'min_y_len'
+            rect_min_v_len = 'min_x_len'
+            rect_u_pos = 'y_pos'
+            rect_v_pos = 'x_pos'
+            rect_u_len = 'y_len'
+            rect_v_len = 'x_len'
         else:
-            rect_min_u_len = 'rect_min_x_len'
-            rect_min_v_len = 'rect_min_y_len'
-            rect_u_pos = 'rect_x_pos'
-            rect_v_pos = 'rect_y_pos'
-            rect_u_len = 'rect_x_len'
-            rect_v_len = 'rect_y_len'
+            rect_min_u_len = 'min_x_len'
+            rect_min_v_len = 'min_y_len'
+            rect_u_pos = 'x_pos'
+            rect_v_pos = 'y_pos'
+            rect_u_len = 'x_len'
+            rect_v_len = 'y_len'
 
         #{"margin":20, "padding":20, "title-height": 50}
         if (isinstance(obj, pt.PlantumlType) or isinstance(obj, pt.ArchBreakLine))and not isinstance(obj, pt.PlantumlConnection) and obj.metadata_dict['remove'] == False:
         
-            # print_with_indent(f">>  {obj.name}: min dim=({obj.metadata_dict[rect_min_u_len]}, {obj.metadata_dict[rect_min_v_len]})", indent)
-            list_of_obj = inspect.getmembers(obj)
-            
-            #count how many valid children exists
-            valid_children_cont = 0
-            for key, child in list_of_obj:
-                if not isinstance(child, pt.PlantumlType) or isinstance(child, pt.PlantumlConnection):
-                    continue
-                valid_children_cont += 1
-        
-            # Recursively compute the actual sizes of all children first
-            if valid_children_cont != 0:
-                for key, child in list_of_obj:
-                    if not isinstance(child, pt.PlantumlType) or isinstance(child, pt.PlantumlConnection):
-                        continue
-                    inner_orientation=c.get_obj_prop(child, "svg_orientation", orientation)
-                    recurrent_layout_sizing(child, inner_orientation, indent+1)
-                
+            # print_with_indent(f">>  {obj.name}: min dim=({getattr(obj.layout, rect_min_u_len)}, {getattr(obj.layout, rect_min_v_len)})", indent)
+            if len(obj.get_children()) != 0:
                 margin = c.get_obj_prop(obj, 'margin', layout_style['margin'])
                 padding = c.get_obj_prop(obj, 'padding', layout_style['padding'])
                 title_height = c.get_obj_prop(obj, 'title-height', layout_style['title-height'])
@@ -378,16 +390,16 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                     road_w = current_v
                     road_h = current_u
                     addr_pos = [cr.Dir.LEFT, cr.Dir.RIGHT] # The two directions to the closest roads for a component address
-                    max_len_v  = max(obj.metadata_dict[rect_min_v_len], text_with + icon_space, (2*margin) + (2*padding) + (2*extra_margin))
-                    max_len_u = max(obj.metadata_dict[rect_min_u_len], (2*margin) + (2*padding) + (2*extra_margin) + title_height)
+                    max_len_v  = max(getattr(obj.layout, rect_min_v_len), text_with + icon_space, (2*margin) + (2*padding) + (2*extra_margin))
+                    max_len_u = max(getattr(obj.layout, rect_min_u_len), (2*margin) + (2*padding) + (2*extra_margin) + title_height)
                 else:
                     road_orientation = cr.DirType.HORIZONTAL
                     current_v += title_height
                     road_w = current_u
                     road_h = current_v
                     addr_pos = [cr.Dir.UP, cr.Dir.DOWN]
-                    max_len_u  = max(obj.metadata_dict[rect_min_u_len], text_with + icon_space, (2*margin) + (2*padding) + (2*extra_margin))
-                    max_len_v = max(obj.metadata_dict[rect_min_v_len], (2*margin) + (2*padding) + (2*extra_margin) + title_height)
+                    max_len_u  = max(getattr(obj.layout, rect_min_u_len), text_with + icon_space, (2*margin) + (2*padding) + (2*extra_margin))
+                    max_len_v = max(getattr(obj.layout, rect_min_v_len), (2*margin) + (2*padding) + (2*extra_margin) + title_height)
 
 
                 line_len_us = []
@@ -397,14 +409,13 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                 # Create first main road (Up or Left, depending on the orientation)
                 main_road_index = 0
                 road_name = f"M {obj.path} {main_road_index}"
-                local_roads_map = {"rects": {}, "orientations": {}, "allocations": {}}
+                local_roads_map = {"rects": {}, "orientations": {}}
                 road_x = 0
                 road_y = 0
                 local_roads_map["rects"][road_name] = [int(road_x), int(road_y), int(road_w), int(road_h)]
                 local_roads_map["orientations"][road_name] = road_orientation
-                local_roads_map["allocations"][road_name] = []
                 
-                for key, child in obj.__dict__.items(): # Use __dict__ to keep decl order
+                for child in obj.get_layout_items(): # Keeps decl order
                     
                     if isinstance(child, pt.ArchBreakLine):
                         current_u = margin + padding + extra_margin
@@ -429,21 +440,20 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                             road_h = (2*margin) + (2*extra_margin)
                         local_roads_map["rects"][road_name] = [int(road_x), int(road_y), int(road_w), int(road_h)]
                         local_roads_map["orientations"][road_name] = road_orientation
-                        local_roads_map["allocations"][road_name] = []
 
                         line_len_us = []
                         max_line_len_u = 0
                 
-                    if not isinstance(child, pt.PlantumlType) or isinstance(child, pt.PlantumlConnection):
+                    if isinstance(child, pt.ArchBreakLine):
                         continue
 
                     # print_with_indent(f" ----------------> Pos=({current_u}, {current_v}) of {child.name}", indent)
                     # # Set child's position
-                    child.metadata_dict[rect_u_pos] = current_u
-                    child.metadata_dict[rect_v_pos] = current_v
-                    line_len_us.append(child.metadata_dict[rect_v_len])
+                    setattr(child.layout, rect_u_pos, current_u)
+                    setattr(child.layout, rect_v_pos, current_v)
+                    line_len_us.append(getattr(child.layout, rect_v_len))
                     
-                    current_u += (child.metadata_dict[rect_u_len] + (2*margin) + (2*extra_margin))
+                    current_u += (getattr(child.layout, rect_u_len) + (2*margin) + (2*extra_margin))
                     max_line_len_u = max(line_len_us)
                     
                     max_len_u = max(max_len_u, current_u)# + margin + padding + extra_margin))
@@ -452,11 +462,11 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                     last_u = current_u
                     last_v = current_v
                     
-                    highway_map["addresses"][child.path] = {addr_pos[0]: f"M {obj.path} {main_road_index}", addr_pos[1]:f"M {obj.path} {main_road_index+1}", "allocarions": {cr.Dir.LEFT:[], cr.Dir.RIGHT:[], cr.Dir.UP:[], cr.Dir.DOWN:[] }}
+                    highway_map["addresses"][child.path] = {addr_pos[0]: f"M {obj.path} {main_road_index}", addr_pos[1]:f"M {obj.path} {main_road_index+1}", "allocarions": csm.new_border_allocations()}
 
                 # Save layout info inside the obj
-                obj.metadata_dict[rect_u_len] = max_len_u # Contains the inner components + internal margins and paddings
-                obj.metadata_dict[rect_v_len] = max_len_v # Contains the inner components + internal margins and paddings
+                setattr(obj.layout, rect_u_len, max_len_u) # Contains the inner components + internal margins and paddings
+                setattr(obj.layout, rect_v_len, max_len_v) # Contains the inner components + internal margins and paddings
                 obj.metadata_dict["title-font-family"] = layout_style["title-font-family"]
                 obj.metadata_dict["title-font-size"] = layout_style["title-font-size"]
 
@@ -479,7 +489,6 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                     road_h = padding + margin + extra_margin
                 local_roads_map["rects"][road_name] = [int(road_x), int(road_y), int(road_w), int(road_h)]
                 local_roads_map["orientations"][road_name] = road_orientation
-                local_roads_map["allocations"][road_name] = []
                 
                 highway_map["final"].append(road_name) # List of final road keys, because index is not enougth
 
@@ -491,9 +500,10 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
                         else:
                             road[2] = max_len_u
 
+                for index, key in enumerate(local_roads_map["rects"]): # The roads are added in index order
+                    highway_map.add_road(key, obj, index)
                 highway_map["roads"]["rects"].update(local_roads_map["rects"])
                 highway_map["roads"]["orientations"].update(local_roads_map["orientations"])
-                highway_map["roads"]["allocations"].update(local_roads_map["allocations"])
 
             else:
                 text_with = calculate_text_dim(obj.name, layout_style["title-font-size"])
@@ -502,32 +512,30 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
 
                 # Save layout info inside the obj
                 # If there are no children, the rectangle keeps its minimal dimensions
-                obj.metadata_dict["rect_x_len"] = max(obj.metadata_dict["rect_min_x_len"], text_with + icon_space)
-                obj.metadata_dict["rect_y_len"] = obj.metadata_dict["rect_min_y_len"]
+                obj.layout.x_len = max(obj.layout.min_x_len, text_with + icon_space)
+                obj.layout.y_len = obj.layout.min_y_len
                 obj.metadata_dict["title-font-family"] = layout_style["title-font-family"]
                 obj.metadata_dict["title-font-size"] = layout_style["title-font-size"]
                 
-    def recurrent_draw(obj, connections, indent):
+    def draw(obj, connections, indent):
         # Print all the svg commands to be embedded in html
+        # The containers open a svg group for their children, it is closed when the walk leaves the container
+        open_groups = [] # Depths of the open groups
         
-        path = ""
-        
-        for name, value in inspect.getmembers(obj):
-            if not inspect.isroutine(value) and not name.startswith('__'):
+        for value, depth, owner in obj.walk(prune=lambda item: item.metadata_dict['hide'] != False):
+            while open_groups and open_groups[-1] >= depth:
+                print_with_indent("</g>", indent + open_groups.pop() - 1)
 
-                if isinstance(value, pt.PlantumlType) and not isinstance(value, pt.PlantumlConnection) and value.metadata_dict['hide'] == False:# and is_container(value):
-                    print_svg_component(value.name, value, layout_style, indent)
+            print_svg_component(value.name, value, layout_style, indent + depth - 1)
 
-                    # TODO: Consider replace this list by some attribute 'is_container' or isinstance pt.PlantumlContainer
-                    if isinstance(value, pt.PlantumlContainer):
-                        if value.has_sub_objs():
-                            print_with_indent(f'<g transform="translate({value.metadata_dict["rect_x_pos"]}, {value.metadata_dict["rect_y_pos"]})">', indent)
-                            
-                    recurrent_draw(value, connections, indent+1)
+            # TODO: Consider replace this list by some attribute 'is_container' or isinstance pt.PlantumlContainer
+            if isinstance(value, pt.PlantumlContainer):
+                if value.has_sub_objs():
+                    print_with_indent(f'<g transform="translate({value.layout.x_pos}, {value.layout.y_pos})">', indent + depth - 1)
+                    open_groups.append(depth)
 
-                    if isinstance(value, pt.PlantumlContainer):
-                        if value.has_sub_objs():
-                            print_with_indent("</g>", indent)
+        while open_groups:
+            print_with_indent("</g>", indent + open_groups.pop() - 1)
 
     # print("\nSize\n-------------------------------------------------------------------------------\n")
     
@@ -538,28 +546,34 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
     orientation = c.get_obj_prop(plantuml_arch, "svg_orientation", orientation)
     highway_map[orientation] = orientation
     
-    recurrent_layout_sizing(plantuml_arch, orientation)
-    # Adjust the highway_map adding the absolute positions to the relative ones created by recurrent_layout_sizing
-    for key, road in highway_map["roads"]["rects"].items():
+    plantuml_arch.clear_absolute_rects() # The layout is recomputed
+    # The children inherit the orientation of their owner, so the orientations are set from the root down
+    remove = lambda item: item.metadata_dict['remove'] != False
+    orientations = {id(plantuml_arch): orientation}
+    for obj, depth, owner in plantuml_arch.walk(prune=remove):
+        orientations[id(obj)] = c.get_obj_prop(obj, "svg_orientation", orientations[id(owner)])
+    # The sizes of the children are needed to size their owner, so the objects are sized after their children
+    for obj, depth, owner in plantuml_arch.walk(order="post", include_self=True, prune=remove):
+        layout_sizing(obj, orientations[id(obj)], depth)
+    plantuml_arch.update_absolute_rects()
+    # Adjust the highway_map adding the absolute positions to the relative ones created by layout_sizing
+    for key, obj in zip(highway_map.road_names, highway_map.road_owners):
         # print(f" Adding offset to {key}")
-        # Split the string into a list of words
-        words = key.split()
-        obj = plantuml_arch.find_sub_obj_by_path_recursive(words[1])
-        if obj != None:
-            # print(f"   Object found name {obj.name}")
-            offset_x, offset_y = cr.get_absolute_pos(plantuml_arch, obj)
-            if offset_x != None and offset_y != None:
-                road[0] += offset_x
-                road[1] += offset_y
+        road = highway_map["roads"]["rects"][key]
+        offset_x, offset_y = cr.get_absolute_pos(plantuml_arch, obj)
+        if offset_x != None and offset_y != None:
+            road[0] += offset_x
+            road[1] += offset_y
+    highway_map.index_roads()
         
     comments = []
     get_all_comments(plantuml_arch, comments)
-    top_comments, bottom_comments = split_top_bottom_comments(plantuml_arch, comments, plantuml_arch.metadata_dict["rect_x_len"], plantuml_arch.metadata_dict["rect_y_len"])
+    top_comments, bottom_comments = split_top_bottom_comments(plantuml_arch, comments, plantuml_arch.layout.x_len, plantuml_arch.layout.y_len)
     top_comment_width, top_comment_height = calculate_comments_dim(top_comments)
     bottom_comment_width, bottom_comment_height = calculate_comments_dim(bottom_comments)
     
-    svg_height = plantuml_arch.metadata_dict["rect_y_len"] + top_comment_height + bottom_comment_height
-    svg_width = max(plantuml_arch.metadata_dict["rect_x_len"], top_comment_width, bottom_comment_width)
+    svg_height = plantuml_arch.layout.y_len + top_comment_height + bottom_comment_height
+    svg_width = max(plantuml_arch.layout.x_len, top_comment_width, bottom_comment_width)
 
     # print("\nSVG\n-------------------------------------------------------------------------------\n")
     
@@ -590,15 +604,21 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
     print_with_indent(f'<g transform="translate(0, {top_comment_height})">', 2)
     
     connections = {} # Use dictionary to avoid duplications
-    get_all_connections(plantuml_arch, connections, highway_map, layout_style)
+    routing_stats = get_all_connections(plantuml_arch, connections, highway_map, layout_style, kwargs.get("negotiated_routing", False),
+                                        kwargs.get("routing_iterations", nr.MAX_ITERATIONS), kwargs.get("routing_time_budget", None))
 
     print_svg_component(plantuml_arch.name, plantuml_arch, layout_style, 2)
-    recurrent_draw(plantuml_arch, connections, 3)
+    draw(plantuml_arch, connections, 3)
+
+    stats = csm.get_routing_stats(highway_map)
+    stats["negotiated_routing"] = routing_stats
 
     # # print all roads.
     if kwargs.get("print_roads", False) == True:
         for key, value in highway_map["roads"]["rects"].items():
             print_svg_rect(key, value)
+    if kwargs.get("print_road_usage", False) == True:
+        print_road_usage(highway_map, stats["road_allocations"])
 
 
     show_connections = True
@@ -621,3 +641,4 @@ def do_svg_architecture(plantuml_arch, layout_style=default_layout_style, **kwar
         print_svg_comment(comment[0], comment[6], comment[7], comment[2], comment[3], comment[4], comment[5]+ top_comment_height + c.get_obj_prop(comment[1], 'rect_y_len')/2)
 
     print(f'    </svg>')
+    return stats